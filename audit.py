@@ -0,0 +1,181 @@
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+from decouple import config
+
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+# Proporsi event INFO yang tetap dicatat (1.0 = semua); WARNING ke atas selalu dicatat
+LOG_INFO_SAMPLE_RATE = config("LOG_INFO_SAMPLE_RATE", default=1.0, cast=float)
+LOG_BATCH_SIZE = config("LOG_BATCH_SIZE", default=100, cast=int)
+LOG_FLUSH_INTERVAL = config("LOG_FLUSH_INTERVAL", default=1.0, cast=float)  # detik
+
+# Field tambahan yang ikut ditulis jika diberikan lewat argumen ``extra``
+AUDIT_FIELDS = ("event", "no_rekening", "nominal", "saldo", "latency_ms", "request_id")
+
+request_id_var: ContextVar = ContextVar("request_id", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format satu record log sebagai satu baris JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in AUDIT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Menyaring event INFO ke bawah secara acak sesuai rate; level lebih tinggi selalu lolos."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.INFO or self.rate >= 1.0 or random.random() < self.rate
+
+
+class RequestIdFilter(logging.Filter):
+    """Menempelkan request id dari context request yang sedang berjalan."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler yang menunda format pesan ke thread listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Queue hanya dipakai di dalam proses, jadi record tidak perlu diformat/di-pickle di sini
+        return record
+
+
+class BatchingHandler(MemoryHandler):
+    """Menulis ke target per batch: saat buffer penuh, ada error, atau interval flush terlewati."""
+
+    def __init__(self, capacity: int, flush_interval: float, target: logging.Handler):
+        super().__init__(capacity, flushLevel=logging.ERROR, target=target)
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        return super().shouldFlush(record) or time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self) -> None:
+        super().flush()
+        self._last_flush = time.monotonic()
+
+
+class BatchingQueueListener(QueueListener):
+    """QueueListener yang juga mem-flush handler batch saat antrean sepi: tanpa ini log
+    terakhir sebelum periode tanpa record baru tertahan di buffer sampai record berikutnya."""
+
+    def __init__(self, log_queue, *handlers, flush_interval: float, respect_handler_level: bool = False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval = flush_interval
+
+    def _monitor(self) -> None:
+        q = self.queue
+        has_task_done = hasattr(q, "task_done")
+        while True:
+            try:
+                record = q.get(timeout=self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+                continue
+            if record is self._sentinel:
+                if has_task_done:
+                    q.task_done()
+                break
+            self.handle(record)
+            if has_task_done:
+                q.task_done()
+
+
+_listener = None
+
+
+def setup_logging() -> None:
+    """Memasang pipeline log: root logger -> queue -> thread listener -> stderr (JSON, per batch)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+    batching_handler = BatchingHandler(LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    # Filter dijalankan di thread request: sampling dulu agar record yang dibuang tidak diproses lagi
+    queue_handler.addFilter(SamplingFilter(LOG_INFO_SAMPLE_RATE))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = BatchingQueueListener(log_queue, batching_handler, flush_interval=LOG_FLUSH_INTERVAL, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Menghentikan listener dan menulis sisa log yang masih di buffer."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.flush()
+    # Log setelah shutdown ditulis langsung (sinkron) agar tidak tertahan di queue tanpa listener
+    logging.getLogger().handlers[:] = [handler.target for handler in _listener.handlers]
+    _listener = None
+
+
+class RequestContextMiddleware:
+    """Middleware ASGI yang memberi setiap request sebuah request id (X-Request-ID)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-request-id", request_id.encode("latin-1")))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
@@ -1,25 +1,48 @@
+import hmac
 from fastapi import Request, HTTPException
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from .auth_handler import decode_jwt
+from fastapi.security import APIKeyHeader, HTTPBearer, HTTPAuthorizationCredentials
+from .auth_handler import decode_jwt_cached, is_dicabut, BACKOFFICE_API_KEY
 
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(JWTBearer, self).__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request):
+    async def __call__(self, request: Request) -> dict:
         credentials: HTTPAuthorizationCredentials = await super(JWTBearer, self).__call__(request)
         if credentials:
             if credentials.scheme.lower() != "bearer":
                 raise HTTPException(status_code=403, detail="Invalid authentication scheme.")
-            if not self.verify_jwt(credentials.credentials):
+            claims = self.decode_claims(credentials.credentials)
+            if not claims:
                 raise HTTPException(status_code=403, detail="Invalid token or expired token.")
-            return credentials.credentials
+            # Refresh token tidak boleh dipakai sebagai access token
+            if claims.get("type") != "access" or is_dicabut(claims):
+                raise HTTPException(status_code=403, detail="Invalid token or revoked token.")
+            # Klaim yang sudah terverifikasi dikembalikan agar handler tahu siapa pemanggilnya
+            return claims
         else:
             raise HTTPException(status_code=403, detail="Invalid authorization code.")
 
-    def verify_jwt(self, jwtoken: str) -> bool:
+    def decode_claims(self, jwtoken: str) -> dict:
         try:
-            payload = decode_jwt(jwtoken)
-            return payload is not None
-        except:
-            return False
+            return decode_jwt_cached(jwtoken)
+        except Exception:
+            return {}
+
+    def verify_jwt(self, jwtoken: str) -> bool:
+        return bool(self.decode_claims(jwtoken))
+
+
+class BackOfficeKey(APIKeyHeader):
+    """Kredensial terpisah untuk endpoint back-office (mis. ekspor massal); token nasabah
+    tidak berlaku. Tanpa BACKOFFICE_API_KEY endpoint tersebut nonaktif (pakai manage.py)."""
+
+    def __init__(self):
+        super(BackOfficeKey, self).__init__(name="X-Backoffice-Key", auto_error=False)
+
+    async def __call__(self, request: Request) -> None:
+        key = await super(BackOfficeKey, self).__call__(request)
+        if not BACKOFFICE_API_KEY:
+            raise HTTPException(status_code=403, detail="Back-office endpoint is disabled.")
+        if not key or not hmac.compare_digest(key.encode(), BACKOFFICE_API_KEY.encode()):
+            raise HTTPException(status_code=403, detail="Invalid back-office key.")
@@ -1,19 +1,75 @@
 import time
-from typing import Dict
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
 from passlib.context import CryptContext
 import jwt
 from decouple import config
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
 
 # Use default values if environment variables are not set
 JWT_SECRET = config("SECRET_KEY", default="04930637953893472aec5fc68bc8f57476e42d31e42a863eaeb21cb2cf957270")
 JWT_ALGORITHM = config("JWT_ALGORITHM", default="HS256")
 
+# Kredensial endpoint back-office (ekspor massal); kosong berarti endpoint tersebut nonaktif
+BACKOFFICE_API_KEY = config("BACKOFFICE_API_KEY", default="")
+
 # Token expiration times
 ACCESS_TOKEN_EXPIRE_MINUTES = 10  # Access token expires in 10 minutes
 REFRESH_TOKEN_EXPIRE_DAYS = 7  # Refresh token expires in 7 days
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Jumlah token terverifikasi yang disimpan agar token yang sering dipakai tidak di-decode ulang
+TOKEN_CACHE_SIZE = config("TOKEN_CACHE_SIZE", default=10_000, cast=int)
+_token_cache = OrderedDict()
+
+# jti token yang sudah dicabut (jti -> batas waktu simpan), diisi dari tabel token_dicabut
+REVOKASI_CACHE_SIZE = config("REVOKASI_CACHE_SIZE", default=100_000, cast=int)
+_jti_dicabut = OrderedDict()
+
+# Cost bcrypt; hash lama dengan cost lebih rendah akan di-rehash saat login berhasil
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", default=12, cast=int)
+
+# Pool untuk hashing password: "thread" (bcrypt melepas GIL) atau "process"
+PASSWORD_POOL_KIND = config("PASSWORD_POOL_KIND", default="thread")
+PASSWORD_POOL_WORKERS = config("PASSWORD_POOL_WORKERS", default=4, cast=int)
+# Jumlah maksimum permintaan yang boleh mengantre di luar worker yang sedang berjalan
+PASSWORD_POOL_QUEUE = config("PASSWORD_POOL_QUEUE", default=32, cast=int)
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS
+)
+
+# Pool dibuat saat pertama dipakai di setiap proses: pool yang dibuat di master gunicorn
+# (preload) akan ikut ter-fork, dan worker akan berbagi pipe ProcessPoolExecutor yang sama
+_password_executor = None
+_password_pid = None
+_password_slots = threading.BoundedSemaphore(PASSWORD_POOL_WORKERS + PASSWORD_POOL_QUEUE)
+
+
+def _password_pool():
+    global _password_executor, _password_pid, _password_slots
+    if _password_pid != os.getpid():
+        if PASSWORD_POOL_KIND == "process":
+            _password_executor = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS)
+        else:
+            _password_executor = ThreadPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, thread_name_prefix="bcrypt")
+        _password_slots = threading.BoundedSemaphore(PASSWORD_POOL_WORKERS + PASSWORD_POOL_QUEUE)
+        _password_pid = os.getpid()
+    return _password_executor
+
+
+class PasswordPoolBusy(Exception):
+    """Dilempar saat antrean hashing password sudah penuh."""
 
 def token_response(access_token: str, refresh_token: str) -> Dict[str, str]:
     return {
@@ -22,25 +78,33 @@ def token_response(access_token: str, refresh_token: str) -> Dict[str, str]:
     }
 
 def sign_jwt(user_id: str, nama: str, nik: str, no_hp: str, email: str) -> Dict[str, str]:
-    access_token_expires = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # Access token membawa jti refresh token pasangannya (sid) sehingga rotasi
+    # atau pencabutan refresh token ikut membatalkan access token yang sepasang
+    refresh_jti = uuid.uuid4().hex
+    access_token_expires = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token_payload = {
         "user_id": user_id,
         "nama": nama,
         "NIK": nik,
         "no_hp": no_hp,
         "email": email,
+        "type": "access",
+        "jti": uuid.uuid4().hex,
+        "sid": refresh_jti,
         "exp": access_token_expires.timestamp()
     }
     access_token = jwt.encode(access_token_payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
     # Create refresh token
-    refresh_token_expires = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    refresh_token_expires = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     refresh_token_payload = {
         "user_id": user_id,
         "nama": nama,
         "NIK": nik,
         "no_hp": no_hp,  # Fixed key name
         "email": email,
+        "type": "refresh",
+        "jti": refresh_jti,
         "exp": refresh_token_expires.timestamp()  # Use timestamp for expiration
     }
     refresh_token = jwt.encode(refresh_token_payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
@@ -48,34 +112,58 @@ def sign_jwt(user_id: str, nama: str, nik: str, no_hp: str, email: str) -> Dict[
     return token_response(access_token, refresh_token)
 
 def decode_jwt(token: str) -> dict:
+    # PyJWT sudah memvalidasi klaim "exp" sehingga tidak perlu dicek ulang secara manual
     try:
-        decoded_token = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        if datetime.fromtimestamp(decoded_token["exp"]) >= datetime.utcnow():
-            return decoded_token
-        else:
-            print("Token has expired.")
-            return {}
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["exp"]})
     except jwt.ExpiredSignatureError:
-        print("Token has expired.")
+        logger.info("Token has expired.")
         return {}
     except jwt.InvalidTokenError as e:
-        print(f"Invalid token error: {e}")
+        logger.warning("Invalid token error: %s", e)
         return {}
 
+def decode_jwt_cached(token: str) -> dict:
+    """Decode token dengan cache LRU; entri kedaluwarsa bersamaan dengan klaim exp token."""
+    claims = _token_cache.get(token)
+    if claims is not None:
+        if claims["exp"] > time.time():
+            _token_cache.move_to_end(token)
+            return claims
+        del _token_cache[token]
+
+    claims = decode_jwt(token)
+    if claims:
+        _token_cache[token] = claims
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return claims
+
+def cabut_jti(jti: str, sampai: float) -> None:
+    """Menandai jti sebagai dicabut di memori sampai waktu `sampai` (epoch detik)."""
+    sekarang = time.time()
+    _jti_dicabut[jti] = sampai
+    _jti_dicabut.move_to_end(jti)
+    # Entri tertua dibuang lebih dulu; yang sudah lewat batas memang tidak dibutuhkan lagi
+    while _jti_dicabut:
+        jti_lama, batas = next(iter(_jti_dicabut.items()))
+        if batas > sekarang and len(_jti_dicabut) <= REVOKASI_CACHE_SIZE:
+            break
+        if batas > sekarang:
+            logger.warning("Cache revokasi penuh; jti %s dibuang sebelum kedaluwarsa", jti_lama)
+        del _jti_dicabut[jti_lama]
+
+def is_dicabut(claims: dict) -> bool:
+    """Pengecekan O(1) di memori: token atau refresh token pasangannya sudah dicabut."""
+    return claims.get("jti") in _jti_dicabut or claims.get("sid") in _jti_dicabut
+
 def decode_refresh_token(token: str) -> dict:
     try:
-        decoded_token = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        # Ensure the refresh token is not expired
-        if datetime.fromtimestamp(decoded_token["exp"]) >= datetime.utcnow():
-            return decoded_token
-        else:
-            print("Refresh token has expired.")
-            return {}
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "jti"]})
     except jwt.ExpiredSignatureError:
-        print("Refresh token has expired.")
+        logger.info("Refresh token has expired.")
         return {}
     except jwt.InvalidTokenError as e:
-        print(f"Invalid refresh token error: {e}")
+        logger.warning("Invalid refresh token error: %s", e)
         return {}
 
 def get_password_hash(password: str) -> str:
@@ -84,9 +172,31 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # Mengembalikan hash baru jika hash lama perlu di-upgrade (mis. cost bcrypt naik)
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+async def _run_in_password_pool(func, *args):
+    executor = _password_pool()
+    slots = _password_slots
+    # Tolak langsung (tanpa menunggu) jika worker dan antrean sudah penuh
+    if not slots.acquire(blocking=False):
+        raise PasswordPoolBusy("Server sedang sibuk, silakan coba lagi")
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+    finally:
+        slots.release()
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_in_password_pool(get_password_hash, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run_in_password_pool(verify_and_update_password, plain_password, hashed_password)
+
 def create_access_token(data: dict) -> str:
     # Set expiration time to 10 minutes from now
-    expires = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expires = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode = data.copy()
     to_encode.update({"exp": expires.timestamp()})  # Use timestamp for expiration
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
@@ -0,0 +1,121 @@
+"""Mengukur riwayat mutasi satu rekening yang sangat panjang (diisi benchmark.run --riwayat,
+mis. 1 juta baris): latensi halaman /cekmutasi di awal, tengah, dan ujung riwayat, serta
+durasi dan puncak RSS saat seluruh riwayat dialirkan sebagai NDJSON (stream=true).
+
+Dijalankan sebagai proses tersendiri oleh benchmark.run agar puncak RSS hanya mencakup
+aplikasi dan pembacaan riwayat, bukan seed, atau langsung:
+python -m benchmark.riwayat <no_rekening>
+"""
+import asyncio
+import json
+import sys
+import time
+
+ULANG = 20
+
+
+def _memori_mb(kolom: str) -> float:
+    """VmRSS (saat ini) atau VmHWM (puncak) proses ini dari /proc (Linux). Berbeda dengan
+    ru_maxrss, VmHWM tidak mewarisi puncak proses induk yang menjalankan seed."""
+    with open("/proc/self/status") as status:
+        for baris in status:
+            if baris.startswith(kolom + ":"):
+                return round(int(baris.split()[1]) / 1024, 1)
+    return 0.0
+
+
+async def _stream(app, no_rekening: str, authorization: bytes) -> int:
+    """Memanggil aplikasi ASGI langsung dan menghitung baris NDJSON tanpa menyimpannya;
+    ASGITransport httpx menampung seluruh body sehingga puncak memorinya ikut terukur."""
+    baris = 0
+    diterima = False
+
+    async def receive():
+        nonlocal diterima
+        if not diterima:
+            diterima = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Klien tidak pernah memutus koneksi selama streaming
+        await asyncio.Event().wait()
+
+    async def send(pesan):
+        nonlocal baris
+        if pesan["type"] == "http.response.start" and pesan["status"] != 200:
+            raise RuntimeError(f"Streaming mutasi gagal: HTTP {pesan['status']}")
+        if pesan["type"] == "http.response.body":
+            baris += pesan.get("body", b"").count(b"\n")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/cekmutasi", "raw_path": b"/cekmutasi", "root_path": "",
+        "query_string": f"no_rekening={no_rekening}&stream=true".encode(),
+        "headers": [(b"host", b"riwayat"), (b"authorization", authorization)],
+        "client": ("127.0.0.1", 5000), "server": ("riwayat", 80)
+    }
+    await app(scope, receive, send)
+    return baris
+
+
+def _cursor_pada(no_rekening: str, posisi: int) -> str:
+    """Cursor keyset yang menunjuk baris ke-posisi (terbaru lebih dulu)."""
+    from config import engine
+    import crud
+
+    with engine.connect() as conn:
+        baris = conn.execute(crud._mutasi_query(no_rekening).offset(posisi).limit(1)).one()
+    return crud.encode_cursor(baris)
+
+
+async def _ukur(no_rekening: str) -> dict:
+    import httpx
+    from sqlalchemy import func, select
+    from auth.auth_handler import sign_jwt
+    from config import engine
+    from main import app
+    from model import Mutasi
+
+    with engine.connect() as conn:
+        jumlah = conn.execute(select(func.count()).select_from(Mutasi).where(Mutasi.no_rekening == no_rekening)).scalar_one()
+    posisi = {"first_page": None, "middle_page": _cursor_pada(no_rekening, jumlah // 2), "last_page": _cursor_pada(no_rekening, max(jumlah - 50, 0))}
+    headers = {"Authorization": f"Bearer {sign_jwt('riwayat', 'bench', 'riwayat', 'riwayat', 'riwayat@bench.local')['access_token']}"}
+
+    hasil = {"rows": jumlah}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://riwayat", headers=headers, timeout=None) as client:
+        for nama, cursor in posisi.items():
+            params = {"no_rekening": no_rekening, "limit": 50, **({"cursor": cursor} if cursor else {})}
+            latensi = []
+            for _ in range(ULANG + 1):
+                mulai = time.perf_counter()
+                response = await client.get("/cekmutasi", params=params)
+                latensi.append(time.perf_counter() - mulai)
+                response.raise_for_status()
+            # Request pertama (koneksi dan cache halaman database masih dingin) tidak dihitung
+            latensi = sorted(latensi[1:])
+            hasil[f"{nama}_p50_ms"] = round(latensi[len(latensi) // 2] * 1000, 3)
+            hasil[f"{nama}_p95_ms"] = round(latensi[int(len(latensi) * 0.95)] * 1000, 3)
+
+    rss_awal = _memori_mb("VmRSS")
+    mulai = time.perf_counter()
+    baris = await _stream(app, no_rekening, headers["Authorization"].encode())
+    durasi = time.perf_counter() - mulai
+
+    from config import async_engine, read_async_engine
+    await async_engine.dispose()
+    await read_async_engine.dispose()
+    hasil.update({
+        "stream_rows": baris,
+        "stream_seconds": round(durasi, 3),
+        "stream_rows_per_s": round(baris / durasi, 1) if durasi else 0.0,
+        "rss_before_stream_mb": rss_awal,
+        "peak_rss_mb": _memori_mb("VmHWM")
+    })
+    return hasil
+
+
+def main():
+    print(json.dumps(asyncio.run(_ukur(sys.argv[1]))))
+
+
+if __name__ == "__main__":
+    main()
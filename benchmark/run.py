@@ -0,0 +1,476 @@
+"""Benchmark beban untuk API bank.
+
+Database di-seed dengan bulk insert, lalu setiap skenario endpoint dijalankan
+dengan sejumlah request paralel dan dilaporkan p50/p95/p99 serta RPS-nya.
+Aplikasi bisa dijalankan di dalam proses (httpx + ASGI, sekaligus melaporkan
+waktu CPU per request) atau sebagai proses uvicorn sungguhan. Hasil bisa
+disimpan sebagai baseline dan dibandingkan pada run berikutnya dengan ambang
+regresi.
+
+Contoh:
+    python -m benchmark.run --nasabah 1000 --mutasi 100000 --requests 500
+    python -m benchmark.run --riwayat 1000000 --skenario cekmutasi --tanpa-ekspor
+    python -m benchmark.run --target uvicorn --workers 4 --simpan-baseline
+    DATABASE_URL=postgresql://... python -m benchmark.run --reset --threshold 0.1
+
+Pengaturan aplikasi lain tetap dibaca dari environment, mis. BCRYPT_ROUNDS,
+LOG_LEVEL atau LOG_INFO_SAMPLE_RATE untuk mengukur overhead logging.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+SKENARIO = ("daftar", "login", "refresh", "tabung", "tarik", "transfer", "ceksaldo", "cekmutasi")
+PASSWORD = "bench123"
+# Anggaran overhead rate limiter per request
+BATAS_OVERHEAD_RATE_LIMIT_US = 10
+# Anggaran overhead pemeriksaan limit velocity per debit (penghitung sudah di memori)
+BATAS_OVERHEAD_VELOCITY_US = 10
+
+
+def persentil(nilai_urut: list, p: float) -> float:
+    if not nilai_urut:
+        return 0.0
+    index = min(len(nilai_urut) - 1, int(round(p / 100 * (len(nilai_urut) - 1))))
+    return nilai_urut[index]
+
+
+def ringkas(latensi: list, gagal: int, durasi: float, cpu: float = None) -> dict:
+    latensi = sorted(latensi)
+    hasil = {
+        "requests": len(latensi),
+        "errors": gagal,
+        "rps": round(len(latensi) / durasi, 2) if durasi else 0.0,
+        "p50_ms": round(persentil(latensi, 50) * 1000, 3),
+        "p95_ms": round(persentil(latensi, 95) * 1000, 3),
+        "p99_ms": round(persentil(latensi, 99) * 1000, 3)
+    }
+    if cpu is not None and latensi:
+        hasil["cpu_ms_per_req"] = round(cpu / len(latensi) * 1000, 3)
+    return hasil
+
+
+class Konteks:
+    """Data bersama antar skenario: jumlah nasabah hasil seed dan header token."""
+
+    def __init__(self, jumlah_nasabah: int):
+        self.jumlah_nasabah = jumlah_nasabah
+        self.headers = {}
+        self.daftar_berikutnya = jumlah_nasabah + 1
+
+    def rekening_acak(self) -> str:
+        from rekening import format_no_rekening
+        return format_no_rekening(random.randint(1, self.jumlah_nasabah))
+
+
+def buat_request(nama: str, ctx: Konteks):
+    """Mengembalikan (method, url, kwargs) untuk satu request skenario."""
+    from benchmark.seed import data_nasabah
+
+    if nama == "daftar":
+        data = data_nasabah(ctx.daftar_berikutnya)
+        ctx.daftar_berikutnya += 1
+        data.pop("no_rekening")
+        return "POST", "/daftar", {"json": {**data, "password": PASSWORD}}
+    if nama == "login":
+        # Bergantian memakai ketiga identitas login agar semua index unik ikut terukur
+        data = data_nasabah(random.randint(1, ctx.jumlah_nasabah))
+        username = data[random.choice(("email", "no_hp", "no_rekening"))]
+        return "POST", "/login", {"json": {"username": username, "password": PASSWORD}}
+    if nama == "refresh":
+        # Refresh token dibuat di sisi klien (secret sama) karena tiap token hanya bisa ditukar sekali
+        from auth.auth_handler import sign_jwt
+        index = random.randint(1, ctx.jumlah_nasabah)
+        data = data_nasabah(index)
+        token = sign_jwt(str(index), data["nama"], data["nik"], data["no_hp"], data["email"])["refresh_token"]
+        return "POST", "/refresh", {"json": {"refresh_token": token}}
+    if nama == "tabung":
+        return "POST", "/tabung", {"json": {"no_rekening": ctx.rekening_acak(), "nominal": "50000.00"}, "headers": ctx.headers}
+    if nama == "tarik":
+        return "POST", "/tarik", {"json": {"no_rekening": ctx.rekening_acak(), "nominal": "1000.00"}, "headers": ctx.headers}
+    if nama == "transfer":
+        pengirim = ctx.rekening_acak()
+        penerima = ctx.rekening_acak()
+        while ctx.jumlah_nasabah > 1 and penerima == pengirim:
+            penerima = ctx.rekening_acak()
+        return "POST", "/transfer", {"json": {"no_rekening_pengirim": pengirim, "no_rekening_penerima": penerima, "nominal": "1000.00"}, "headers": ctx.headers}
+    if nama == "ceksaldo":
+        return "GET", "/ceksaldo", {"params": {"no_rekening": ctx.rekening_acak()}, "headers": ctx.headers}
+    if nama == "cekmutasi":
+        return "GET", "/cekmutasi", {"params": {"no_rekening": ctx.rekening_acak(), "limit": 50}, "headers": ctx.headers}
+    raise ValueError(f"Skenario tidak dikenal: {nama}")
+
+
+async def jalankan_skenario(client, nama: str, ctx: Konteks, jumlah: int, concurrency: int, ukur_cpu: bool = False) -> dict:
+    """Menjalankan satu skenario; dengan ukur_cpu, waktu CPU proses (aplikasi + klien
+    httpx, thread pool bcrypt termasuk) dibagi rata per request."""
+    latensi = []
+    gagal = 0
+    # Satu iterator dibagi ke semua worker sehingga total request tepat `jumlah`
+    antrian = iter(range(jumlah))
+
+    async def worker():
+        nonlocal gagal
+        for _ in antrian:
+            method, url, kwargs = buat_request(nama, ctx)
+            mulai = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latensi.append(time.perf_counter() - mulai)
+            if response.status_code >= 300:
+                gagal += 1
+
+    mulai = time.perf_counter()
+    cpu_mulai = time.process_time()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    cpu = time.process_time() - cpu_mulai if ukur_cpu else None
+    return ringkas(latensi, gagal, time.perf_counter() - mulai, cpu)
+
+
+async def ambil_token(client, ctx: Konteks) -> None:
+    response = await client.post("/login", json={"username": "bench1@bench.local", "password": PASSWORD})
+    response.raise_for_status()
+    ctx.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def ukur_ekspor() -> dict:
+    """Throughput ekspor CSV seluruh mutasi lewat server-side cursor."""
+    import ekspor
+    from config import ReadSessionLocal
+
+    jumlah_byte = 0
+    jumlah_baris = -1  # baris header tidak dihitung
+    mulai = time.perf_counter()
+    async with ReadSessionLocal() as session:
+        async for chunk in ekspor.ekspor_csv(session):
+            jumlah_byte += len(chunk)
+            jumlah_baris += chunk.count(b"\n")
+    durasi = time.perf_counter() - mulai
+    return {"rows": jumlah_baris, "bytes": jumlah_byte, "seconds": round(durasi, 3), "rows_per_s": round(jumlah_baris / durasi, 1) if durasi else 0.0}
+
+
+async def ukur_rate_limit(jumlah: int = 200_000) -> dict:
+    """Overhead rate limiter per request (memory store): aplikasi kosong dengan dan tanpa
+    middleware, memakai route dengan kunci per IP dan per pengguna (access token) (/ceksaldo)."""
+    from auth.auth_handler import sign_jwt
+    from ratelimit import Aturan, Batas, MemoryStore, RateLimitMiddleware
+
+    async def aplikasi(scope, receive, send):
+        pass
+
+    # Batas sangat longgar agar yang diukur hanya jalur request yang diizinkan
+    middleware = RateLimitMiddleware(aplikasi, MemoryStore(), {"/ceksaldo": Aturan(Batas(1e9, 10**9), Batas(1e9, 10**9))})
+    scopes = [
+        {"type": "http", "method": "GET", "path": "/ceksaldo", "client": (f"10.0.{i // 256 % 256}.{i % 256}", 5000),
+         "query_string": f"no_rekening={i:016d}".encode(),
+         "headers": [(b"authorization", f"Bearer {sign_jwt(str(i), 'bench', str(i), str(i), f'{i}@bench')['access_token']}".encode())]}
+        for i in range(1000)
+    ]
+
+    async def ukur(app) -> float:
+        mulai = time.perf_counter()
+        for i in range(jumlah):
+            await app(scopes[i % 1000], None, None)
+        return time.perf_counter() - mulai
+
+    await ukur(middleware)  # pemanasan
+    dasar = await ukur(aplikasi)
+    dengan = await ukur(middleware)
+    return {"requests": jumlah, "overhead_us": round((dengan - dasar) / jumlah * 1e6, 3)}
+
+
+async def ukur_velocity(jumlah_rekening: int = 100_000, jumlah: int = 200_000) -> dict:
+    """Overhead limit velocity per debit dengan penghitung untuk banyak rekening aktif di memori:
+    muat (cache hit) + cadangkan, dibandingkan dengan loop kosong. Juga memori per rekening."""
+    import tracemalloc
+    import velocity
+
+    # Limit sangat longgar agar yang diukur hanya jalur debit yang diizinkan
+    jendela = tuple(j._replace(maks_nominal=10**18, maks_jumlah=10**9) for j in velocity.JENDELA)
+    nomor = [f"{i:016d}" for i in range(jumlah_rekening)]
+    slot = int(time.time() // velocity.VELOCITY_RESOLUSI)
+    tracemalloc.start()
+    sebelum = tracemalloc.get_traced_memory()[0]
+    for no in nomor:
+        penghitung = velocity.Penghitung(jendela)
+        # Riwayat beberapa debit dalam sehari terakhir per rekening
+        for mundur in (600, 120, 30, 5, 0):
+            penghitung.tambah(slot - mundur, 100_000)
+        velocity._pasang(no, penghitung)
+    memori = tracemalloc.get_traced_memory()[0] - sebelum
+    tracemalloc.stop()
+
+    urutan = [random.choice(nomor) for _ in range(10_000)]
+    # Pengganti nasabah.jumlah_debit yang di aplikasi dibaca dari baris yang terkunci
+    jumlah_debit = dict.fromkeys(nomor, 0)
+
+    async def ukur(dengan_velocity: bool) -> float:
+        reservasi = []
+        mulai = time.perf_counter()
+        for i in range(jumlah):
+            no = urutan[i % 10_000]
+            if dengan_velocity:
+                penghitung = await velocity.muat(None, {no: jumlah_debit[no]})
+                velocity.cadangkan(penghitung, no, 100_000, reservasi)
+                jumlah_debit[no] += 1
+                reservasi.clear()
+        return time.perf_counter() - mulai
+
+    await ukur(True)  # pemanasan
+    dasar = await ukur(False)
+    dengan = await ukur(True)
+    velocity._penghitung.clear()
+    return {
+        "accounts": jumlah_rekening,
+        "checks": jumlah,
+        "overhead_us": round((dengan - dasar) / jumlah * 1e6, 3),
+        "bytes_per_account": round(memori / jumlah_rekening)
+    }
+
+
+async def tunggu_outbox(batas_waktu: float = 60.0) -> dict:
+    """Menunggu dispatcher (di lifespan) menguras outbox, lalu melaporkan lag pengirimannya."""
+    import outbox
+    from sqlalchemy import func, select
+    from config import AsyncSessionLocal
+    from model import Outbox
+
+    batas = time.monotonic() + batas_waktu
+    while time.monotonic() < batas:
+        async with AsyncSessionLocal() as session:
+            sisa = (await session.execute(select(func.count()).select_from(Outbox))).scalar_one()
+            await session.commit()
+        if not sisa:
+            break
+        await asyncio.sleep(0.2)
+    stats = outbox.stats()
+    return {
+        "events": stats["terkirim"],
+        "pending": sisa,
+        "avg_lag_ms": round(stats["lag_total"] / stats["terkirim"] * 1000, 1) if stats["terkirim"] else 0.0
+    }
+
+
+def ukur_startup(ulang: int = 5) -> dict:
+    """Median waktu startup worker (lihat benchmark.startup) dari beberapa proses baru."""
+    hasil = []
+    for _ in range(ulang):
+        keluaran = subprocess.run(
+            [sys.executable, "-m", "benchmark.startup"],
+            cwd=ROOT, env=os.environ.copy(), capture_output=True, text=True, check=True
+        ).stdout
+        hasil.append(json.loads(keluaran.strip().splitlines()[-1]))
+    return {kolom: sorted(h[kolom] for h in hasil)[len(hasil) // 2] for kolom in hasil[0]}
+
+
+def ukur_riwayat(no_rekening: str) -> dict:
+    """Latensi halaman dan puncak RSS streaming riwayat panjang (lihat benchmark.riwayat),
+    di proses baru agar memori seed tidak ikut terhitung."""
+    keluaran = subprocess.run(
+        [sys.executable, "-m", "benchmark.riwayat", no_rekening],
+        cwd=ROOT, env=os.environ.copy(), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(keluaran.strip().splitlines()[-1])
+
+
+def cek_konservasi() -> dict:
+    """Total saldo semua rekening harus sama dengan total kredit dikurangi debit di mutasi."""
+    from sqlalchemy import case, func, select
+    from config import engine
+    from model import Nasabah, Mutasi
+
+    with engine.connect() as conn:
+        total_saldo = conn.execute(select(func.coalesce(func.sum(Nasabah.saldo), 0))).scalar_one()
+        total_mutasi = conn.execute(select(func.coalesce(func.sum(
+            case((Mutasi.jenis_transaksi == "kredit", Mutasi.nominal), else_=-Mutasi.nominal)
+        ), 0))).scalar_one()
+    return {"total_saldo_sen": int(total_saldo), "total_mutasi_sen": int(total_mutasi), "cocok": int(total_saldo) == int(total_mutasi)}
+
+
+def port_bebas() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def tunggu_siap(client, batas_waktu: float = 30.0) -> None:
+    batas = time.monotonic() + batas_waktu
+    while True:
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except Exception:
+            if time.monotonic() > batas:
+                raise
+        await asyncio.sleep(0.2)
+
+
+async def benchmark(args) -> dict:
+    import httpx
+
+    ctx = Konteks(args.nasabah)
+    hasil = {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async def jalankan_semua(client):
+        await ambil_token(client, ctx)
+        for nama in args.skenario:
+            # CPU hanya bermakna jika aplikasi berjalan di proses yang sama
+            hasil[nama] = await jalankan_skenario(client, nama, ctx, args.requests, args.concurrency, ukur_cpu=args.target == "asgi")
+            logging.warning("Skenario %s selesai: %s", nama, hasil[nama])
+
+    if args.target == "asgi":
+        import main
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+                await jalankan_semua(client)
+            hasil["outbox"] = await tunggu_outbox()
+    else:
+        port = port_bebas()
+        proses = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=ROOT, env=os.environ.copy()
+        )
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+                await tunggu_siap(client)
+                await jalankan_semua(client)
+        finally:
+            proses.terminate()
+            proses.wait(timeout=30)
+
+    if args.ekspor:
+        hasil["ekspor"] = await ukur_ekspor()
+    hasil["rate_limit"] = await ukur_rate_limit()
+    hasil["velocity"] = await ukur_velocity()
+
+    from config import async_engine, read_async_engine
+    await async_engine.dispose()
+    await read_async_engine.dispose()
+    return hasil
+
+
+def bandingkan(hasil: dict, baseline: dict, threshold: float) -> list:
+    """Daftar regresi: p95 naik atau RPS turun melebihi threshold (relatif)."""
+    regresi = []
+    for nama, sekarang in hasil.items():
+        dasar = baseline.get(nama)
+        if not dasar or "p95_ms" not in dasar:
+            continue
+        if sekarang["p95_ms"] > dasar["p95_ms"] * (1 + threshold):
+            regresi.append(f"{nama}: p95 {sekarang['p95_ms']} ms > baseline {dasar['p95_ms']} ms")
+        if sekarang["rps"] < dasar["rps"] * (1 - threshold):
+            regresi.append(f"{nama}: rps {sekarang['rps']} < baseline {dasar['rps']}")
+        if "cpu_ms_per_req" in dasar and sekarang.get("cpu_ms_per_req", 0) > dasar["cpu_ms_per_req"] * (1 + threshold):
+            regresi.append(f"{nama}: cpu {sekarang['cpu_ms_per_req']} ms/req > baseline {dasar['cpu_ms_per_req']} ms/req")
+    return regresi
+
+
+def cetak(hasil: dict) -> None:
+    print(f"{'skenario':<10} {'req':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cpu ms':>9}")
+    for nama, r in hasil.items():
+        if "p95_ms" in r:
+            print(f"{nama:<10} {r['requests']:>7} {r['errors']:>5} {r['rps']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r.get('cpu_ms_per_req', '-'):>9}")
+        else:
+            print(f"{nama:<10} {json.dumps(r)}")
+
+
+def siapkan_environment(args) -> None:
+    """Environment harus diisi sebelum modul aplikasi (config) di-import."""
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    elif "DATABASE_URL" not in os.environ:
+        path = Path(tempfile.mkdtemp(prefix="bench-")) / "bench.db"
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        args.reset = True
+    # Semua request benchmark datang dari satu IP; rate limiter diukur terpisah
+    os.environ.setdefault("RATE_LIMIT", "false")
+    os.environ.setdefault("OUTBOX_FILE", str(Path(tempfile.mkdtemp(prefix="bench-outbox-")) / "outbox.jsonl"))
+    database_url = os.environ["DATABASE_URL"]
+    if database_url.startswith("sqlite://") and "ASYNC_DATABASE_URL" not in os.environ:
+        os.environ["ASYNC_DATABASE_URL"] = database_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark beban API bank")
+    parser.add_argument("--target", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--workers", type=int, default=1, help="Jumlah worker uvicorn")
+    parser.add_argument("--database-url", help="Default: DATABASE_URL, atau file SQLite sementara")
+    parser.add_argument("--reset", action="store_true", help="Hapus dan buat ulang semua tabel sebelum seed")
+    parser.add_argument("--nasabah", type=int, default=1000)
+    parser.add_argument("--mutasi", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=500, help="Jumlah request per skenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--skenario", nargs="+", choices=SKENARIO, default=list(SKENARIO))
+    parser.add_argument("--riwayat", type=int, default=0, help="Tambah satu rekening dengan riwayat sepanjang ini (mis. 1000000) lalu ukur")
+    parser.add_argument("--tanpa-ekspor", dest="ekspor", action="store_false", help="Lewati pengukuran ekspor CSV")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--simpan-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Toleransi regresi relatif (0.2 = 20%%)")
+    parser.add_argument("--output", type=Path, help="Tulis hasil lengkap sebagai JSON")
+    args = parser.parse_args()
+
+    siapkan_environment(args)
+    sys.path.insert(0, str(ROOT))
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from config import engine
+    from auth.auth_handler import get_password_hash
+    from benchmark.seed import seed, seed_riwayat, INDEX_RIWAYAT
+
+    mulai = time.perf_counter()
+    seed(engine, args.nasabah, args.mutasi, get_password_hash(PASSWORD), reset=args.reset)
+    logging.warning("Seed %s nasabah / %s mutasi selesai dalam %.1f detik", args.nasabah, args.mutasi, time.perf_counter() - mulai)
+    if args.riwayat:
+        mulai = time.perf_counter()
+        rekening_riwayat = seed_riwayat(engine, INDEX_RIWAYAT, args.riwayat, get_password_hash(PASSWORD))
+        logging.warning("Seed riwayat %s mutasi selesai dalam %.1f detik", args.riwayat, time.perf_counter() - mulai)
+
+    hasil = asyncio.run(benchmark(args))
+    if args.riwayat:
+        hasil["riwayat"] = ukur_riwayat(rekening_riwayat)
+    hasil["startup"] = ukur_startup()
+    hasil["konservasi"] = cek_konservasi()
+    cetak(hasil)
+
+    if args.output:
+        args.output.write_text(json.dumps(hasil, indent=2))
+
+    gagal = not hasil["konservasi"]["cocok"]
+    if gagal:
+        print("GAGAL: total saldo tidak sama dengan total mutasi")
+    if hasil["rate_limit"]["overhead_us"] > BATAS_OVERHEAD_RATE_LIMIT_US:
+        print(f"GAGAL: overhead rate limiter {hasil['rate_limit']['overhead_us']} us > {BATAS_OVERHEAD_RATE_LIMIT_US} us")
+        gagal = True
+    if hasil["velocity"]["overhead_us"] > BATAS_OVERHEAD_VELOCITY_US:
+        print(f"GAGAL: overhead limit velocity {hasil['velocity']['overhead_us']} us > {BATAS_OVERHEAD_VELOCITY_US} us")
+        gagal = True
+
+    semua_baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.simpan_baseline:
+        semua_baseline[args.target] = hasil
+        args.baseline.write_text(json.dumps(semua_baseline, indent=2))
+        print(f"Baseline {args.target} disimpan ke {args.baseline}")
+    elif args.target in semua_baseline:
+        regresi = bandingkan(hasil, semua_baseline[args.target], args.threshold)
+        for baris in regresi:
+            print(f"REGRESI {baris}")
+        gagal = gagal or bool(regresi)
+
+    sys.exit(1 if gagal else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Engine
+import model
+from model import Nasabah, Mutasi, MutasiHarian, RekeningBlok
+from rekening import format_no_rekening
+
+# Nominal setiap mutasi hasil seed, dalam sen (Rp 100.000)
+NOMINAL_SEED = 10_000_000
+CHUNK_SIZE = 10_000
+# Serial nasabah dengan riwayat panjang, jauh di atas nomor yang dialokasikan skenario daftar
+INDEX_RIWAYAT = 999_999_999
+
+
+def data_nasabah(index: int) -> dict:
+    """Identitas nasabah ke-index (mulai 1); dipakai juga oleh runner untuk login."""
+    return {
+        "nik": f"B{index:015d}",
+        "nama": f"bench{index}",
+        "email": f"bench{index}@bench.local",
+        "no_hp": f"08{index:011d}",
+        "no_rekening": format_no_rekening(index)
+    }
+
+
+def seed(engine: Engine, jumlah_nasabah: int, jumlah_mutasi: int, password_hash: str, reset: bool = False) -> None:
+    """Mengisi N nasabah dan M mutasi kredit dengan bulk insert per potongan.
+
+    Mutasi dibagi rata ke semua rekening sehingga saldo setiap nasabah sama
+    dengan jumlah mutasinya (lolos rekonsiliasi). Ringkasan harian ikut diisi
+    agar pembatasan rentang cek mutasi bisa diukur.
+    """
+    if reset:
+        model.Base.metadata.drop_all(bind=engine)
+    model.Base.metadata.create_all(bind=engine)
+
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(Nasabah)).scalar_one():
+            raise SystemExit("Database sudah berisi nasabah; jalankan dengan --reset untuk mengosongkannya")
+
+    jumlah_per_rekening = [jumlah_mutasi // jumlah_nasabah + (1 if i < jumlah_mutasi % jumlah_nasabah else 0) for i in range(jumlah_nasabah)]
+
+    with engine.begin() as conn:
+        for awal in range(0, jumlah_nasabah, CHUNK_SIZE):
+            conn.execute(insert(Nasabah), [
+                {**data_nasabah(i + 1), "saldo": jumlah_per_rekening[i] * NOMINAL_SEED, "password": password_hash}
+                for i in range(awal, min(awal + CHUNK_SIZE, jumlah_nasabah))
+            ])
+        # Penghitung blok nomor rekening dilanjutkan setelah serial hasil seed
+        conn.execute(insert(RekeningBlok), [{"id": 1, "nilai_terakhir": jumlah_nasabah}])
+    logging.info("Seed nasabah selesai: %s baris", jumlah_nasabah)
+
+    ditulis, jumlah_harian = _seed_mutasi(engine, {format_no_rekening(i + 1): jumlah for i, jumlah in enumerate(jumlah_per_rekening)})
+    logging.info("Seed mutasi selesai: %s baris, %s ringkasan harian", ditulis, jumlah_harian)
+
+
+def seed_riwayat(engine: Engine, index: int, jumlah_mutasi: int, password_hash: str) -> str:
+    """Menambah satu nasabah ke-index dengan riwayat M mutasi kredit (mis. 1 juta baris)
+    untuk mengukur pagination dan streaming mutasi; mengembalikan no_rekening-nya."""
+    data = data_nasabah(index)
+    with engine.begin() as conn:
+        conn.execute(insert(Nasabah), [{**data, "saldo": jumlah_mutasi * NOMINAL_SEED, "password": password_hash}])
+    ditulis, jumlah_harian = _seed_mutasi(engine, {data["no_rekening"]: jumlah_mutasi})
+    logging.info("Seed riwayat %s selesai: %s mutasi, %s ringkasan harian", data["no_rekening"], ditulis, jumlah_harian)
+    return data["no_rekening"]
+
+
+def _seed_mutasi(engine: Engine, jumlah_per_rekening: dict) -> tuple:
+    """Bulk insert mutasi kredit berurutan per rekening beserta ringkasan hariannya;
+    mengembalikan (jumlah mutasi, jumlah ringkasan harian)."""
+    # Mutasi diberi waktu mundur dari sekarang agar urutan (tanggal_transaksi, id) realistis
+    mulai = datetime.now() - timedelta(seconds=sum(jumlah_per_rekening.values()))
+    rows = []
+    ditulis = 0
+    nomor = 0
+    harian = {}
+    with engine.begin() as conn:
+        for no_rekening, jumlah in jumlah_per_rekening.items():
+            for urutan in range(jumlah):
+                nomor += 1
+                tanggal = mulai + timedelta(seconds=nomor)
+                saldo = (urutan + 1) * NOMINAL_SEED
+                rows.append({
+                    "no_rekening": no_rekening,
+                    "jenis_transaksi": "kredit",
+                    "tanggal_transaksi": tanggal,
+                    "nominal": NOMINAL_SEED,
+                    "saldo": saldo,
+                    "keterangan": "Seed"
+                })
+                ringkasan = harian.setdefault((no_rekening, tanggal.date()), [0, 0])
+                ringkasan[0] += 1
+                ringkasan[1] = saldo
+                if len(rows) >= CHUNK_SIZE:
+                    conn.execute(insert(Mutasi), rows)
+                    ditulis += len(rows)
+                    rows.clear()
+        if rows:
+            conn.execute(insert(Mutasi), rows)
+            ditulis += len(rows)
+
+        ringkasan_rows = [
+            {
+                "no_rekening": no_rekening,
+                "tanggal": tanggal,
+                "total_kredit": jumlah * NOMINAL_SEED,
+                "total_debit": 0,
+                "jumlah_transaksi": jumlah,
+                "saldo_penutupan": saldo
+            }
+            for (no_rekening, tanggal), (jumlah, saldo) in harian.items()
+        ]
+        for awal in range(0, len(ringkasan_rows), CHUNK_SIZE):
+            conn.execute(insert(MutasiHarian), ringkasan_rows[awal:awal + CHUNK_SIZE])
+    return ditulis, len(harian)
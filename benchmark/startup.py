@@ -0,0 +1,53 @@
+"""Mengukur waktu startup satu worker di proses baru: import aplikasi, startup lifespan,
+request pertama tanpa database (/metrics) dan request pertama ke database (/login).
+
+Dijalankan sebagai proses tersendiri oleh benchmark.run (agar modul belum ter-cache),
+atau langsung: python -m benchmark.startup
+"""
+import asyncio
+import json
+import time
+
+
+async def _ukur_request(mulai_import: float, selesai_import: float) -> dict:
+    import httpx
+    from main import app
+
+    mulai = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        lifespan = time.perf_counter() - mulai
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            mulai = time.perf_counter()
+            await client.get("/metrics")
+            metrics = time.perf_counter() - mulai
+            # Username tidak terdaftar: satu query tanpa bcrypt, mengukur pembukaan koneksi pertama
+            mulai = time.perf_counter()
+            await client.post("/login", json={"username": "startup@bench.local", "password": "-"})
+            login = time.perf_counter() - mulai
+        siap = time.perf_counter() - mulai_import
+        # Beri tugas latar belakang waktu menyelesaikan putaran pertamanya (di luar pengukuran):
+        # koneksi aiosqlite yang dibatalkan saat sedang dibuka meninggalkan thread yang menahan proses
+        await asyncio.sleep(0.5)
+
+    from config import async_engine, read_async_engine
+    await async_engine.dispose()
+    await read_async_engine.dispose()
+    return {
+        "import_ms": round((selesai_import - mulai_import) * 1000, 1),
+        "lifespan_ms": round(lifespan * 1000, 1),
+        "first_request_ms": round(metrics * 1000, 1),
+        "first_db_request_ms": round(login * 1000, 1),
+        "ready_ms": round(siap * 1000, 1)
+    }
+
+
+def main():
+    mulai = time.perf_counter()
+    import main  # noqa: F401
+    selesai = time.perf_counter()
+    print(json.dumps(asyncio.run(_ukur_request(mulai, selesai))))
+
+
+if __name__ == "__main__":
+    main()
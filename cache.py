@@ -0,0 +1,137 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+from decouple import config
+
+# Backend cache saldo: "memory" (LRU di dalam proses), "redis", atau "none" (tanpa cache).
+# "memory" hanya koheren untuk satu proses: worker lain tidak melihat perubahan saldo dari
+# worker ini, jadi server.jalankan memakai "none" jika worker lebih dari satu
+BALANCE_CACHE_BACKEND = config("BALANCE_CACHE_BACKEND", default="memory")
+BALANCE_CACHE_SIZE = config("BALANCE_CACHE_SIZE", default=100_000, cast=int)
+BALANCE_CACHE_TTL = config("BALANCE_CACHE_TTL", default=30.0, cast=float)  # detik
+REDIS_URL = config("REDIS_URL", default="redis://localhost:6379/0")
+
+
+class BalanceCache(ABC):
+    """Dasar cache saldo (dalam sen) per no_rekening beserta penghitung hit/miss."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    async def get(self, no_rekening: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def set(self, no_rekening: str, saldo: int) -> None:
+        ...
+
+    @abstractmethod
+    async def invalidate(self, no_rekening: str) -> None:
+        ...
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+class NullBalanceCache(BalanceCache):
+    """Tanpa cache: setiap pembacaan langsung ke database."""
+
+    async def get(self, no_rekening: str) -> Optional[int]:
+        self.misses += 1
+        return None
+
+    async def set(self, no_rekening: str, saldo: int) -> None:
+        pass
+
+    async def invalidate(self, no_rekening: str) -> None:
+        pass
+
+
+class LRUBalanceCache(BalanceCache):
+    """Cache LRU di dalam proses dengan TTL per entri."""
+
+    def __init__(self, maxsize: int = BALANCE_CACHE_SIZE, ttl: float = BALANCE_CACHE_TTL):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    async def get(self, no_rekening: str) -> Optional[int]:
+        entry = self._data.get(no_rekening)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[no_rekening]
+            self.misses += 1
+            return None
+        self._data.move_to_end(no_rekening)
+        self.hits += 1
+        return entry[0]
+
+    async def set(self, no_rekening: str, saldo: int) -> None:
+        self._data[no_rekening] = (saldo, time.monotonic() + self.ttl)
+        self._data.move_to_end(no_rekening)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def invalidate(self, no_rekening: str) -> None:
+        self._data.pop(no_rekening, None)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self._data)}
+
+
+class RedisBalanceCache(BalanceCache):
+    """Cache di Redis (atau klien lain dengan API get/set/delete yang sama)."""
+
+    def __init__(self, client, ttl: float = BALANCE_CACHE_TTL, prefix: str = "saldo:"):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, no_rekening: str) -> Optional[int]:
+        try:
+            value = await self.client.get(self.prefix + no_rekening)
+        except Exception as e:
+            # Cache tidak boleh menggagalkan request; anggap saja miss
+            logging.warning("Gagal membaca cache saldo: %s", e)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return int(value)
+
+    async def set(self, no_rekening: str, saldo: int) -> None:
+        try:
+            await self.client.set(self.prefix + no_rekening, saldo, px=int(self.ttl * 1000))
+        except Exception as e:
+            logging.warning("Gagal menulis cache saldo: %s", e)
+
+    async def invalidate(self, no_rekening: str) -> None:
+        try:
+            await self.client.delete(self.prefix + no_rekening)
+        except Exception as e:
+            logging.warning("Gagal menghapus cache saldo: %s", e)
+
+
+def create_balance_cache() -> BalanceCache:
+    if BALANCE_CACHE_BACKEND == "redis":
+        # redis hanya dibutuhkan jika backend redis dipilih
+        import redis.asyncio as redis
+        return RedisBalanceCache(redis.from_url(REDIS_URL))
+    if BALANCE_CACHE_BACKEND == "none":
+        return NullBalanceCache()
+    return LRUBalanceCache()
+
+
+balance_cache = create_balance_cache()
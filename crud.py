@@ -1,36 +1,64 @@
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
-from model import Nasabah,Mutasi
-from schema import user,UserInDB,UserLogin,Tabung,Tarik,Transfer
-from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from model import Nasabah,Mutasi,MutasiHarian,ArsipMutasi,TokenDicabut,Outbox
+from schema import user,UserInDB,UserLogin,RefreshRequest,Tabung,Tarik,Transfer,Batch,MutasiResponse
+from sqlalchemy import select, update, insert, tuple_, func, case
+from sqlalchemy.orm import load_only
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import date, datetime
+from typing import Optional
+import asyncio
+import base64
+import binascii
+import functools
 import logging
 import random
+import time
+from cache import balance_cache
+from rekening import rekening_allocator, is_valid_no_rekening, is_no_rekening_lama
+from money import ke_sen, ke_rupiah
+from partisi import MUTASI_PARTISI
+import revokasi
+import idempotency
+import outbox
+import velocity
 from auth.auth_bearer import JWTBearer
-from auth.auth_handler import sign_jwt, get_password_hash, verify_password, create_access_token,decode_refresh_token
+from auth.auth_handler import sign_jwt, get_password_hash_async, verify_and_update_password_async, create_access_token,decode_refresh_token
 
-def generate_no_rekening() -> str:
-    """Menghasilkan nomor rekening unik dengan format 16 digit."""
-    random_digits = random.randint(0, 99999999)
-    formatted_digits = f"{random_digits:08d}"
-    no_rekening = f"113{formatted_digits}"
-    return no_rekening
+# SQLSTATE Postgres untuk serialization failure dan deadlock yang aman diulang
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+MAX_RETRY = 3
+RETRY_BACKOFF = 0.05  # detik, dikalikan nomor percobaan
 
-def signup(data: user, session: Session):
-    try:
-        existing_nasabah = session.query(Nasabah).filter(
-            or_(
-                Nasabah.nik == data.nik,
-                Nasabah.no_hp == data.no_hp
-            )
-        ).first()
+REKENING_TIDAK_DIKENALI = "No Rekening tidak dikenali"
+# Error database pada transaksi uang: detailnya hanya di log, router memetakannya ke 503
+# agar tidak disimpan sebagai respons idempotent dan klien bisa mengulang dengan key yang sama
+KESALAHAN_DATABASE = "Terjadi kesalahan database, silakan coba lagi"
 
-        if existing_nasabah:
-            logging.warning(f"NIK atau No HP sudah digunakan: NIK={data.nik}, No HP={data.no_hp}")
-            return None, "NIK atau No HP sudah digunakan"
-        
-        hashed_password = get_password_hash(data.password)
-        no_rekening = generate_no_rekening()
+# Penanda constraint unik nasabah pada pesan IntegrityError (nama constraint Postgres
+# atau kolom/index SQLite), beserta pesan untuk klien
+DUPLIKAT_NASABAH = (
+    (("nasabah_nik_key", "nasabah.nik"), "NIK sudah digunakan"),
+    (("ix_nasabah_email_lower", "nasabah_email_key", "nasabah.email"), "Email sudah digunakan"),
+    (("nasabah_no_hp_key", "nasabah.no_hp"), "No HP sudah digunakan"),
+)
+
+# Jumlah maksimum no_rekening per query penguncian pada batch
+BATCH_LOCK_CHUNK = 5000
+
+# Jumlah baris yang diambil per batch dari server-side cursor saat streaming mutasi
+STREAM_BATCH_SIZE = 500
 
+async def signup(data: user, session: AsyncSession):
+    try:
+        # Hash dan nomor rekening disiapkan sebelum query pertama agar transaksi
+        # (dan koneksi database) tidak tertahan selama bcrypt berjalan
+        hashed_password = await get_password_hash_async(data.password)
+        no_rekening = await rekening_allocator.allocate()
+
+        # Tanpa SELECT pengecekan lebih dulu: duplikat dideteksi oleh constraint unik
+        # dalam satu round trip (dan tetap benar saat dua pendaftaran berjalan bersamaan)
         new_nasabah = Nasabah(
             nama=data.nama,
             nik=data.nik,
@@ -41,222 +69,768 @@ def signup(data: user, session: Session):
         )
 
         session.add(new_nasabah)
-        session.commit()
-        logging.info(f"Nasabah berhasil dibuat: Nama={new_nasabah.nama}, No Rekening={new_nasabah.no_rekening}, No HP={new_nasabah.no_hp}")
+        try:
+            await session.commit()
+        except IntegrityError as e:
+            await session.rollback()
+            pesan = str(e.orig)
+            for penanda, remark in DUPLIKAT_NASABAH:
+                if any(p in pesan for p in penanda):
+                    logging.warning("%s: NIK=%s, No HP=%s", remark, data.nik, data.no_hp)
+                    return None, remark
+            raise
+        logging.info("Nasabah berhasil dibuat: Nama=%s, No Rekening=%s, No HP=%s", new_nasabah.nama, new_nasabah.no_rekening, new_nasabah.no_hp)
         return new_nasabah, None
 
     except SQLAlchemyError as e:
-        session.rollback()
-        logging.error(f"Kesalahan saat membuat nasabah: {str(e)}")
+        await session.rollback()
+        logging.error("Kesalahan saat membuat nasabah: %s", e)
         return None, str(e)
     
 
-def login(data: UserLogin, session: Session):
+def _filter_login(username: str):
+    """Kondisi pencarian nasabah dari username, masing-masing memakai index unik:
+    email (tanpa membedakan huruf besar/kecil), no_rekening, atau no_hp."""
+    username = username.strip()
+    if "@" in username:
+        return func.lower(Nasabah.email) == username.lower()
+    if is_valid_no_rekening(username) or is_no_rekening_lama(username):
+        return Nasabah.no_rekening == username
+    return Nasabah.no_hp == username
+
+async def login(data: UserLogin, session: AsyncSession):
     try:
-        # Mengambil nasabah berdasarkan nama pengguna (username)
-        existing_nasabah = session.query(Nasabah).filter(
-            Nasabah.nama == data.username  # Username disini adalah nama pengguna
-        ).first()
+        # Username berupa email, no_hp, atau no_rekening; hanya kolom yang dibutuhkan
+        # untuk verifikasi dan isi token yang diambil
+        result = await session.execute(
+            select(Nasabah)
+            .options(load_only(Nasabah.nama, Nasabah.nik, Nasabah.no_hp, Nasabah.email, Nasabah.password))
+            .filter(_filter_login(data.username))
+        )
+        existing_nasabah = result.scalars().first()
+        # Transaksi baca diakhiri agar koneksi tidak tertahan selama verifikasi bcrypt
+        await session.commit()
+
+        # Verifikasi bcrypt dijalankan di pool terpisah agar tidak memblokir event loop
+        password_valid, new_hash = False, None
+        if existing_nasabah:
+            password_valid, new_hash = await verify_and_update_password_async(data.password, existing_nasabah.password)
 
         # Jika pengguna ditemukan dan password sesuai
-        if existing_nasabah and verify_password(data.password, existing_nasabah.password):
-            access_token = sign_jwt(
+        if existing_nasabah and password_valid:
+            # Rehash transparan jika hash lama memakai parameter yang sudah usang
+            if new_hash:
+                existing_nasabah.password = new_hash
+                await session.commit()
+                logging.info("Hash password diperbarui untuk pengguna: %s", data.username)
+
+            tokens = sign_jwt(
                 user_id=str(existing_nasabah.id),
                 nama=existing_nasabah.nama,  # Nama pengguna
                 nik=existing_nasabah.nik,  # NIK pengguna
                 no_hp=existing_nasabah.no_hp,  # Nomor HP pengguna
                 email=existing_nasabah.email  # Email pengguna
-            )['access_token']
-            
-            return {
-                "access_token": access_token,
-                "token_type": "bearer"
-            }, None
+            )
+            revokasi.catat("login")
+
+            return {**tokens, "token_type": "bearer"}, None
 
         # Jika tidak ditemukan atau password salah
         if not existing_nasabah:
-            logging.warning(f"Pengguna tidak ditemukan: {data.username}")
+            logging.warning("Pengguna tidak ditemukan: %s", data.username)
             return None, "Pengguna tidak ditemukan"
         else:
-            logging.warning(f"Password salah untuk pengguna: {data.username}")
+            logging.warning("Password salah untuk pengguna: %s", data.username)
             return None, "Password salah"
 
     except SQLAlchemyError as e:
-        logging.error(f"Kesalahan saat login: {str(e)}")
+        logging.error("Kesalahan saat login: %s", e)
         return None, str(e)
     
 
-def tabung(data: Tabung, session: Session):
+async def refresh(data: RefreshRequest, session: AsyncSession):
+    """Menukar refresh token dengan pasangan token baru tanpa verifikasi password.
+
+    Refresh token lama langsung dicabut (rotasi); jti disimpan dengan primary key
+    sehingga token yang sama hanya bisa ditukar sekali, juga antar worker.
+    """
+    claims = decode_refresh_token(data.refresh_token)
+    if not claims or claims.get("type") != "refresh":
+        logging.warning("Refresh token tidak valid atau kedaluwarsa")
+        return None, "Refresh token tidak valid atau kedaluwarsa"
+
+    try:
+        sekarang = datetime.now()
+        session.add(TokenDicabut(
+            jti=claims["jti"],
+            user_id=claims["user_id"],
+            dicabut_at=sekarang,
+            expires_at=datetime.fromtimestamp(claims["exp"])
+        ))
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            revokasi.catat("reuse")
+            logging.warning("Refresh token dipakai ulang: user_id=%s, jti=%s", claims["user_id"], claims["jti"])
+            return None, "Refresh token sudah dipakai"
+
+        revokasi.ke_cache(claims["jti"], sekarang)
+        tokens = sign_jwt(
+            user_id=claims["user_id"],
+            nama=claims["nama"],
+            nik=claims["NIK"],
+            no_hp=claims["no_hp"],
+            email=claims["email"]
+        )
+        revokasi.catat("refresh")
+        logging.info("Token dirotasi untuk user_id=%s", claims["user_id"])
+        return {**tokens, "token_type": "bearer"}, None
+
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logging.error("Kesalahan saat refresh token: %s", e)
+        return None, str(e)
+
+
+def retry_on_conflict(func):
+    """Mengulang transaksi yang gagal karena deadlock atau serialization failure."""
+    @functools.wraps(func)
+    async def wrapper(data, session: AsyncSession):
+        for attempt in range(1, MAX_RETRY + 1):
+            try:
+                return await func(data, session)
+            except DBAPIError as e:
+                # Fungsi di bawah hanya meneruskan error yang bisa diulang (sudah di-rollback)
+                if attempt == MAX_RETRY:
+                    logging.error("Transaksi tetap gagal setelah %s percobaan: %s", MAX_RETRY, e)
+                    return None, KESALAHAN_DATABASE
+                logging.warning("Konflik transaksi, mencoba ulang (%s/%s): %s", attempt, MAX_RETRY, e)
+                await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * attempt))
+    return wrapper
+
+def _is_retryable(error: SQLAlchemyError) -> bool:
+    """Cek apakah error database berasal dari deadlock atau serialization failure."""
+    if not isinstance(error, DBAPIError):
+        return False
+    sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    # Padanan di SQLite (WAL): tulis dari snapshot basi atau lock tulis tidak didapat
+    return "database is locked" in str(error.orig)
+
+async def _catat_mutasi(session: AsyncSession, rows: list):
+    """Menyimpan baris mutasi dengan satu bulk insert, memperbarui ringkasan hariannya,
+    dan menulis event outbox-nya dalam transaksi yang sama."""
+    if not rows:
+        return
+
+    # Waktu transaksi ditetapkan di sini agar tanggal ringkasan sama persis dengan mutasinya
+    sekarang = datetime.now()
+    ringkasan = {}
+    for row in rows:
+        row["tanggal_transaksi"] = sekarang
+        item = ringkasan.setdefault(row["no_rekening"], {
+            "no_rekening": row["no_rekening"],
+            "tanggal": sekarang.date(),
+            "total_kredit": 0,
+            "total_debit": 0,
+            "jumlah_transaksi": 0
+        })
+        item["total_kredit" if row["jenis_transaksi"] == "kredit" else "total_debit"] += row["nominal"]
+        item["jumlah_transaksi"] += 1
+        # Baris diurutkan sesuai urutan penerapan, jadi saldo terakhir adalah saldo penutupan
+        item["saldo_penutupan"] = row["saldo"]
+
+    await session.execute(insert(Mutasi), rows)
+    # Tanpa RETURNING id mutasi: event diidentifikasi oleh id outbox-nya sendiri
+    await session.execute(insert(Outbox), [outbox.event_mutasi(row) for row in rows])
+
+    dialect_insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = dialect_insert(MutasiHarian).values([ringkasan[no] for no in sorted(ringkasan)])
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[MutasiHarian.no_rekening, MutasiHarian.tanggal],
+        set_={
+            "total_kredit": MutasiHarian.total_kredit + stmt.excluded.total_kredit,
+            "total_debit": MutasiHarian.total_debit + stmt.excluded.total_debit,
+            "jumlah_transaksi": MutasiHarian.jumlah_transaksi + stmt.excluded.jumlah_transaksi,
+            "saldo_penutupan": stmt.excluded.saldo_penutupan
+        }
+    ))
+
+def _audit(event: str, mulai: float, **fields) -> dict:
+    """Field terstruktur untuk log audit; nominal dan saldo dalam sen."""
+    return {"event": event, "latency_ms": round((time.perf_counter() - mulai) * 1000, 3), **fields}
+
+@retry_on_conflict
+async def tabung(data: Tabung, session: AsyncSession):
     """Menambahkan saldo ke rekening nasabah dan mencatat mutasi."""
+    mulai = time.perf_counter()
     try:
         # Validasi data
-        if data.nominal <= 0:
-            logging.warning(f"Nominal harus lebih besar dari nol: {data.nominal}")
+        nominal = ke_sen(data.nominal)
+        if nominal <= 0:
+            logging.warning("Nominal harus lebih besar dari nol: %s", data.nominal)
             return None, "Nominal harus lebih besar dari nol"
 
-        # Mengambil nasabah berdasarkan no_rekening
-        nasabah = session.query(Nasabah).filter(Nasabah.no_rekening == data.no_rekening).first()
+        # Menambahkan saldo secara atomik (satu statement, tanpa read-modify-write di Python)
+        result = await session.execute(
+            update(Nasabah)
+            .where(Nasabah.no_rekening == data.no_rekening)
+            .values(saldo=Nasabah.saldo + nominal)
+            .returning(Nasabah.saldo)
+        )
+        saldo = result.scalar_one_or_none()
 
-        if not nasabah:
-            logging.warning(f"No Rekening tidak dikenali: {data.no_rekening}")
+        if saldo is None:
+            await session.rollback()
+            logging.warning("No Rekening tidak dikenali: %s", data.no_rekening)
             return None, "No Rekening tidak dikenali"
 
-        # Menambahkan saldo
-        nasabah.saldo += data.nominal
+        # Mencatat mutasi (saldo yang disimpan adalah saldo setelah transaksi)
+        await _catat_mutasi(session, [
+            {"no_rekening": data.no_rekening, "nominal": nominal, "saldo": saldo, "jenis_transaksi": "kredit", "keterangan": "Tabung"}
+        ])
 
-        # Membuat data mutasi
-        mutasi = Mutasi(
-            no_rekening=nasabah.no_rekening,
-            saldo=nasabah.saldo,  # Menyimpan saldo setelah transaksi
-            jenis_transaksi="kredit",
-            keterangan="Tabung"
-        )
+        # Respons idempotent (jika ada) ditulis dalam transaksi yang sama dengan mutasinya
+        await idempotency.simpan_respons(session, ke_rupiah(saldo))
 
         # Menyimpan perubahan ke database
-        session.add(mutasi)
-        session.commit()
+        await session.commit()
+        await balance_cache.set(data.no_rekening, saldo)
 
-        logging.info(f"Tabungan berhasil: No Rekening={nasabah.no_rekening}, Saldo={nasabah.saldo}")
-        return nasabah.saldo, None
+        logging.info(
+            "Tabungan berhasil: No Rekening=%s, Saldo (sen)=%s", data.no_rekening, saldo,
+            extra=_audit("tabung", mulai, no_rekening=data.no_rekening, nominal=nominal, saldo=saldo)
+        )
+        return ke_rupiah(saldo), None
 
     except SQLAlchemyError as e:
-        session.rollback()
-        logging.error(f"Kesalahan saat menabung: {str(e)}")
-        return None, str(e)
+        await session.rollback()
+        if _is_retryable(e):
+            raise
+        logging.error("Kesalahan saat menabung: %s", e)
+        return None, KESALAHAN_DATABASE
     
-def tarik(data: Tarik, session: Session):
+@retry_on_conflict
+async def tarik(data: Tarik, session: AsyncSession):
     """Menarik dana dari rekening nasabah."""
+    mulai = time.perf_counter()
+    reservasi = []
     try:
-        # Mengambil nasabah berdasarkan no_rekening
-        nasabah = session.query(Nasabah).filter(Nasabah.no_rekening == data.no_rekening).first()
+        nominal = ke_sen(data.nominal)
+        if nominal <= 0:
+            logging.warning("Nominal harus lebih besar dari nol: %s", data.nominal)
+            return None, "Nominal harus lebih besar dari nol"
 
-        if not nasabah:
-            logging.warning(f"No Rekening tidak dikenali: {data.no_rekening}")
-            return None, "No Rekening tidak dikenali"
+        # Mengurangi saldo secara atomik hanya jika saldo mencukupi
+        result = await session.execute(
+            update(Nasabah)
+            .where(Nasabah.no_rekening == data.no_rekening, Nasabah.saldo >= nominal)
+            .values(saldo=Nasabah.saldo - nominal, jumlah_debit=Nasabah.jumlah_debit + 1)
+            .returning(Nasabah.saldo, Nasabah.jumlah_debit)
+        )
+        saldo, jumlah_debit = result.one_or_none() or (None, None)
+
+        if saldo is None:
+            # Tidak ada baris yang berubah: bedakan rekening tidak ada vs saldo kurang
+            result = await session.execute(select(Nasabah.saldo).filter(Nasabah.no_rekening == data.no_rekening))
+            saldo_sekarang = result.scalar_one_or_none()
+            await session.rollback()
+
+            if saldo_sekarang is None:
+                logging.warning("No Rekening tidak dikenali: %s", data.no_rekening)
+                return None, "No Rekening tidak dikenali"
 
-        if nasabah.saldo < data.nominal:
-            logging.warning(f"Saldo tidak cukup: No Rekening={nasabah.no_rekening}, Saldo={nasabah.saldo}, Nominal={data.nominal}")
+            logging.warning("Saldo tidak cukup: No Rekening=%s, Saldo=%s, Nominal=%s", data.no_rekening, ke_rupiah(saldo_sekarang), data.nominal)
             return None, "Saldo tidak cukup"
 
-        # Mengurangi saldo nasabah
-        nasabah.saldo -= data.nominal
-        
-        # Membuat data mutasi
-        mutasi = Mutasi(
-            no_rekening=nasabah.no_rekening,
-            saldo=nasabah.saldo,  # Menyimpan saldo setelah transaksi
-            jenis_transaksi="debit",
-            keterangan="Tarik"
-        )
+        # Limit velocity diperiksa setelah baris rekening terkunci oleh UPDATE di atas
+        penghitung = await velocity.muat(session, {data.no_rekening: jumlah_debit - 1})
+        error = velocity.cadangkan(penghitung, data.no_rekening, nominal, reservasi)
+        if error:
+            await session.rollback()
+            return None, error
+
+        # Mencatat mutasi (saldo yang disimpan adalah saldo setelah transaksi)
+        await _catat_mutasi(session, [
+            {"no_rekening": data.no_rekening, "nominal": nominal, "saldo": saldo, "jenis_transaksi": "debit", "keterangan": "Tarik"}
+        ])
         
+        # Respons idempotent (jika ada) ditulis dalam transaksi yang sama dengan mutasinya
+        await idempotency.simpan_respons(session, ke_rupiah(saldo))
+
         # Menyimpan perubahan ke database
-        session.add(mutasi)
-        session.commit()
+        await session.commit()
+        await balance_cache.set(data.no_rekening, saldo)
 
-        logging.info(f"Penarikan berhasil: No Rekening={nasabah.no_rekening}, Saldo={nasabah.saldo}")
-        return nasabah.saldo, None
+        logging.info(
+            "Penarikan berhasil: No Rekening=%s, Saldo (sen)=%s", data.no_rekening, saldo,
+            extra=_audit("tarik", mulai, no_rekening=data.no_rekening, nominal=nominal, saldo=saldo)
+        )
+        return ke_rupiah(saldo), None
 
     except SQLAlchemyError as e:
-        session.rollback()
-        logging.error(f"Kesalahan saat menarik dana: {str(e)}")
-        return None, str(e)
-
-def transfer(data: Transfer, session: Session):
+        await session.rollback()
+        velocity.batalkan(reservasi)
+        if _is_retryable(e):
+            raise
+        logging.error("Kesalahan saat menarik dana: %s", e)
+        return None, KESALAHAN_DATABASE
+
+@retry_on_conflict
+async def transfer(data: Transfer, session: AsyncSession):
     """Mentrasfer dana antar rekening."""
+    mulai = time.perf_counter()
+    reservasi = []
     try:
-        pengirim = session.query(Nasabah).filter(Nasabah.no_rekening == data.no_rekening_pengirim).first()
-        penerima = session.query(Nasabah).filter(Nasabah.no_rekening == data.no_rekening_penerima).first()
+        nominal = ke_sen(data.nominal)
+        if nominal <= 0:
+            logging.warning("Nominal harus lebih besar dari nol: %s", data.nominal)
+            return None, "Nominal harus lebih besar dari nol"
+
+        if data.no_rekening_pengirim == data.no_rekening_penerima:
+            logging.warning("Transfer ke rekening sendiri: %s", data.no_rekening_pengirim)
+            return None, "No Rekening pengirim dan penerima tidak boleh sama"
+
+        # Mengunci kedua rekening dengan urutan no_rekening yang tetap
+        # agar dua transfer berlawanan arah tidak saling deadlock
+        result = await session.execute(
+            select(Nasabah)
+            .options(load_only(Nasabah.no_rekening, Nasabah.saldo, Nasabah.jumlah_debit))
+            .filter(Nasabah.no_rekening.in_([data.no_rekening_pengirim, data.no_rekening_penerima]))
+            .order_by(Nasabah.no_rekening)
+            .with_for_update()
+        )
+        rekening = {nasabah.no_rekening: nasabah for nasabah in result.scalars().all()}
+        pengirim = rekening.get(data.no_rekening_pengirim)
+        penerima = rekening.get(data.no_rekening_penerima)
 
         if not pengirim:
-            logging.warning(f"No Rekening pengirim tidak dikenali: {data.no_rekening_pengirim}")
+            await session.rollback()
+            logging.warning("No Rekening pengirim tidak dikenali: %s", data.no_rekening_pengirim)
             return None, "No Rekening pengirim tidak dikenali"
 
         if not penerima:
-            logging.warning(f"No Rekening penerima tidak dikenali: {data.no_rekening_penerima}")
+            await session.rollback()
+            logging.warning("No Rekening penerima tidak dikenali: %s", data.no_rekening_penerima)
             return None, "No Rekening penerima tidak dikenali"
 
-        if pengirim.saldo < data.nominal:
-            logging.warning(f"Saldo pengirim tidak cukup: No Rekening={pengirim.no_rekening}, Saldo={pengirim.saldo}, Nominal={data.nominal}")
+        if pengirim.saldo < nominal:
+            await session.rollback()
+            logging.warning("Saldo pengirim tidak cukup: No Rekening=%s, Saldo=%s, Nominal=%s", pengirim.no_rekening, ke_rupiah(pengirim.saldo), data.nominal)
             return None, "Saldo pengirim tidak cukup"
 
-        # Update saldo
-        pengirim.saldo -= data.nominal
-        penerima.saldo += data.nominal
+        penghitung = await velocity.muat(session, {pengirim.no_rekening: pengirim.jumlah_debit})
+        error = velocity.cadangkan(penghitung, pengirim.no_rekening, nominal, reservasi)
+        if error:
+            await session.rollback()
+            return None, error
+
+        # Update saldo (aman karena kedua baris sudah terkunci)
+        pengirim.saldo -= nominal
+        pengirim.jumlah_debit += 1
+        penerima.saldo += nominal
 
-        # Menyimpan data mutasi untuk pengirim
-        mutasi_pengirim = Mutasi(
-            no_rekening=pengirim.no_rekening,
-            saldo=pengirim.saldo,  # Updated saldo after the transaction
-            jenis_transaksi="debit",  # Jenis transaksi "debit"
-            keterangan=f"Transfer ke {data.no_rekening_penerima}"
+        # Menyimpan data mutasi untuk pengirim (debit) dan penerima (kredit) sekaligus
+        await _catat_mutasi(session, [
+            {
+                "no_rekening": pengirim.no_rekening,
+                "nominal": nominal,
+                "saldo": pengirim.saldo,  # Updated saldo after the transaction
+                "jenis_transaksi": "debit",
+                "keterangan": f"Transfer ke {data.no_rekening_penerima}"
+            },
+            {
+                "no_rekening": penerima.no_rekening,
+                "nominal": nominal,
+                "saldo": penerima.saldo,  # Updated saldo after the transaction
+                "jenis_transaksi": "kredit",
+                "keterangan": f"Transfer dari {data.no_rekening_pengirim}"
+            }
+        ])
+
+        hasil = {
+            "saldo_pengirim": ke_rupiah(pengirim.saldo),
+            "saldo_penerima": ke_rupiah(penerima.saldo)
+        }
+        await idempotency.simpan_respons(session, hasil)
+
+        # Commit transaksi ke database
+        await session.commit()
+        await balance_cache.set(pengirim.no_rekening, pengirim.saldo)
+        await balance_cache.set(penerima.no_rekening, penerima.saldo)
+
+        logging.info(
+            "Transfer berhasil: Dari No Rekening=%s ke No Rekening=%s, Saldo Pengirim (sen)=%s, Saldo Penerima (sen)=%s",
+            pengirim.no_rekening, penerima.no_rekening, pengirim.saldo, penerima.saldo,
+            extra=_audit("transfer", mulai, no_rekening=pengirim.no_rekening, nominal=nominal, saldo=pengirim.saldo)
         )
-        session.add(mutasi_pengirim)
+        return hasil, None
+
+    except SQLAlchemyError as e:
+        await session.rollback()
+        velocity.batalkan(reservasi)
+        if _is_retryable(e):
+            raise
+        logging.error("Kesalahan saat transfer: %s", e)
+        return None, KESALAHAN_DATABASE
+
+def _terapkan_operasi(operasi, saldo: dict, mutasi_rows: list, penghitung: dict, reservasi: list):
+    """Menerapkan satu operasi batch pada saldo (sen) di memori; mengembalikan (hasil, error).
+
+    Debit juga dicadangkan pada penghitung velocity, sehingga operasi berikutnya
+    dalam batch yang sama ikut memperhitungkannya.
+    """
+    nominal = ke_sen(operasi.nominal)
+    if nominal <= 0:
+        return None, "Nominal harus lebih besar dari nol"
+
+    if operasi.jenis == "tabung":
+        if operasi.no_rekening not in saldo:
+            return None, REKENING_TIDAK_DIKENALI
+        saldo[operasi.no_rekening] += nominal
+        mutasi_rows.append({"no_rekening": operasi.no_rekening, "nominal": nominal, "saldo": saldo[operasi.no_rekening], "jenis_transaksi": "kredit", "keterangan": "Tabung"})
+        return {"saldo": ke_rupiah(saldo[operasi.no_rekening])}, None
+
+    if operasi.jenis == "tarik":
+        if operasi.no_rekening not in saldo:
+            return None, REKENING_TIDAK_DIKENALI
+        if saldo[operasi.no_rekening] < nominal:
+            return None, "Saldo tidak cukup"
+        error = velocity.cadangkan(penghitung, operasi.no_rekening, nominal, reservasi)
+        if error:
+            return None, error
+        saldo[operasi.no_rekening] -= nominal
+        mutasi_rows.append({"no_rekening": operasi.no_rekening, "nominal": nominal, "saldo": saldo[operasi.no_rekening], "jenis_transaksi": "debit", "keterangan": "Tarik"})
+        return {"saldo": ke_rupiah(saldo[operasi.no_rekening])}, None
+
+    # Transfer
+    pengirim, penerima = operasi.no_rekening_pengirim, operasi.no_rekening_penerima
+    if pengirim == penerima:
+        return None, "No Rekening pengirim dan penerima tidak boleh sama"
+    if pengirim not in saldo:
+        return None, "No Rekening pengirim tidak dikenali"
+    if penerima not in saldo:
+        return None, "No Rekening penerima tidak dikenali"
+    if saldo[pengirim] < nominal:
+        return None, "Saldo pengirim tidak cukup"
+    error = velocity.cadangkan(penghitung, pengirim, nominal, reservasi)
+    if error:
+        return None, error
+    saldo[pengirim] -= nominal
+    saldo[penerima] += nominal
+    mutasi_rows.append({"no_rekening": pengirim, "nominal": nominal, "saldo": saldo[pengirim], "jenis_transaksi": "debit", "keterangan": f"Transfer ke {penerima}"})
+    mutasi_rows.append({"no_rekening": penerima, "nominal": nominal, "saldo": saldo[penerima], "jenis_transaksi": "kredit", "keterangan": f"Transfer dari {pengirim}"})
+    return {"saldo_pengirim": ke_rupiah(saldo[pengirim]), "saldo_penerima": ke_rupiah(saldo[penerima])}, None
+
+@retry_on_conflict
+async def batch(data: Batch, session: AsyncSession):
+    """Menjalankan banyak operasi tabung/tarik/transfer dalam satu transaksi."""
+    mulai = time.perf_counter()
+    reservasi = []
+    try:
+        nomor_rekening, pendebit = set(), set()
+        for operasi in data.operasi:
+            if operasi.jenis == "transfer":
+                nomor_rekening.update((operasi.no_rekening_pengirim, operasi.no_rekening_penerima))
+                pendebit.add(operasi.no_rekening_pengirim)
+            else:
+                nomor_rekening.add(operasi.no_rekening)
+                if operasi.jenis == "tarik":
+                    pendebit.add(operasi.no_rekening)
+
+        # Mengunci semua rekening yang terlibat sekali saja, dengan urutan no_rekening
+        # yang tetap (per potongan agar jumlah parameter query tetap terbatas)
+        nomor_urut = sorted(nomor_rekening)
+        id_rekening, saldo, jumlah_debit = {}, {}, {}
+        for start in range(0, len(nomor_urut), BATCH_LOCK_CHUNK):
+            result = await session.execute(
+                select(Nasabah.id, Nasabah.no_rekening, Nasabah.saldo, Nasabah.jumlah_debit)
+                .filter(Nasabah.no_rekening.in_(nomor_urut[start:start + BATCH_LOCK_CHUNK]))
+                .order_by(Nasabah.no_rekening)
+                .with_for_update()
+            )
+            for row in result:
+                id_rekening[row.no_rekening] = row.id
+                saldo[row.no_rekening] = row.saldo
+                jumlah_debit[row.no_rekening] = row.jumlah_debit
+        saldo_awal = dict(saldo)
+        # Penghitung velocity semua rekening yang didebit dimuat sekali, setelah rekening terkunci
+        penghitung = await velocity.muat(session, {no: jumlah_debit[no] for no in sorted(pendebit & saldo.keys())})
+
+        hasil, mutasi_rows, jumlah_gagal = [], [], 0
+        for index, operasi in enumerate(data.operasi):
+            hasil_operasi, error = _terapkan_operasi(operasi, saldo, mutasi_rows, penghitung, reservasi)
+            if error:
+                jumlah_gagal += 1
+                hasil.append({"index": index, "status": "gagal", "remark": error})
+            else:
+                hasil.append({"index": index, "status": "berhasil", **hasil_operasi})
+
+        if jumlah_gagal and data.atomik:
+            await session.rollback()
+            velocity.batalkan(reservasi)
+            logging.warning("Batch dibatalkan: %s dari %s operasi gagal", jumlah_gagal, len(data.operasi))
+            return hasil, "Sebagian operasi gagal, seluruh batch dibatalkan"
+
+        # Update saldo per primary key dan insert mutasi, masing-masing sebagai executemany
+        debit = {}
+        for row in mutasi_rows:
+            if row["jenis_transaksi"] == "debit":
+                debit[row["no_rekening"]] = debit.get(row["no_rekening"], 0) + 1
+        berubah = [no for no in saldo if saldo[no] != saldo_awal[no] or no in debit]
+        if berubah:
+            await session.execute(update(Nasabah), [
+                {"id": id_rekening[no], "saldo": saldo[no], "jumlah_debit": jumlah_debit[no] + debit.get(no, 0)}
+                for no in berubah
+            ])
+        await _catat_mutasi(session, mutasi_rows)
+        await session.commit()
+
+        for no in berubah:
+            await balance_cache.set(no, saldo[no])
+
+        logging.info(
+            "Batch berhasil: %s operasi diterapkan, %s gagal, %s rekening berubah",
+            len(data.operasi) - jumlah_gagal, jumlah_gagal, len(berubah),
+            extra=_audit("batch", mulai)
+        )
+        return hasil, None
+
+    except SQLAlchemyError as e:
+        await session.rollback()
+        velocity.batalkan(reservasi)
+        if _is_retryable(e):
+            raise
+        logging.error("Kesalahan saat menjalankan batch: %s", e)
+        return None, KESALAHAN_DATABASE
+
+async def ceksaldo(no_rekening: str, session: AsyncSession):
+    """Cek saldo rekening nasabah berdasarkan no_rekening."""
+    try:
+        saldo = await balance_cache.get(no_rekening)
+        if saldo is not None:
+            return ke_rupiah(saldo), None
+
+        # Hanya mengambil kolom saldo, tanpa memuat seluruh entitas Nasabah
+        result = await session.execute(select(Nasabah.saldo).filter(Nasabah.no_rekening == no_rekening))
+        saldo = result.scalar_one_or_none()
         
-        # Menyimpan data mutasi untuk penerima
-        mutasi_penerima = Mutasi(
-            no_rekening=penerima.no_rekening,
-            saldo=penerima.saldo,  # Updated saldo after the transaction
-            jenis_transaksi="kredit",  # Jenis transaksi "kredit"
-            keterangan=f"Transfer dari {data.no_rekening_pengirim}"
+        if saldo is None:
+            return None, REKENING_TIDAK_DIKENALI
+        
+        # Saldo dari replica bisa tertinggal; cache hanya diisi dari primary
+        if not session.info.get("replica"):
+            await balance_cache.set(no_rekening, saldo)
+        return ke_rupiah(saldo), None
+
+    except SQLAlchemyError as e:
+        await session.rollback()
+        return None, f"Kesalahan saat mengecek saldo: {str(e)}"
+
+async def rekonsiliasi(no_rekening: str, session: AsyncSession):
+    """Mencocokkan saldo tersimpan dengan jumlah seluruh nominal mutasi (SUM memakai index no_rekening)."""
+    try:
+        result = await session.execute(select(Nasabah.saldo).filter(Nasabah.no_rekening == no_rekening))
+        saldo = result.scalar_one_or_none()
+
+        if saldo is None:
+            return None, REKENING_TIDAK_DIKENALI
+
+        # Mutasi pada partisi yang sudah diarsipkan dihitung dari ringkasan hariannya
+        batas_arsip = (await session.execute(select(func.max(ArsipMutasi.sampai)))).scalar_one()
+
+        query = (
+            select(func.coalesce(func.sum(case((Mutasi.jenis_transaksi == "kredit", Mutasi.nominal), else_=-Mutasi.nominal)), 0))
+            .filter(Mutasi.no_rekening == no_rekening)
         )
-        session.add(mutasi_penerima)
+        if batas_arsip:
+            query = query.filter(Mutasi.tanggal_transaksi >= batas_arsip)
+        saldo_mutasi = (await session.execute(query)).scalar_one()
+
+        if batas_arsip:
+            result = await session.execute(
+                select(func.coalesce(func.sum(MutasiHarian.total_kredit - MutasiHarian.total_debit), 0))
+                .filter(MutasiHarian.no_rekening == no_rekening, MutasiHarian.tanggal < batas_arsip.date())
+            )
+            saldo_mutasi += result.scalar_one()
 
-        # Commit transaksi ke database
-        session.commit()
+        if saldo != saldo_mutasi:
+            logging.warning("Selisih rekonsiliasi: No Rekening=%s, Saldo=%s, Saldo Mutasi=%s", no_rekening, ke_rupiah(saldo), ke_rupiah(saldo_mutasi))
 
-        logging.info(f"Transfer berhasil: Dari No Rekening={pengirim.no_rekening} ke No Rekening={penerima.no_rekening}, Saldo Pengirim={pengirim.saldo}, Saldo Penerima={penerima.saldo}")
         return {
-            "saldo_pengirim": pengirim.saldo,
-            "saldo_penerima": penerima.saldo
+            "saldo": ke_rupiah(saldo),
+            "saldo_mutasi": ke_rupiah(saldo_mutasi),
+            "cocok": saldo == saldo_mutasi
         }, None
 
     except SQLAlchemyError as e:
-        session.rollback()
-        logging.error(f"Kesalahan saat transfer: {str(e)}")
+        logging.error("Kesalahan saat rekonsiliasi: %s", e)
         return None, str(e)
 
-def ceksaldo(no_rekening: str, session: Session):
-    """Cek saldo rekening nasabah berdasarkan no_rekening."""
+async def ringkasan(no_rekening: str, dari: date, sampai: date, session: AsyncSession):
+    """Ringkasan kredit/debit per hari dari tabel ringkasan harian, O(jumlah hari)."""
     try:
-        # Query nasabah based on no_rekening
-        nasabah = session.query(Nasabah).filter(Nasabah.no_rekening == no_rekening).first()
-        
-        if not nasabah:
-            return None, "No Rekening tidak dikenali"
-        
-        return nasabah.saldo, None
+        result = await session.execute(
+            select(
+                MutasiHarian.tanggal,
+                MutasiHarian.total_kredit,
+                MutasiHarian.total_debit,
+                MutasiHarian.jumlah_transaksi,
+                MutasiHarian.saldo_penutupan
+            )
+            .filter(MutasiHarian.no_rekening == no_rekening, MutasiHarian.tanggal.between(dari, sampai))
+            .order_by(MutasiHarian.tanggal)
+        )
+        harian = result.all()
+
+        # Saldo awal = saldo penutupan hari terakhir yang punya mutasi sebelum periode
+        result = await session.execute(
+            select(MutasiHarian.saldo_penutupan)
+            .filter(MutasiHarian.no_rekening == no_rekening, MutasiHarian.tanggal < dari)
+            .order_by(MutasiHarian.tanggal.desc())
+            .limit(1)
+        )
+        saldo_awal = result.scalar_one_or_none() or 0
+
+        return {
+            "no_rekening": no_rekening,
+            "saldo_awal": ke_rupiah(saldo_awal),
+            "saldo_akhir": ke_rupiah(harian[-1].saldo_penutupan if harian else saldo_awal),
+            "total_kredit": ke_rupiah(sum(item.total_kredit for item in harian)),
+            "total_debit": ke_rupiah(sum(item.total_debit for item in harian)),
+            "jumlah_transaksi": sum(item.jumlah_transaksi for item in harian),
+            "harian": [
+                {
+                    "tanggal": item.tanggal,
+                    "total_kredit": ke_rupiah(item.total_kredit),
+                    "total_debit": ke_rupiah(item.total_debit),
+                    "jumlah_transaksi": item.jumlah_transaksi,
+                    "saldo_penutupan": ke_rupiah(item.saldo_penutupan)
+                }
+                for item in harian
+            ]
+        }, None
 
     except SQLAlchemyError as e:
-        session.rollback()
-        return None, f"Kesalahan saat mengecek saldo: {str(e)}"
+        logging.error("Kesalahan saat membuat ringkasan: %s", e)
+        return None, str(e)
 
-def cek_mutasi(no_rekening: str, session: Session):
-    """Mengecek mutasi berdasarkan nomor rekening."""
+def encode_cursor(mutasi) -> str:
+    """Membuat cursor keyset dari (tanggal_transaksi, id) baris terakhir."""
+    raw = f"{mutasi.tanggal_transaksi.isoformat()}|{mutasi.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Mengurai cursor keyset menjadi (tanggal_transaksi, id)."""
+    tanggal, mutasi_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(tanggal), int(mutasi_id)
+
+# Kolom yang dikirim ke klien; dibaca sebagai Row biasa tanpa identity map ORM
+MUTASI_KOLOM = (
+    Mutasi.id,
+    Mutasi.no_rekening,
+    Mutasi.jenis_transaksi,
+    Mutasi.tanggal_transaksi,
+    Mutasi.nominal,
+    Mutasi.saldo,
+    Mutasi.keterangan
+)
+
+def _mutasi_query(no_rekening: str, dari: Optional[datetime] = None, sampai: Optional[datetime] = None, jenis_transaksi: Optional[str] = None):
+    """Query mutasi terbaru lebih dulu, memakai index (no_rekening, tanggal_transaksi, id)."""
+    query = select(*MUTASI_KOLOM).filter(Mutasi.no_rekening == no_rekening)
+    if dari:
+        query = query.filter(Mutasi.tanggal_transaksi >= dari)
+    if sampai:
+        query = query.filter(Mutasi.tanggal_transaksi <= sampai)
+    if jenis_transaksi:
+        query = query.filter(Mutasi.jenis_transaksi == jenis_transaksi)
+    return query.order_by(Mutasi.tanggal_transaksi.desc(), Mutasi.id.desc())
+
+def _mutasi_to_dict(row) -> dict:
+    """Row mapping mutasi dengan nominal dan saldo dikonversi dari sen ke rupiah."""
+    return {**row._mapping, "nominal": ke_rupiah(row.nominal), "saldo": ke_rupiah(row.saldo)}
+
+async def _batas_bawah(session: AsyncSession, no_rekening: str, atas: Optional[datetime], limit: int) -> Optional[datetime]:
+    """Awal hari terbaru yang menjamin lebih dari `limit` mutasi sebelum `atas`, dihitung
+    dari ringkasan harian, agar query mutasi hanya menyentuh partisi yang relevan."""
+    query = select(MutasiHarian.tanggal, MutasiHarian.jumlah_transaksi).filter(MutasiHarian.no_rekening == no_rekening)
+    if atas:
+        # Hari milik `atas` sendiri tidak dihitung karena sebagian mutasinya berada setelah `atas`
+        query = query.filter(MutasiHarian.tanggal < atas.date())
+    result = await session.execute(query.order_by(MutasiHarian.tanggal.desc()).limit(limit + 1))
+
+    jumlah = 0
+    for tanggal, jumlah_transaksi in result:
+        jumlah += jumlah_transaksi
+        if jumlah > limit:
+            return datetime.combine(tanggal, datetime.min.time())
+    return None
+
+async def cek_mutasi(
+    no_rekening: str,
+    session: AsyncSession,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    dari: Optional[datetime] = None,
+    sampai: Optional[datetime] = None,
+    jenis_transaksi: Optional[str] = None
+):
+    """Mengecek mutasi berdasarkan nomor rekening, per halaman dengan cursor keyset."""
     try:
-        # Query untuk mendapatkan semua mutasi berdasarkan nomor rekening
-        mutasi_records = session.query(Mutasi).filter(Mutasi.no_rekening == no_rekening).all()
-
-        if not mutasi_records:
-            logging.warning(f"Tidak ada mutasi untuk No Rekening: {no_rekening}")
+        query = _mutasi_query(no_rekening, dari, sampai, jenis_transaksi)
+
+        if cursor:
+            try:
+                cursor_tanggal, cursor_id = decode_cursor(cursor)
+            except (ValueError, binascii.Error):
+                logging.warning("Cursor tidak valid: %s", cursor)
+                return None, "Cursor tidak valid"
+            query = query.filter(tuple_(Mutasi.tanggal_transaksi, Mutasi.id) < tuple_(cursor_tanggal, cursor_id))
+
+        # Pada tabel berpartisi, batasi rentang waktu lebih dulu (partition pruning);
+        # ringkasan tidak tahu jenis transaksi, jadi filter jenis memakai query biasa
+        bawah = None
+        if MUTASI_PARTISI and not jenis_transaksi:
+            bawah = await _batas_bawah(session, no_rekening, cursor_tanggal if cursor else sampai, limit)
+
+        # Ambil satu baris ekstra untuk mengetahui apakah masih ada halaman berikutnya
+        result = await session.execute((query.filter(Mutasi.tanggal_transaksi >= bawah) if bawah else query).limit(limit + 1))
+        mutasi_records = result.all()
+
+        if bawah and len(mutasi_records) <= limit:
+            # Ringkasan belum lengkap (mis. belum dibangun ulang): ulangi tanpa batas bawah
+            result = await session.execute(query.limit(limit + 1))
+            mutasi_records = result.all()
+
+        if not mutasi_records and not cursor:
+            logging.warning("Tidak ada mutasi untuk No Rekening: %s", no_rekening)
             return [], "Tidak ada mutasi untuk No Rekening ini"
 
-        # Konversi hasil query ke format yang dapat digunakan
-        mutasi_list = [
-            {
-                "id": mutasi.id,
-                "no_rekening": mutasi.no_rekening,
-                "jenis_transaksi": mutasi.jenis_transaksi,
-                "tanggal_transaksi": mutasi.tanggal_transaksi.isoformat() if mutasi.tanggal_transaksi else None,
-                "nominal": mutasi.saldo,
-                "saldo": mutasi.saldo,
-                "keterangan": mutasi.keterangan
-            }
-            for mutasi in mutasi_records
-        ]
+        has_next = len(mutasi_records) > limit
+        mutasi_records = mutasi_records[:limit]
 
-        logging.info(f"Mutasi ditemukan untuk No Rekening={no_rekening}")
-        return mutasi_list, None
+        logging.info("Mutasi ditemukan untuk No Rekening=%s", no_rekening)
+        return {
+            "mutasi": [_mutasi_to_dict(mutasi) for mutasi in mutasi_records],
+            "next_cursor": encode_cursor(mutasi_records[-1]) if has_next else None
+        }, None
 
     except SQLAlchemyError as e:
-        logging.error(f"Kesalahan saat mengecek mutasi: {str(e)}")
+        logging.error("Kesalahan saat mengecek mutasi: %s", e)
         return None, str(e)
+
+async def stream_mutasi(
+    no_rekening: str,
+    session: AsyncSession,
+    dari: Optional[datetime] = None,
+    sampai: Optional[datetime] = None,
+    jenis_transaksi: Optional[str] = None
+):
+    """Mengalirkan seluruh mutasi sebagai NDJSON memakai server-side cursor."""
+    query = _mutasi_query(no_rekening, dari, sampai, jenis_transaksi).execution_options(yield_per=STREAM_BATCH_SIZE)
+    result = await session.stream(query)
+    async for row in result:
+        yield MutasiResponse.model_validate(_mutasi_to_dict(row)).model_dump_json() + "\n"
@@ -0,0 +1,137 @@
+import csv
+import io
+from datetime import datetime
+from typing import List, Optional
+from decouple import config
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from model import Mutasi
+from money import ke_rupiah
+
+# Jumlah baris yang diambil dari server-side cursor per potongan (= satu row group Parquet)
+EKSPOR_BATCH_SIZE = config("EKSPOR_BATCH_SIZE", default=10_000, cast=int)
+
+KOLOM_EKSPOR = ("id", "no_rekening", "jenis_transaksi", "tanggal_transaksi", "nominal", "saldo", "keterangan")
+
+
+def _ekspor_query(no_rekening_list: Optional[List[str]], dari: Optional[datetime], sampai: Optional[datetime]):
+    """Select Core (tanpa ORM) urut per rekening lalu waktu, sejalan dengan index (no_rekening, tanggal_transaksi, id)."""
+    tabel = Mutasi.__table__
+    query = select(*(tabel.c[kolom] for kolom in KOLOM_EKSPOR))
+    if no_rekening_list:
+        query = query.where(tabel.c.no_rekening.in_(no_rekening_list))
+    if dari:
+        query = query.where(tabel.c.tanggal_transaksi >= dari)
+    if sampai:
+        query = query.where(tabel.c.tanggal_transaksi <= sampai)
+    return query.order_by(tabel.c.no_rekening, tabel.c.tanggal_transaksi, tabel.c.id)
+
+
+async def _potongan_mutasi(
+    session: AsyncSession,
+    no_rekening_list: Optional[List[str]],
+    dari: Optional[datetime],
+    sampai: Optional[datetime],
+    batch_size: int
+):
+    """Mengambil baris mutasi per potongan lewat server-side cursor; memori tetap sebesar satu potongan."""
+    connection = await session.connection()
+    query = _ekspor_query(no_rekening_list, dari, sampai).execution_options(yield_per=batch_size)
+    result = await connection.stream(query)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def ekspor_csv(
+    session: AsyncSession,
+    no_rekening_list: Optional[List[str]] = None,
+    dari: Optional[datetime] = None,
+    sampai: Optional[datetime] = None,
+    batch_size: int = EKSPOR_BATCH_SIZE
+):
+    """Menghasilkan CSV (bytes UTF-8) per potongan; nominal dan saldo dalam rupiah."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(KOLOM_EKSPOR)
+    async for rows in _potongan_mutasi(session, no_rekening_list, dari, sampai, batch_size):
+        writer.writerows(
+            (id_, no_rekening, jenis, tanggal.isoformat() if tanggal else "", ke_rupiah(nominal), ke_rupiah(saldo), keterangan)
+            for id_, no_rekening, jenis, tanggal, nominal, saldo, keterangan in rows
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    sisa = buffer.getvalue()
+    if sisa:
+        # Hanya terjadi jika tidak ada baris sama sekali (header saja)
+        yield sisa.encode("utf-8")
+
+
+class _ChunkSink:
+    """File-like minimal untuk ParquetWriter; isi yang sudah ditulis bisa diambil per potongan."""
+
+    def __init__(self):
+        self._chunks = []
+        self._posisi = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._posisi += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._posisi
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def ambil(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def ekspor_parquet(
+    session: AsyncSession,
+    no_rekening_list: Optional[List[str]] = None,
+    dari: Optional[datetime] = None,
+    sampai: Optional[datetime] = None,
+    batch_size: int = EKSPOR_BATCH_SIZE
+):
+    """Menghasilkan Parquet (bytes) dengan satu row group per potongan; nominal dan saldo tetap dalam sen (kolom *_sen).
+
+    Membutuhkan pyarrow, yang hanya di-import saat format ini dipakai.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("no_rekening", pa.string()),
+        ("jenis_transaksi", pa.string()),
+        ("tanggal_transaksi", pa.timestamp("us")),
+        ("nominal_sen", pa.int64()),
+        ("saldo_sen", pa.int64()),
+        ("keterangan", pa.string())
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for rows in _potongan_mutasi(session, no_rekening_list, dari, sampai, batch_size):
+            kolom = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(nilai, type=field.type) for nilai, field in zip(kolom, schema)], schema=schema))
+            data = sink.ambil()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.ambil()
+
+
+EKSPORTIR = {"csv": ekspor_csv, "parquet": ekspor_parquet}
+MEDIA_TYPE = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from fastapi.responses import Response
+from respons import ORJSONResponse
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from decouple import config
+from config import AsyncSessionLocal
+from model import IdempotencyKey
+
+# Lama respons disimpan untuk replay
+IDEMPOTENCY_TTL = config("IDEMPOTENCY_TTL", default=86400, cast=int)  # detik
+# Klaim yang belum selesai dianggap basi setelah waktu ini (mis. worker mati di tengah request)
+IDEMPOTENCY_LOCK_TIMEOUT = config("IDEMPOTENCY_LOCK_TIMEOUT", default=60, cast=int)  # detik
+IDEMPOTENCY_SWEEP_INTERVAL = config("IDEMPOTENCY_SWEEP_INTERVAL", default=300, cast=int)  # detik
+
+
+async def _claim(key: str, request_hash: str):
+    """Mencoba mengklaim key; mengembalikan (True, None) atau (False, baris yang sudah ada)."""
+    async with AsyncSessionLocal() as session:
+        sekarang = datetime.now()
+        # Key yang sudah kedaluwarsa boleh dipakai ulang
+        await session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.expires_at < sekarang))
+        session.add(IdempotencyKey(
+            key=key,
+            request_hash=request_hash,
+            expires_at=sekarang + timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+        ))
+        try:
+            await session.commit()
+            return True, None
+        except IntegrityError:
+            await session.rollback()
+
+        result = await session.execute(select(IdempotencyKey).where(IdempotencyKey.key == key))
+        return False, result.scalars().first()
+
+
+async def _simpan(key: str, response: Response) -> None:
+    async with AsyncSessionLocal() as session:
+        existing = await session.get(IdempotencyKey, key)
+        existing.status_code = response.status_code
+        existing.response = response.body.decode()
+        existing.expires_at = datetime.now() + timedelta(seconds=IDEMPOTENCY_TTL)
+        await session.commit()
+
+
+async def _lepas(key: str) -> None:
+    # Hanya klaim yang belum punya respons: jika transaksi uangnya sempat di-commit
+    # (respons tersimpan bersamanya), key tetap dipertahankan untuk replay
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None)))
+        await session.commit()
+
+
+async def simpan_respons(session, hasil) -> None:
+    """Dipanggil crud tepat sebelum commit transaksi uang: respons sukses ditulis ke key yang
+    sedang diklaim dalam transaksi yang sama. Worker yang mati setelah commit tidak lagi
+    membuat request ulang mengeksekusi transaksi kedua kalinya setelah klaimnya basi."""
+    tertunda = session.info.get("idempotency")
+    if tertunda is None:
+        return
+    response = tertunda["respons"](hasil)
+    await session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == tertunda["key"])
+        .values(
+            status_code=response.status_code,
+            response=response.body.decode(),
+            expires_at=datetime.now() + timedelta(seconds=IDEMPOTENCY_TTL)
+        )
+    )
+    tertunda["tersimpan"] = True
+
+
+async def jalankan(idempotency_key, claims: dict, endpoint: str, payload: BaseModel, handler, session=None, respons=None) -> Response:
+    """Menjalankan handler sekali per Idempotency-Key; request ulang mendapat respons yang sama.
+
+    Jika ``session`` dan ``respons`` (penyusun respons sukses dari hasil crud) diberikan,
+    respons sukses disimpan oleh crud lewat simpan_respons di dalam transaksinya sendiri.
+    """
+    if not idempotency_key:
+        return await handler()
+
+    key = f"{claims.get('user_id')}:{endpoint}:{idempotency_key}"
+    request_hash = hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+    claimed, existing = await _claim(key, request_hash)
+    if not claimed:
+        if existing is None:
+            # Baris dihapus sweeper di antara insert dan select; minta klien mengulang
+            return ORJSONResponse(content={"remark": "Request dengan Idempotency-Key ini masih diproses"}, status_code=409)
+        if existing.request_hash != request_hash:
+            return ORJSONResponse(content={"remark": "Idempotency-Key sudah dipakai untuk request yang berbeda"}, status_code=422)
+        if existing.status_code is None:
+            return ORJSONResponse(content={"remark": "Request dengan Idempotency-Key ini masih diproses"}, status_code=409)
+        logging.info("Replay respons idempotent: %s", endpoint)
+        return Response(
+            content=existing.response,
+            status_code=existing.status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    tertunda = {"key": key, "respons": respons, "tersimpan": False}
+    if session is not None and respons is not None:
+        session.info["idempotency"] = tertunda
+    try:
+        response = await handler()
+    except BaseException:
+        await _lepas(key)
+        raise
+    finally:
+        if session is not None:
+            session.info.pop("idempotency", None)
+
+    # Error server tidak disimpan agar klien bisa mencoba lagi dengan key yang sama
+    if response.status_code >= 500:
+        await _lepas(key)
+    elif response.status_code >= 400 or not tertunda["tersimpan"]:
+        # Penolakan tidak mengubah saldo, jadi boleh disimpan di transaksi terpisah
+        await _simpan(key, response)
+    return response
+
+
+async def sweeper() -> None:
+    """Tugas latar belakang yang menghapus key kedaluwarsa secara berkala."""
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.now()))
+                await session.commit()
+                if result.rowcount:
+                    logging.info("Idempotency key kedaluwarsa dihapus: %s", result.rowcount)
+        except SQLAlchemyError as e:
+            logging.error("Kesalahan saat menghapus idempotency key: %s", e)
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_INTERVAL)
@@ -1,16 +1,58 @@
-import logging
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from config import engine
+from decouple import config
+from config import async_engine
 import model
 from router import router
+from metrics import MetricsMiddleware
+import idempotency
+import partisi
+import revokasi
+import outbox
+import ratelimit
+import audit
+from respons import ORJSONResponse
 
-# Konfigurasi logging
-logging.basicConfig(
-    level=logging.INFO,  # Set ke INFO untuk menangkap pesan level INFO
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Skema dikelola lewat `python manage.py migrate`; opsi ini hanya untuk pengembangan
+# dengan satu worker, karena beberapa worker yang membuat tabel bersamaan bisa bentrok
+MIGRATE_ON_STARTUP = config("MIGRATE_ON_STARTUP", default=False, cast=bool)
 
-model.Base.metadata.create_all(bind=engine)
+# Import modul ini tidak menyentuh database maupun membuat thread, sehingga aman
+# di-preload oleh proses master sebelum fork (lihat server.py)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Log JSON ditulis oleh thread listener per batch, bukan di jalur request;
+    # dibuat per worker karena thread tidak ikut tersalin saat fork
+    audit.setup_logging()
+    if MIGRATE_ON_STARTUP:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(model.Base.metadata.create_all)
+    tugas = [
+        # Tugas latar belakang untuk menghapus idempotency key yang sudah kedaluwarsa
+        asyncio.create_task(idempotency.sweeper()),
+        # Menyalin jti yang dicabut worker lain ke cache memori untuk JWTBearer
+        asyncio.create_task(revokasi.sinkronisasi())
+    ]
+    if outbox.OUTBOX_DISPATCHER:
+        # Mengirim event perubahan saldo dari tabel outbox ke sink
+        tugas.append(asyncio.create_task(outbox.dispatcher()))
+    # Partisi bulanan mutasi hanya ada di Postgres
+    if async_engine.dialect.name == "postgresql":
+        tugas.append(asyncio.create_task(partisi.pemelihara()))
+    yield
+    for t in tugas:
+        t.cancel()
+    # Ditunggu sampai benar-benar berhenti agar session-nya sudah mengembalikan koneksi ke pool
+    await asyncio.gather(*tugas, return_exceptions=True)
+    audit.shutdown_logging()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(router)
+# Ditambahkan lebih dulu (lebih dalam dari metrik) agar request yang ditolak tetap tercatat
+if ratelimit.RATE_LIMIT:
+    app.add_middleware(ratelimit.RateLimitMiddleware)
+# Middleware ASGI murni agar overhead per request tetap kecil
+app.add_middleware(MetricsMiddleware)
+# Ditambahkan terakhir agar menjadi lapisan terluar dan request id tersedia di seluruh request
+app.add_middleware(audit.RequestContextMiddleware)
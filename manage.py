@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from config import engine, AsyncSessionLocal, ReadSessionLocal, read_async_engine
+import crud
+import model
+import ekspor
+import partisi
+import server
+import velocity
+from money import ke_sen
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def migrate() -> None:
+    """Membuat tabel dan index yang belum ada. Dijalankan sekali per deploy, bukan oleh tiap worker."""
+    model.Base.metadata.create_all(bind=engine)
+    logging.info("Skema database sudah terbaru")
+
+
+def _backfill(sql: str, table: str, batch_size: int) -> None:
+    """Menjalankan UPDATE per rentang id dan commit per potongan agar lock tetap singkat."""
+    with engine.connect() as conn:
+        max_id = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar_one()
+    lo = 0
+    while lo < max_id:
+        hi = lo + batch_size
+        with engine.begin() as conn:
+            updated = conn.execute(text(sql), {"lo": lo, "hi": hi}).rowcount
+        logging.info(f"{table}: id {lo + 1} s/d {hi} diperbarui ({updated} baris)")
+        lo = hi
+
+
+def _cek_konservasi_saldo(conn) -> None:
+    """Membandingkan total kolom lama dan baru sebelum ditukar; selisih membatalkan migrasi."""
+    for table in ("nasabah", "mutasi"):
+        lama, baru, kosong = conn.execute(text(f"""
+            SELECT COALESCE(SUM(ROUND(COALESCE(saldo, 0)::numeric * 100)), 0),
+                   COALESCE(SUM(saldo_sen), 0),
+                   COUNT(*) FILTER (WHERE saldo_sen IS NULL)
+            FROM {table}
+        """)).one()
+        if lama != baru or kosong:
+            raise RuntimeError(f"Konservasi saldo {table} gagal: lama={lama} sen, baru={baru} sen, kosong={kosong}")
+        logging.info(f"{table}: total saldo {baru} sen cocok dengan kolom lama")
+
+
+def migrasi_saldo(batch_size: int) -> None:
+    """Migrasi online kolom saldo Float (rupiah) menjadi BigInteger (sen) untuk Postgres.
+
+    Kolom baru diisi bertahap per potongan id selagi aplikasi lama tetap berjalan,
+    lalu ditukar dalam satu transaksi singkat setelah total saldo kolom lama dan baru
+    dicocokkan. Kolom lama disimpan sebagai ``saldo_float_lama`` dan bisa di-drop
+    setelah rekonsiliasi.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE nasabah ADD COLUMN IF NOT EXISTS saldo_sen BIGINT"))
+        conn.execute(text("ALTER TABLE mutasi ADD COLUMN IF NOT EXISTS saldo_sen BIGINT"))
+        conn.execute(text("ALTER TABLE mutasi ADD COLUMN IF NOT EXISTS nominal BIGINT"))
+
+    nasabah_sql = """
+        UPDATE nasabah SET saldo_sen = ROUND(COALESCE(saldo, 0)::numeric * 100)
+        WHERE id > :lo AND id <= :hi AND saldo_sen IS NULL
+    """
+    # Nominal mutasi lama diturunkan dari selisih saldo dengan mutasi sebelumnya
+    # pada rekening yang sama (memakai index no_rekening, tanggal_transaksi, id)
+    mutasi_sql = """
+        UPDATE mutasi m SET
+            saldo_sen = ROUND(m.saldo::numeric * 100),
+            nominal = ABS(ROUND(m.saldo::numeric * 100) - COALESCE((
+                SELECT ROUND(p.saldo::numeric * 100) FROM mutasi p
+                WHERE p.no_rekening = m.no_rekening
+                  AND (p.tanggal_transaksi, p.id) < (m.tanggal_transaksi, m.id)
+                ORDER BY p.tanggal_transaksi DESC, p.id DESC
+                LIMIT 1
+            ), 0))
+        WHERE m.id > :lo AND m.id <= :hi AND m.saldo_sen IS NULL
+    """
+    _backfill(nasabah_sql, "nasabah", batch_size)
+    _backfill(mutasi_sql, "mutasi", batch_size)
+
+    with engine.begin() as conn:
+        # Kunci singkat untuk menyusul perubahan selama backfill lalu menukar kolom. Saldo
+        # nasabah yang sudah tersalin tetap diubah aplikasi lama, jadi semua baris dihitung
+        # ulang; mutasi hanya di-insert sehingga cukup baris yang belum terisi
+        conn.execute(text("LOCK TABLE nasabah, mutasi IN SHARE ROW EXCLUSIVE MODE"))
+        conn.execute(text("UPDATE nasabah SET saldo_sen = ROUND(COALESCE(saldo, 0)::numeric * 100)"))
+        conn.execute(text(mutasi_sql.replace("m.id > :lo AND m.id <= :hi AND ", "")))
+        _cek_konservasi_saldo(conn)
+        for table in ("nasabah", "mutasi"):
+            conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN saldo TO saldo_float_lama"))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN saldo_float_lama DROP NOT NULL"))
+            conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN saldo_sen TO saldo"))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN saldo SET NOT NULL"))
+        conn.execute(text("ALTER TABLE nasabah ALTER COLUMN saldo SET DEFAULT 0"))
+        conn.execute(text("ALTER TABLE mutasi ALTER COLUMN nominal SET NOT NULL"))
+    logging.info("Migrasi saldo ke sen selesai")
+
+
+def indeks_login() -> None:
+    """Membuat index unik lower(email) pada tabel nasabah yang sudah ada (Postgres) tanpa mengunci tulis."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_nasabah_email_lower ON nasabah (lower(email))"))
+    logging.info("Index login nasabah selesai dibuat")
+
+
+def indeks_mutasi() -> None:
+    """Membuat index (no_rekening, tanggal_transaksi, id) untuk pagination keyset mutasi pada
+    tabel yang sudah ada (Postgres) tanpa mengunci tulis; create_all tidak menambah index
+    ke tabel yang sudah ada."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # CREATE INDEX CONCURRENTLY yang terputus meninggalkan index INVALID yang
+        # dilewati IF NOT EXISTS; index seperti itu dibuang lalu dibuat ulang
+        tidak_valid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = 'ix_mutasi_no_rekening_tanggal_id' AND NOT i.indisvalid"
+        )).first()
+        if tidak_valid:
+            conn.execute(text("DROP INDEX CONCURRENTLY ix_mutasi_no_rekening_tanggal_id"))
+        conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_mutasi_no_rekening_tanggal_id "
+            "ON mutasi (no_rekening, tanggal_transaksi, id)"
+        ))
+    logging.info("Index mutasi (no_rekening, tanggal_transaksi, id) selesai dibuat")
+
+
+def kolom_jumlah_debit() -> None:
+    """Menambah kolom nasabah.jumlah_debit (versi penghitung velocity) pada tabel yang sudah ada (Postgres).
+
+    Default konstan tidak menulis ulang tabel di Postgres 11+, jadi kunci yang diambil singkat.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE nasabah ADD COLUMN IF NOT EXISTS jumlah_debit BIGINT NOT NULL DEFAULT 0"))
+    logging.info("Kolom jumlah_debit nasabah sudah ada")
+
+
+def bangun_ringkasan() -> None:
+    """Mengisi ulang mutasi_daily_summary dari riwayat mutasi (Postgres, sekali jalan).
+
+    Hari-hari pada partisi yang sudah diarsipkan tidak disentuh karena ringkasannya
+    menjadi satu-satunya sumber untuk rekonsiliasi.
+    """
+    batas = "COALESCE((SELECT MAX(sampai) FROM mutasi_arsip), '-infinity')"
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM mutasi_daily_summary WHERE tanggal >= {batas}"))
+        conn.execute(text(f"""
+            INSERT INTO mutasi_daily_summary
+                (no_rekening, tanggal, total_kredit, total_debit, jumlah_transaksi, saldo_penutupan)
+            SELECT
+                no_rekening,
+                tanggal_transaksi::date,
+                COALESCE(SUM(nominal) FILTER (WHERE jenis_transaksi = 'kredit'), 0),
+                COALESCE(SUM(nominal) FILTER (WHERE jenis_transaksi <> 'kredit'), 0),
+                COUNT(*),
+                (ARRAY_AGG(saldo ORDER BY tanggal_transaksi DESC, id DESC))[1]
+            FROM mutasi
+            WHERE tanggal_transaksi >= {batas}
+            GROUP BY no_rekening, tanggal_transaksi::date
+        """))
+    logging.info("Ringkasan harian mutasi selesai dibangun")
+
+
+async def _rekonsiliasi(no_rekening_list: list) -> None:
+    async with AsyncSessionLocal() as session:
+        for no_rekening in no_rekening_list:
+            hasil, error = await crud.rekonsiliasi(no_rekening, session)
+            print(no_rekening, error or hasil)
+
+
+async def _ekspor_mutasi(args) -> None:
+    """Menulis ekspor mutasi ke file per potongan tanpa memuat seluruh data ke memori."""
+    jumlah_byte = 0
+    async with ReadSessionLocal() as session:
+        with open(args.output, "wb") as f:
+            async for chunk in ekspor.EKSPORTIR[args.format](session, args.no_rekening, args.dari, args.sampai, args.batch_size):
+                f.write(chunk)
+                jumlah_byte += len(chunk)
+    await read_async_engine.dispose()
+    logging.info("Ekspor mutasi selesai: %s (%s byte)", args.output, jumlah_byte)
+
+
+def buat_partisi(bulan_ke_depan: int) -> None:
+    with engine.begin() as conn:
+        if not partisi.is_partitioned(conn):
+            raise SystemExit("Tabel mutasi belum berpartisi; jalankan partisi-mutasi lebih dulu")
+        partisi.buat_partisi(conn, bulan_ke_depan)
+
+
+async def _arsip_mutasi(args) -> None:
+    diarsipkan = await partisi.arsipkan(args.retensi_bulan, args.direktori)
+    await partisi.async_engine.dispose()
+    logging.info("Partisi diarsipkan: %s", ", ".join(diarsipkan) or "-")
+
+
+def atur_limit(no_rekening: str, jendela: str, nominal, jumlah) -> None:
+    """Menyimpan limit velocity khusus satu rekening; berlaku di worker setelah penghitungnya dimuat ulang."""
+    with Session(engine) as session:
+        session.merge(model.LimitRekening(
+            no_rekening=no_rekening,
+            jendela=jendela,
+            maks_nominal=ke_sen(nominal) if nominal is not None else None,
+            maks_jumlah=jumlah
+        ))
+        session.commit()
+    logging.info("Limit %s rekening %s disimpan (nominal=%s, jumlah=%s)", jendela, no_rekening, nominal, jumlah)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perintah administrasi aplikasi bank")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("migrate", help="Buat tabel dan index yang belum ada")
+
+    parser_serve = subparsers.add_parser("serve", help="Jalankan server (gunicorn preload + worker uvicorn)")
+    parser_serve.add_argument("--host", default=server.SERVER_HOST)
+    parser_serve.add_argument("--port", type=int, default=server.SERVER_PORT)
+    parser_serve.add_argument("--workers", type=int, default=server.WEB_CONCURRENCY)
+
+    parser_migrasi = subparsers.add_parser("migrasi-saldo", help="Migrasi kolom saldo Float ke BigInteger sen")
+    parser_migrasi.add_argument("--batch-size", type=int, default=10_000)
+
+    subparsers.add_parser("indeks-login", help="Buat index email tanpa membedakan huruf besar/kecil untuk login")
+
+    subparsers.add_parser("indeks-mutasi", help="Buat index pagination mutasi per rekening tanpa mengunci tulis")
+
+    subparsers.add_parser("kolom-jumlah-debit", help="Tambah kolom versi penghitung velocity pada tabel nasabah")
+
+    subparsers.add_parser("bangun-ringkasan", help="Bangun ulang ringkasan harian dari riwayat mutasi")
+
+    parser_rekon = subparsers.add_parser("rekonsiliasi", help="Cocokkan saldo dengan jumlah mutasi")
+    parser_rekon.add_argument("no_rekening", nargs="+")
+
+    parser_ekspor = subparsers.add_parser("ekspor-mutasi", help="Ekspor mutasi ke CSV atau Parquet")
+    parser_ekspor.add_argument("--no-rekening", nargs="*", default=None, help="Kosongkan untuk semua rekening")
+    parser_ekspor.add_argument("--dari", type=datetime.fromisoformat)
+    parser_ekspor.add_argument("--sampai", type=datetime.fromisoformat)
+    parser_ekspor.add_argument("--format", choices=sorted(ekspor.EKSPORTIR), default="csv")
+    parser_ekspor.add_argument("--batch-size", type=int, default=ekspor.EKSPOR_BATCH_SIZE)
+    parser_ekspor.add_argument("--output", required=True)
+
+    parser_partisi = subparsers.add_parser("partisi-mutasi", help="Ubah tabel mutasi menjadi berpartisi bulanan (Postgres)")
+    parser_partisi.add_argument("--bulan-ke-depan", type=int, default=partisi.PARTISI_BULAN_KE_DEPAN)
+
+    parser_buat = subparsers.add_parser("buat-partisi", help="Buat partisi bulan-bulan ke depan yang belum ada")
+    parser_buat.add_argument("--bulan-ke-depan", type=int, default=partisi.PARTISI_BULAN_KE_DEPAN)
+
+    parser_arsip = subparsers.add_parser("arsip-mutasi", help="Arsipkan partisi mutasi lama ke CSV gzip lalu hapus")
+    parser_arsip.add_argument("--retensi-bulan", type=int, default=partisi.PARTISI_RETENSI_BULAN)
+    parser_arsip.add_argument("--direktori", default=partisi.ARSIP_DIREKTORI)
+
+    parser_limit = subparsers.add_parser("limit-rekening", help="Atur limit velocity khusus satu rekening")
+    parser_limit.add_argument("no_rekening")
+    parser_limit.add_argument("--jendela", choices=[j.nama for j in velocity.JENDELA], required=True)
+    parser_limit.add_argument("--nominal", type=Decimal, help="Maksimum nominal (rupiah); kosongkan untuk limit default")
+    parser_limit.add_argument("--jumlah", type=int, help="Maksimum jumlah transaksi; kosongkan untuk limit default")
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate()
+    elif args.command == "serve":
+        server.jalankan(args.workers, args.host, args.port)
+    elif args.command == "migrasi-saldo":
+        migrasi_saldo(args.batch_size)
+    elif args.command == "indeks-login":
+        indeks_login()
+    elif args.command == "indeks-mutasi":
+        indeks_mutasi()
+    elif args.command == "kolom-jumlah-debit":
+        kolom_jumlah_debit()
+    elif args.command == "bangun-ringkasan":
+        bangun_ringkasan()
+    elif args.command == "rekonsiliasi":
+        asyncio.run(_rekonsiliasi(args.no_rekening))
+    elif args.command == "ekspor-mutasi":
+        asyncio.run(_ekspor_mutasi(args))
+    elif args.command == "partisi-mutasi":
+        partisi.migrasi_partisi(engine, args.bulan_ke_depan)
+    elif args.command == "buat-partisi":
+        buat_partisi(args.bulan_ke_depan)
+    elif args.command == "arsip-mutasi":
+        asyncio.run(_arsip_mutasi(args))
+    elif args.command == "limit-rekening":
+        atur_limit(args.no_rekening, args.jendela, args.nominal, args.jumlah)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Batas bucket histogram latensi (detik), mengikuti default client Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Histogram kumulatif sederhana dengan format ekspor Prometheus."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class RequestStats:
+    """Penghitung query database selama satu request."""
+
+    __slots__ = ("query_count", "query_time")
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+
+
+_request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+# Metrik per (method, route) dan per (method, route, status)
+_request_latency = {}
+_request_db_time = {}
+_request_total = {}
+_db_queries_total = {}
+
+
+def record_request(method: str, route: str, status: int, elapsed: float, stats: RequestStats) -> None:
+    key = (method, route)
+    latency = _request_latency.get(key)
+    if latency is None:
+        latency = _request_latency[key] = Histogram()
+        _request_db_time[key] = Histogram()
+        _db_queries_total[key] = 0
+    latency.observe(elapsed)
+    _request_db_time[key].observe(stats.query_time)
+    _db_queries_total[key] += stats.query_count
+    status_key = (method, route, status)
+    _request_total[status_key] = _request_total.get(status_key, 0) + 1
+
+
+class MetricsMiddleware:
+    """Middleware ASGI yang mencatat latensi, status, dan waktu query per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Pakai template route (mis. "/ceksaldo") agar label tidak meledak karena path param
+            route = scope.get("route")
+            record_request(scope["method"], route.path if route else "unmatched", status, time.perf_counter() - start, stats)
+            _request_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.query_count += 1
+        stats.query_time += elapsed
+
+
+def instrument_engine(engine) -> None:
+    """Memasang hook waktu query pada engine (sync maupun async)."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """QueuePool yang mencatat lama menunggu koneksi dan jumlah timeout."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_count = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.timeout_count = 0
+        self.invalidated_count = 0
+        # Koneksi basi (mis. setelah failover) yang terdeteksi pool_pre_ping
+        event.listen(self, "invalidate", self._on_invalidate)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.invalidated_count += 1
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.timeout_count += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkout_count += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+
+def pool_stats(engine) -> dict:
+    """Ringkasan kondisi pool koneksi sebuah engine (sync maupun async)."""
+    pool = getattr(engine, "sync_engine", engine).pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return {"status": pool.status()}
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkout_count": pool.checkout_count,
+        "checkout_wait_seconds_total": pool.checkout_wait_total,
+        "checkout_wait_seconds_max": pool.checkout_wait_max,
+        "timeout_count": pool.timeout_count,
+        "invalidated_count": pool.invalidated_count
+    }
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render_prometheus(gauges: dict = None) -> str:
+    """Menyusun seluruh metrik request dalam format teks Prometheus.
+
+    ``gauges`` berisi metrik tambahan: nama -> (tipe, help, [(labels, nilai), ...]).
+    """
+    lines = [
+        "# HELP http_request_duration_seconds Latensi request per route.",
+        "# TYPE http_request_duration_seconds histogram"
+    ]
+    for (method, route), histogram in _request_latency.items():
+        lines.extend(histogram.render("http_request_duration_seconds", _labels(method=method, route=route)))
+
+    lines.append("# HELP http_request_db_seconds Total waktu query database per request.")
+    lines.append("# TYPE http_request_db_seconds histogram")
+    for (method, route), histogram in _request_db_time.items():
+        lines.extend(histogram.render("http_request_db_seconds", _labels(method=method, route=route)))
+
+    lines.append("# HELP http_requests_total Jumlah request per route dan status.")
+    lines.append("# TYPE http_requests_total counter")
+    for (method, route, status), count in _request_total.items():
+        lines.append(f"http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}")
+
+    lines.append("# HELP db_queries_total Jumlah query database per route.")
+    lines.append("# TYPE db_queries_total counter")
+    for (method, route), count in _db_queries_total.items():
+        lines.append(f"db_queries_total{{{_labels(method=method, route=route)}}} {count}")
+
+    for name, (metric_type, help_text, samples) in (gauges or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{_labels(**labels)}}} {value}" if labels else f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
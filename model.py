@@ -1,33 +1,111 @@
-from sqlalchemy import Column, String, BigInteger, Float, DateTime, ForeignKey
+from sqlalchemy import Column, String, BigInteger, Integer, Text, Date, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+# SQLite hanya melakukan autoincrement pada kolom INTEGER PRIMARY KEY
+BigIntegerPK = BigInteger().with_variant(Integer, "sqlite")
+
 class Nasabah(Base):
     __tablename__ = 'nasabah'
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntegerPK, primary_key=True)
     nik = Column(String(50), unique=True, nullable=False)
     nama = Column(String(100), nullable=False)
     email = Column(String(100), unique=True, nullable=False)
     no_hp = Column(String(13), unique=True, nullable=False)
     no_rekening = Column(String(16), unique=True, nullable=False)
-    saldo = Column(Float, default=0.0)
+    saldo = Column(BigInteger, nullable=False, default=0)  # Dalam sen (1 rupiah = 100 sen)
+    # Jumlah mutasi debit sepanjang masa, dinaikkan bersama saldo; versi penghitung velocity
+    jumlah_debit = Column(BigInteger, nullable=False, default=0, server_default="0")
     password = Column(String(100), nullable=False) 
     created_at = Column(DateTime, default=func.now())
 
     # Relationship to Mutasi
     mutasi = relationship("Mutasi", back_populates="nasabah")
 
+    # Index fungsional untuk login dan cek duplikat email tanpa membedakan huruf besar/kecil
+    __table_args__ = (
+        Index("ix_nasabah_email_lower", func.lower(email), unique=True),
+    )
+
 class Mutasi(Base):
     __tablename__ = 'mutasi'
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntegerPK, primary_key=True)
     no_rekening = Column(String(16), ForeignKey('nasabah.no_rekening'), nullable=False)
     jenis_transaksi = Column(String(50), nullable=False)
-    tanggal_transaksi = Column(DateTime, default=func.now())
-    saldo = Column(Float, nullable=False)
+    tanggal_transaksi = Column(DateTime, nullable=False, default=func.now())  # Kunci partisi bulanan di Postgres
+    nominal = Column(BigInteger, nullable=False)  # Dalam sen, selalu positif; arah dari jenis_transaksi
+    saldo = Column(BigInteger, nullable=False)  # Saldo setelah transaksi, dalam sen
     keterangan = Column(String(255))  # Mengatur panjang kolom keterangan
     
     # Relationship to Nasabah
     nasabah = relationship("Nasabah", back_populates="mutasi")
+
+    # Index komposit untuk pagination keyset riwayat mutasi per rekening
+    __table_args__ = (
+        Index("ix_mutasi_no_rekening_tanggal_id", "no_rekening", "tanggal_transaksi", "id"),
+    )
+
+class MutasiHarian(Base):
+    __tablename__ = 'mutasi_daily_summary'
+    # Ringkasan per rekening per hari, diperbarui dalam transaksi yang sama dengan mutasi
+    no_rekening = Column(String(16), ForeignKey('nasabah.no_rekening'), primary_key=True)
+    tanggal = Column(Date, primary_key=True)
+    total_kredit = Column(BigInteger, nullable=False, default=0)  # Dalam sen
+    total_debit = Column(BigInteger, nullable=False, default=0)  # Dalam sen
+    jumlah_transaksi = Column(BigInteger, nullable=False, default=0)
+    saldo_penutupan = Column(BigInteger, nullable=False)  # Saldo setelah mutasi terakhir hari itu
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_key'
+    # Gabungan user_id, endpoint, dan nilai header Idempotency-Key
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # SHA-256 body request
+    status_code = Column(Integer)  # NULL selama request pertama masih diproses
+    response = Column(Text)
+    created_at = Column(DateTime, default=func.now())
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class RekeningBlok(Base):
+    __tablename__ = 'rekening_blok'
+    # Satu baris penghitung; tiap worker mengklaim satu blok nomor sekaligus
+    id = Column(BigIntegerPK, primary_key=True)
+    nilai_terakhir = Column(BigInteger, nullable=False)
+
+class ArsipMutasi(Base):
+    __tablename__ = 'mutasi_arsip'
+    # Partisi mutasi yang sudah dipindahkan ke file; rentang [dari, sampai)
+    nama_partisi = Column(String(63), primary_key=True)
+    dari = Column(DateTime)  # NULL untuk partisi yang mencakup seluruh riwayat awal
+    sampai = Column(DateTime, nullable=False)
+    jumlah_baris = Column(BigInteger, nullable=False)
+    file = Column(String(255), nullable=False)
+    diarsipkan_at = Column(DateTime, default=func.now())
+
+class TokenDicabut(Base):
+    __tablename__ = 'token_dicabut'
+    # jti refresh token yang sudah dirotasi atau dicabut; dipakai ulang berarti token bocor
+    jti = Column(String(32), primary_key=True)
+    user_id = Column(String(50), nullable=False)
+    dicabut_at = Column(DateTime, nullable=False, index=True)  # Acuan sinkronisasi cache antar worker
+    expires_at = Column(DateTime, nullable=False, index=True)  # Baris boleh dihapus setelah refresh token kedaluwarsa
+
+class Outbox(Base):
+    __tablename__ = 'outbox'
+    # Event perubahan saldo, ditulis dalam transaksi yang sama dengan mutasinya lalu
+    # dihapus oleh dispatcher setelah terkirim; id menjadi id event untuk deduplikasi
+    id = Column(BigIntegerPK, primary_key=True)
+    topik = Column(String(50), nullable=False)
+    kunci = Column(String(16), nullable=False)  # no_rekening, untuk partisi/urutan di sisi konsumen
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, nullable=False)
+
+class LimitRekening(Base):
+    __tablename__ = 'limit_rekening'
+    # Limit velocity khusus satu rekening; kolom NULL memakai limit default jendela tersebut
+    no_rekening = Column(String(16), ForeignKey('nasabah.no_rekening'), primary_key=True)
+    jendela = Column(String(20), primary_key=True)  # Nama jendela di velocity.JENDELA, mis. "harian"
+    maks_nominal = Column(BigInteger)  # Dalam sen
+    maks_jumlah = Column(Integer)
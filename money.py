@@ -0,0 +1,14 @@
+from decimal import Decimal
+
+# Semua saldo dan nominal disimpan sebagai bilangan bulat sen (1 rupiah = 100 sen)
+SEN_PER_RUPIAH = 100
+
+
+def ke_sen(nominal: Decimal) -> int:
+    """Mengubah nominal rupiah (maksimal 2 desimal) menjadi sen."""
+    return int((Decimal(nominal) * SEN_PER_RUPIAH).to_integral_value())
+
+
+def ke_rupiah(sen: int) -> Decimal:
+    """Mengubah sen menjadi rupiah dengan 2 desimal tanpa kehilangan presisi."""
+    return Decimal(sen).scaleb(-2)
@@ -0,0 +1,128 @@
+import asyncio
+import importlib
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+import orjson
+from decouple import config
+from sqlalchemy import delete, select
+from config import AsyncSessionLocal, async_engine
+from model import Outbox
+
+# Dispatcher berjalan di setiap worker; dengan SKIP LOCKED (Postgres) batch dibagi tanpa saling menunggu
+OUTBOX_DISPATCHER = config("OUTBOX_DISPATCHER", default=True, cast=bool)
+OUTBOX_BATCH_SIZE = config("OUTBOX_BATCH_SIZE", default=500, cast=int)
+OUTBOX_INTERVAL = config("OUTBOX_INTERVAL", default=0.5, cast=float)  # detik jeda saat outbox kosong
+# "file", "queue", atau path kelas sink sendiri "paket.modul:Kelas"
+OUTBOX_SINK = config("OUTBOX_SINK", default="file")
+OUTBOX_FILE = config("OUTBOX_FILE", default="outbox.jsonl")
+
+TOPIK_MUTASI = "mutasi"
+
+# Statistik pengiriman untuk /metrics
+_stats = {"terkirim": 0, "gagal": 0, "lag_total": 0.0, "lag_terakhir": 0.0, "terkirim_at": 0.0}
+
+
+def stats() -> dict:
+    return dict(_stats)
+
+
+def event_mutasi(row: dict) -> dict:
+    """Baris outbox untuk satu mutasi; nominal dan saldo tetap dalam sen agar presisi."""
+    return {
+        "topik": TOPIK_MUTASI,
+        "kunci": row["no_rekening"],
+        "payload": orjson.dumps({
+            "no_rekening": row["no_rekening"],
+            "jenis_transaksi": row["jenis_transaksi"],
+            "nominal_sen": row["nominal"],
+            "saldo_sen": row["saldo"],
+            "keterangan": row.get("keterangan"),
+            "tanggal_transaksi": row["tanggal_transaksi"]
+        }).decode(),
+        "created_at": row["tanggal_transaksi"]
+    }
+
+
+class FileSink:
+    """Menulis event sebagai JSON per baris ke file (pengganti lokal untuk message broker)."""
+
+    def __init__(self, path: str = OUTBOX_FILE):
+        self.path = Path(path)
+
+    def _tulis(self, data: bytes) -> None:
+        with self.path.open("ab") as f:
+            f.write(data)
+
+    async def kirim(self, events: list) -> None:
+        data = b"".join(orjson.dumps(event) + b"\n" for event in events)
+        # I/O file dijalankan di thread agar event loop tidak terblokir
+        await asyncio.to_thread(self._tulis, data)
+
+
+class QueueSink:
+    """Menaruh event ke asyncio.Queue di proses yang sama (untuk konsumen lokal dan benchmark)."""
+
+    def __init__(self, maxsize: int = 0):
+        self.queue = asyncio.Queue(maxsize)
+
+    async def kirim(self, events: list) -> None:
+        for event in events:
+            await self.queue.put(event)
+
+
+def buat_sink():
+    if OUTBOX_SINK == "file":
+        return FileSink()
+    if OUTBOX_SINK == "queue":
+        return QueueSink()
+    modul, _, nama = OUTBOX_SINK.partition(":")
+    return getattr(importlib.import_module(modul), nama)()
+
+
+async def kirim_batch(sink, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Mengirim satu batch event tertua lalu menghapusnya dari outbox; mengembalikan jumlahnya.
+
+    Pengiriman bersifat at-least-once: jika commit gagal setelah sink menerima event,
+    batch yang sama dikirim ulang, sehingga konsumen men-deduplikasi dengan id event.
+    """
+    query = select(Outbox.id, Outbox.topik, Outbox.kunci, Outbox.payload, Outbox.created_at).order_by(Outbox.id).limit(batch_size)
+    if async_engine.dialect.name == "postgresql":
+        # Baris yang sedang dikirim worker lain dilewati, bukan ditunggu
+        query = query.with_for_update(skip_locked=True)
+
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(query)).all()
+        if not rows:
+            await session.commit()
+            return 0
+
+        await sink.kirim([
+            {"id": row.id, "topik": row.topik, "kunci": row.kunci, "created_at": row.created_at.isoformat(), "data": orjson.loads(row.payload)}
+            for row in rows
+        ])
+        await session.execute(delete(Outbox).where(Outbox.id.in_([row.id for row in rows])))
+        await session.commit()
+
+    sekarang = datetime.now()
+    lag = [(sekarang - row.created_at).total_seconds() for row in rows]
+    _stats["terkirim"] += len(rows)
+    _stats["lag_total"] += sum(lag)
+    _stats["lag_terakhir"] = max(lag)
+    _stats["terkirim_at"] = time.time()
+    return len(rows)
+
+
+async def dispatcher(sink=None) -> None:
+    """Tugas latar belakang yang menguras outbox per batch; batch penuh langsung disusul batch berikutnya."""
+    sink = sink or buat_sink()
+    while True:
+        try:
+            jumlah = await kirim_batch(sink)
+        except Exception as e:
+            _stats["gagal"] += 1
+            logging.error("Kesalahan saat mengirim event outbox: %s", e)
+            jumlah = 0
+        if jumlah < OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(OUTBOX_INTERVAL)
@@ -0,0 +1,191 @@
+import asyncio
+import gzip
+import logging
+import re
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+from decouple import config
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from config import async_engine, AsyncSessionLocal
+from model import ArsipMutasi
+import ekspor
+
+# Partisi bulanan tabel mutasi (khusus Postgres); aktifkan MUTASI_PARTISI setelah migrasi
+MUTASI_PARTISI = config("MUTASI_PARTISI", default=False, cast=bool)
+PARTISI_BULAN_KE_DEPAN = config("PARTISI_BULAN_KE_DEPAN", default=3, cast=int)
+PARTISI_RETENSI_BULAN = config("PARTISI_RETENSI_BULAN", default=24, cast=int)
+PARTISI_INTERVAL = config("PARTISI_INTERVAL", default=86400, cast=int)  # detik
+ARSIP_DIREKTORI = config("ARSIP_DIREKTORI", default="arsip")
+
+_RENTANG = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def awal_bulan(tanggal: date) -> date:
+    return tanggal.replace(day=1)
+
+
+def tambah_bulan(bulan: date, jumlah: int) -> date:
+    index = bulan.month - 1 + jumlah
+    return date(bulan.year + index // 12, index % 12 + 1, 1)
+
+
+def nama_partisi(bulan: date) -> str:
+    return f"mutasi_y{bulan.year:04d}m{bulan.month:02d}"
+
+
+def _nilai_batas(nilai: str) -> Optional[datetime]:
+    # pg_get_expr menulis batas sebagai MINVALUE/MAXVALUE atau literal '2026-11-01 00:00:00'
+    if nilai in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(nilai.strip("'"))
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('mutasi'))"
+    )).scalar_one()
+
+
+def daftar_partisi(conn: Connection) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """Partisi mutasi beserta rentang [dari, sampai); None berarti MINVALUE/MAXVALUE."""
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'mutasi'::regclass
+    """)).all()
+    partisi = []
+    for nama, batas in rows:
+        dari, sampai = _RENTANG.search(batas).groups()
+        partisi.append((nama, _nilai_batas(dari), _nilai_batas(sampai)))
+    return sorted(partisi, key=lambda item: item[1] or datetime.min)
+
+
+def buat_partisi(conn: Connection, bulan_ke_depan: int = PARTISI_BULAN_KE_DEPAN) -> List[str]:
+    """Membuat partisi bulanan yang belum ada, dari batas atas partisi terakhir
+    (agar tidak ada celah) sampai bulan_ke_depan bulan setelah bulan ini."""
+    partisi = daftar_partisi(conn)
+    batas_atas = max((sampai for _, _, sampai in partisi if sampai), default=None)
+    bulan = awal_bulan(date.today())
+    if batas_atas and batas_atas.date() < bulan:
+        bulan = awal_bulan(batas_atas.date())
+    akhir = tambah_bulan(awal_bulan(date.today()), bulan_ke_depan)
+
+    dibuat = []
+    while bulan <= akhir:
+        berikutnya = tambah_bulan(bulan, 1)
+        if not batas_atas or bulan >= batas_atas.date():
+            nama = nama_partisi(bulan)
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {nama} PARTITION OF mutasi "
+                f"FOR VALUES FROM ('{bulan.isoformat()}') TO ('{berikutnya.isoformat()}')"
+            ))
+            dibuat.append(nama)
+        bulan = berikutnya
+    if dibuat:
+        logging.info("Partisi mutasi dibuat: %s", ", ".join(dibuat))
+    return dibuat
+
+
+def migrasi_partisi(engine: Engine, bulan_ke_depan: int = PARTISI_BULAN_KE_DEPAN) -> None:
+    """Mengubah mutasi menjadi tabel berpartisi bulanan tanpa menyalin data.
+
+    Tabel lama dipasang sebagai satu partisi untuk seluruh riwayat sampai awal
+    bulan setelah bulan depan; CHECK dan index unik disiapkan lebih dulu
+    (tanpa mengunci tulis) sehingga ATTACH tidak perlu memindai ulang tabel.
+    """
+    batas = tambah_bulan(awal_bulan(date.today()), 2)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if is_partitioned(conn):
+            logging.info("Tabel mutasi sudah berpartisi")
+            return
+        conn.execute(text(
+            "ALTER TABLE mutasi ADD CONSTRAINT mutasi_lama_rentang "
+            f"CHECK (tanggal_transaksi IS NOT NULL AND tanggal_transaksi < '{batas.isoformat()}') NOT VALID"
+        ))
+        conn.execute(text("ALTER TABLE mutasi VALIDATE CONSTRAINT mutasi_lama_rentang"))
+        # Primary key tabel berpartisi wajib memuat kolom partisi
+        conn.execute(text("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS mutasi_lama_id_tanggal ON mutasi (id, tanggal_transaksi)"))
+        # Tabel lama yang dibuat sebelum index keyset ada di model belum memilikinya
+        # (create_all tidak menambah index ke tabel yang sudah ada)
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_mutasi_no_rekening_tanggal_id ON mutasi (no_rekening, tanggal_transaksi, id)"))
+
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE mutasi IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text("ALTER TABLE mutasi RENAME TO mutasi_lama"))
+        conn.execute(text("ALTER TABLE mutasi_lama RENAME CONSTRAINT mutasi_pkey TO mutasi_lama_pkey"))
+        conn.execute(text("ALTER INDEX ix_mutasi_no_rekening_tanggal_id RENAME TO mutasi_lama_no_rekening_tanggal_id"))
+        conn.execute(text("ALTER TABLE mutasi_lama ALTER COLUMN tanggal_transaksi SET NOT NULL"))
+        # Partisi tidak boleh punya primary key sendiri yang berbeda dari induknya;
+        # index unik (id, tanggal_transaksi) yang sudah disiapkan dijadikan primary key
+        conn.execute(text(
+            "ALTER TABLE mutasi_lama DROP CONSTRAINT mutasi_lama_pkey, "
+            "ADD CONSTRAINT mutasi_lama_id_tanggal PRIMARY KEY USING INDEX mutasi_lama_id_tanggal"
+        ))
+
+        # Default id (sequence mutasi_id_seq) ikut tersalin sehingga id tetap berlanjut
+        conn.execute(text("CREATE TABLE mutasi (LIKE mutasi_lama INCLUDING DEFAULTS) PARTITION BY RANGE (tanggal_transaksi)"))
+        conn.execute(text("ALTER TABLE mutasi ADD CONSTRAINT mutasi_pkey PRIMARY KEY (id, tanggal_transaksi)"))
+        conn.execute(text("ALTER TABLE mutasi ADD FOREIGN KEY (no_rekening) REFERENCES nasabah (no_rekening)"))
+        conn.execute(text("CREATE INDEX ix_mutasi_no_rekening_tanggal_id ON mutasi (no_rekening, tanggal_transaksi, id)"))
+        conn.execute(text("ALTER SEQUENCE mutasi_id_seq OWNED BY mutasi.id"))
+        conn.execute(text(f"ALTER TABLE mutasi ATTACH PARTITION mutasi_lama FOR VALUES FROM (MINVALUE) TO ('{batas.isoformat()}')"))
+        buat_partisi(conn, bulan_ke_depan)
+    logging.info("Migrasi partisi mutasi selesai; riwayat lama ada di partisi mutasi_lama")
+
+
+async def pemelihara() -> None:
+    """Tugas latar belakang yang memastikan partisi bulan-bulan ke depan sudah ada."""
+    while True:
+        try:
+            async with async_engine.begin() as conn:
+                if await conn.run_sync(is_partitioned):
+                    await conn.run_sync(buat_partisi)
+        except Exception as e:
+            logging.error("Kesalahan saat membuat partisi mutasi: %s", e)
+        await asyncio.sleep(PARTISI_INTERVAL)
+
+
+async def _ekspor_gzip(path: Path, dari: Optional[datetime], sampai: datetime) -> int:
+    """Menulis mutasi dalam rentang [dari, sampai) ke CSV gzip; mengembalikan jumlah baris."""
+    jumlah_baris = -1  # baris header tidak dihitung
+    async with AsyncSessionLocal() as session:
+        with gzip.open(path, "wb") as f:
+            # Resolusi timestamp Postgres adalah mikrodetik, jadi batas inklusif ini tepat
+            async for chunk in ekspor.ekspor_csv(session, None, dari, sampai - timedelta(microseconds=1)):
+                f.write(chunk)
+                jumlah_baris += chunk.count(b"\r\n")
+    return jumlah_baris
+
+
+async def arsipkan(retensi_bulan: int = PARTISI_RETENSI_BULAN, direktori: str = ARSIP_DIREKTORI) -> List[str]:
+    """Memindahkan partisi yang seluruhnya lebih tua dari retensi ke file CSV gzip,
+    lalu melepas dan menghapus partisinya. Ringkasan harian tetap disimpan."""
+    batas = datetime.combine(tambah_bulan(awal_bulan(date.today()), -retensi_bulan), datetime.min.time())
+    Path(direktori).mkdir(parents=True, exist_ok=True)
+
+    async with async_engine.connect() as conn:
+        partisi = await conn.run_sync(daftar_partisi)
+
+    diarsipkan = []
+    for nama, dari, sampai in partisi:
+        if sampai is None or sampai > batas:
+            continue
+        path = Path(direktori) / f"{nama}.csv.gz"
+        jumlah_baris = await _ekspor_gzip(path, dari, sampai)
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(text(f"ALTER TABLE mutasi DETACH PARTITION {nama}"))
+            jumlah_tabel = (await session.execute(text(f"SELECT COUNT(*) FROM {nama}"))).scalar_one()
+            if jumlah_tabel != jumlah_baris:
+                await session.rollback()
+                raise RuntimeError(f"Jumlah baris arsip {nama} tidak cocok: {jumlah_baris} != {jumlah_tabel}")
+            await session.execute(text(f"DROP TABLE {nama}"))
+            session.add(ArsipMutasi(nama_partisi=nama, dari=dari, sampai=sampai, jumlah_baris=jumlah_baris, file=str(path)))
+            await session.commit()
+
+        logging.info("Partisi %s diarsipkan ke %s (%s baris)", nama, path, jumlah_baris)
+        diarsipkan.append(nama)
+    return diarsipkan
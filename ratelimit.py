@@ -0,0 +1,241 @@
+import logging
+import math
+import threading
+import time
+from typing import NamedTuple, Optional
+from decouple import config
+from respons import ORJSONResponse
+from auth.auth_handler import decode_jwt_cached, is_dicabut
+
+# Pembatasan laju (token bucket) dan batas request bersamaan per route. Default mati:
+# di belakang load balancer semua klien tampak dari satu IP, sehingga batas per IP
+# hanya benar jika RATE_LIMIT_TRUST_PROXY juga diaktifkan
+RATE_LIMIT = config("RATE_LIMIT", default=False, cast=bool)
+# "memory" (per proses worker) atau "redis" (dibagi antar worker dan server)
+RATE_LIMIT_BACKEND = config("RATE_LIMIT_BACKEND", default="memory")
+REDIS_URL = config("REDIS_URL", default="redis://localhost:6379/0")
+RATE_LIMIT_SHARDS = config("RATE_LIMIT_SHARDS", default=64, cast=int)
+RATE_LIMIT_MAX_KEYS = config("RATE_LIMIT_MAX_KEYS", default=200_000, cast=int)
+# Pengali semua rate dan burst, mis. 0.5 untuk lingkungan yang lebih ketat
+RATE_LIMIT_SKALA = config("RATE_LIMIT_SKALA", default=1.0, cast=float)
+# Pakai alamat pertama X-Forwarded-For hanya jika aplikasi berada di belakang proxy tepercaya
+RATE_LIMIT_TRUST_PROXY = config("RATE_LIMIT_TRUST_PROXY", default=False, cast=bool)
+
+
+class Batas(NamedTuple):
+    rate: float  # token per detik
+    burst: int  # kapasitas bucket
+
+
+class Aturan(NamedTuple):
+    per_ip: Optional[Batas] = None
+    # Per user_id dari access token yang valid; request tanpa token valid hanya kena batas per IP
+    # (lalu ditolak JWTBearer), sehingga tidak bisa menghabiskan kuota pengguna lain
+    per_pengguna: Optional[Batas] = None
+    maks_bersamaan: Optional[int] = None  # per proses worker
+
+
+# Route mahal (bcrypt, batch, ekspor) diberi batas paling ketat
+ATURAN_ROUTE = {
+    "/daftar": Aturan(per_ip=Batas(0.2, 5), maks_bersamaan=32),
+    "/login": Aturan(per_ip=Batas(1, 10), maks_bersamaan=32),
+    "/refresh": Aturan(per_ip=Batas(2, 20)),
+    "/tabung": Aturan(per_ip=Batas(20, 40), per_pengguna=Batas(5, 10)),
+    "/tarik": Aturan(per_ip=Batas(20, 40), per_pengguna=Batas(5, 10)),
+    "/transfer": Aturan(per_ip=Batas(20, 40), per_pengguna=Batas(5, 10)),
+    "/batch": Aturan(per_ip=Batas(1, 5), maks_bersamaan=4),
+    "/ceksaldo": Aturan(per_ip=Batas(20, 50), per_pengguna=Batas(10, 20)),
+    "/cekmutasi": Aturan(per_ip=Batas(10, 30), per_pengguna=Batas(5, 10)),
+    "/ringkasan": Aturan(per_ip=Batas(10, 30), per_pengguna=Batas(5, 10)),
+    "/export/mutasi": Aturan(per_ip=Batas(0.2, 2), maks_bersamaan=2),
+}
+
+# Jumlah request yang ditolak per (route, alasan), untuk /metrics
+_ditolak = {}
+
+
+def stats() -> dict:
+    return dict(_ditolak)
+
+
+def _skala(batas: Optional[Batas]) -> Optional[Batas]:
+    if batas is None or RATE_LIMIT_SKALA == 1.0:
+        return batas
+    return Batas(batas.rate * RATE_LIMIT_SKALA, max(1, int(batas.burst * RATE_LIMIT_SKALA)))
+
+
+class MemoryStore:
+    """Token bucket di memori proses, dibagi ke beberapa shard dengan lock masing-masing
+    agar aman dipakai dari thread lain tanpa satu lock global."""
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self._max_per_shard = max(1, max_keys // shards)
+
+    async def ambil(self, key: str, batas: Batas) -> float:
+        return self.ambil_sync(key, batas)
+
+    def ambil_sync(self, key: str, batas: Batas) -> float:
+        """Mengambil satu token; mengembalikan 0 jika diizinkan, atau detik sampai token tersedia."""
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        sekarang = time.monotonic()
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self._max_per_shard:
+                    self._buang(buckets, sekarang)
+                # Entri: [token, waktu update, waktu bucket kembali penuh]
+                bucket = buckets[key] = [batas.burst, sekarang, sekarang]
+            tokens = min(batas.burst, bucket[0] + (sekarang - bucket[1]) * batas.rate)
+            tunggu = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                tunggu = (1 - tokens) / batas.rate
+            bucket[0], bucket[1] = tokens, sekarang
+            bucket[2] = sekarang + (batas.burst - tokens) / batas.rate
+            return tunggu
+
+    def _buang(self, buckets: dict, sekarang: float) -> None:
+        # Bucket yang sudah penuh kembali sama dengan bucket baru, jadi aman dibuang
+        for key in [key for key, bucket in buckets.items() if bucket[2] <= sekarang]:
+            del buckets[key]
+        if len(buckets) >= self._max_per_shard:
+            # Semua masih aktif: buang yang paling lama dibuat
+            del buckets[next(iter(buckets))]
+
+
+# Token bucket atomik di Redis; waktu dikirim klien agar juga bisa dipakai oleh fake lokal
+_SCRIPT_REDIS = """
+local data = redis.call('HMGET', KEYS[1], 't', 'ts')
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local tunggu = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    tunggu = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(tunggu)
+"""
+
+
+class RedisStore:
+    """Token bucket di Redis (atau server/fake yang kompatibel dengan EVAL), dibagi antar worker.
+
+    ``client`` cukup menyediakan coroutine ``eval(script, numkeys, *keys_and_args)``.
+    Jika Redis tidak bisa dihubungi, request diizinkan (fail open) dan error dicatat.
+    """
+
+    def __init__(self, client, prefix: str = "rl:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def ambil(self, key: str, batas: Batas) -> float:
+        try:
+            hasil = await self.client.eval(_SCRIPT_REDIS, 1, self.prefix + key, batas.rate, batas.burst, time.time())
+        except Exception as e:
+            logging.error("Rate limiter Redis gagal, request diizinkan: %s", e)
+            return 0.0
+        return float(hasil)
+
+
+def buat_store():
+    if RATE_LIMIT_BACKEND == "redis":
+        # Dependensi opsional, hanya di-import jika backend ini dipakai
+        import redis.asyncio as redis
+        return RedisStore(redis.from_url(REDIS_URL))
+    return MemoryStore()
+
+
+def _pengguna(scope) -> Optional[str]:
+    """user_id dari access token Bearer yang valid dan belum dicabut (decode memakai cache
+    yang sama dengan JWTBearer), atau None."""
+    for nama, nilai in scope["headers"]:
+        if nama == b"authorization":
+            if nilai[:7].lower() != b"bearer ":
+                return None
+            claims = decode_jwt_cached(nilai[7:].strip().decode("latin-1"))
+            if not claims or claims.get("type") != "access" or is_dicabut(claims):
+                return None
+            return str(claims.get("user_id"))
+    return None
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI murni: token bucket per IP dan per pengguna terautentikasi untuk setiap
+    route di ATURAN_ROUTE, serta batas request bersamaan untuk route yang mahal."""
+
+    def __init__(self, app, store=None, aturan: dict = None):
+        self.app = app
+        self.store = store or buat_store()
+        self.aturan = {
+            route: Aturan(_skala(a.per_ip), _skala(a.per_pengguna), a.maks_bersamaan)
+            for route, a in (aturan or ATURAN_ROUTE).items()
+        }
+        self._berjalan = dict.fromkeys(self.aturan, 0)
+        # Store di memori dipanggil langsung tanpa membuat coroutine per request
+        self._ambil_sync = getattr(self.store, "ambil_sync", None)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = scope["path"]
+        aturan = self.aturan.get(route)
+        if aturan is None:
+            await self.app(scope, receive, send)
+            return
+
+        if aturan.per_ip:
+            key = f"{route}:ip:{self._ip(scope)}"
+            tunggu = self._ambil_sync(key, aturan.per_ip) if self._ambil_sync else await self.store.ambil(key, aturan.per_ip)
+            if tunggu:
+                await self._tolak(scope, receive, send, route, "ip", tunggu)
+                return
+
+        if aturan.per_pengguna:
+            user_id = _pengguna(scope)
+            if user_id is not None:
+                key = f"{route}:user:{user_id}"
+                tunggu = self._ambil_sync(key, aturan.per_pengguna) if self._ambil_sync else await self.store.ambil(key, aturan.per_pengguna)
+                if tunggu:
+                    await self._tolak(scope, receive, send, route, "pengguna", tunggu)
+                    return
+
+        if aturan.maks_bersamaan is None:
+            await self.app(scope, receive, send)
+            return
+        if self._berjalan[route] >= aturan.maks_bersamaan:
+            await self._tolak(scope, receive, send, route, "bersamaan", 1.0, status_code=503)
+            return
+        self._berjalan[route] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._berjalan[route] -= 1
+
+    @staticmethod
+    def _ip(scope) -> str:
+        if RATE_LIMIT_TRUST_PROXY:
+            for nama, nilai in scope["headers"]:
+                if nama == b"x-forwarded-for":
+                    return nilai.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "-"
+
+    async def _tolak(self, scope, receive, send, route: str, alasan: str, tunggu: float, status_code: int = 429):
+        key = (route, alasan)
+        _ditolak[key] = _ditolak.get(key, 0) + 1
+        response = ORJSONResponse(
+            content={"remark": "Terlalu banyak request, silakan coba lagi nanti"},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(tunggu)))}
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from decouple import config
+from config import AsyncSessionLocal
+from model import RekeningBlok
+
+# Format nomor rekening: prefix (3) + serial (12) + check digit Luhn (1) = 16 digit
+PREFIX_REKENING = "113"
+PANJANG_SERIAL = 12
+# Jumlah nomor yang diklaim per round trip ke database
+REKENING_BLOCK_SIZE = config("REKENING_BLOCK_SIZE", default=1000, cast=int)
+
+
+def luhn_check_digit(digits: str) -> str:
+    """Menghitung check digit Luhn untuk deretan angka."""
+    total = 0
+    # Digit paling kanan (sebelum check digit) dikalikan dua, lalu berselang-seling
+    for index, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if index % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+def format_no_rekening(serial: int) -> str:
+    body = f"{PREFIX_REKENING}{serial:0{PANJANG_SERIAL}d}"
+    return body + luhn_check_digit(body)
+
+
+def is_valid_no_rekening(no_rekening: str) -> bool:
+    """Validasi format dan check digit tanpa perlu query ke database."""
+    return (
+        len(no_rekening) == len(PREFIX_REKENING) + PANJANG_SERIAL + 1
+        and no_rekening.isdigit()
+        and luhn_check_digit(no_rekening[:-1]) == no_rekening[-1]
+    )
+
+
+def is_no_rekening_lama(no_rekening: str) -> bool:
+    """Format sebelum nomor ber-check digit: prefix + 8 digit acak (11 digit), masih
+    dipakai nasabah lama sehingga tetap harus bisa dipakai login."""
+    return len(no_rekening) == len(PREFIX_REKENING) + 8 and no_rekening.isdigit() and no_rekening.startswith(PREFIX_REKENING)
+
+
+class RekeningAllocator:
+    """Membagikan nomor rekening unik dari blok yang diklaim per worker."""
+
+    def __init__(self, session_factory=AsyncSessionLocal, block_size: int = REKENING_BLOCK_SIZE):
+        self.session_factory = session_factory
+        self.block_size = block_size
+        # Rentang serial (inklusif) yang sedang dipegang worker ini; awalnya kosong
+        self._next = 1
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def allocate(self) -> str:
+        async with self._lock:
+            if self._next > self._end:
+                await self._claim_block()
+            serial = self._next
+            self._next += 1
+        return format_no_rekening(serial)
+
+    async def _claim_block(self) -> None:
+        # Klaim blok di session tersendiri dan langsung di-commit, sehingga blok
+        # tidak ikut dibatalkan jika transaksi signup yang memintanya gagal
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(RekeningBlok)
+                .where(RekeningBlok.id == 1)
+                .values(nilai_terakhir=RekeningBlok.nilai_terakhir + self.block_size)
+                .returning(RekeningBlok.nilai_terakhir)
+            )
+            end = result.scalar_one_or_none()
+
+            if end is None:
+                # Baris penghitung belum ada; jika worker lain lebih dulu membuatnya, ulangi klaim
+                try:
+                    session.add(RekeningBlok(id=1, nilai_terakhir=self.block_size))
+                    await session.commit()
+                    end = self.block_size
+                except IntegrityError:
+                    await session.rollback()
+                    await self._claim_block()
+                    return
+            else:
+                await session.commit()
+
+        self._next, self._end = end - self.block_size + 1, end
+        logging.info("Blok nomor rekening diklaim: serial %s s/d %s", self._next, self._end)
+
+
+rekening_allocator = RekeningAllocator()
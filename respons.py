@@ -0,0 +1,25 @@
+from decimal import Decimal
+import orjson
+from fastapi import responses
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+
+def _default(obj):
+    # Decimal (rupiah) dikirim sebagai angka, sama seperti jsonable_encoder sebelumnya
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+class ORJSONResponse(responses.ORJSONResponse):
+    """JSONResponse berbasis orjson yang juga menerima Decimal."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def model_response(model: type[BaseModel], data, status_code: int = 200) -> Response:
+    """Serialisasi langsung ke bytes JSON oleh serializer pydantic-core milik model
+    (dibangun sekali saat kelas didefinisikan), tanpa jsonable_encoder."""
+    return Response(content=model.model_validate(data).model_dump_json(), status_code=status_code, media_type="application/json")
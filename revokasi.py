@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+from decouple import config
+from config import AsyncSessionLocal
+from model import TokenDicabut
+from auth.auth_handler import ACCESS_TOKEN_EXPIRE_MINUTES, cabut_jti
+
+# Jeda sinkronisasi jti yang dicabut oleh worker lain ke cache memori
+REVOKASI_SYNC_INTERVAL = config("REVOKASI_SYNC_INTERVAL", default=5, cast=int)  # detik
+REVOKASI_SWEEP_INTERVAL = config("REVOKASI_SWEEP_INTERVAL", default=3600, cast=int)  # detik
+
+# Access token pasangan refresh token yang dicabut paling lama berlaku selama ini,
+# jadi cache memori cukup menyimpan jti selama itu (tabel tetap menyimpan sampai exp)
+MASA_CACHE = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
+# Penghitung penerbitan token; setiap refresh adalah satu verifikasi bcrypt yang dihemat
+_penerbitan = {"login": 0, "refresh": 0, "reuse": 0}
+
+
+def catat(jenis: str) -> None:
+    _penerbitan[jenis] += 1
+
+
+def stats() -> dict:
+    return dict(_penerbitan)
+
+
+def ke_cache(jti: str, dicabut_at: datetime) -> None:
+    cabut_jti(jti, (dicabut_at + MASA_CACHE).timestamp())
+
+
+async def sinkronisasi() -> None:
+    """Tugas latar belakang yang menyalin jti dicabut dari database ke cache memori
+    worker ini, dan sesekali menghapus baris yang refresh token-nya sudah kedaluwarsa."""
+    terakhir = datetime.now() - MASA_CACHE
+    sapu_berikutnya = datetime.now()
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                sekarang = datetime.now()
+                # Tumpang tindih satu interval agar commit yang terlambat tidak terlewat
+                result = await session.execute(
+                    select(TokenDicabut.jti, TokenDicabut.dicabut_at)
+                    .where(TokenDicabut.dicabut_at >= terakhir - timedelta(seconds=REVOKASI_SYNC_INTERVAL))
+                )
+                for jti, dicabut_at in result:
+                    ke_cache(jti, dicabut_at)
+                terakhir = sekarang
+
+                if sekarang >= sapu_berikutnya:
+                    result = await session.execute(delete(TokenDicabut).where(TokenDicabut.expires_at < sekarang))
+                    if result.rowcount:
+                        logging.info("Token dicabut yang kedaluwarsa dihapus: %s", result.rowcount)
+                    sapu_berikutnya = sekarang + timedelta(seconds=REVOKASI_SWEEP_INTERVAL)
+                await session.commit()
+        except SQLAlchemyError as e:
+            logging.error("Kesalahan saat sinkronisasi token dicabut: %s", e)
+        await asyncio.sleep(REVOKASI_SYNC_INTERVAL)
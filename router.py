@@ -1,146 +1,352 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from config import SessionLocal
+from datetime import date, datetime
+from typing import List, Literal, Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import AsyncSessionLocal, ReadSessionLocal, async_engine, read_async_engine
+from cache import balance_cache
+from metrics import pool_stats, render_prometheus
 import crud
-from schema import user,UserLogin,Tabung,Tarik,Transfer
-from model import Nasabah
-from auth.auth_bearer import JWTBearer
-from auth.auth_handler import sign_jwt, get_password_hash, verify_password, create_access_token,decode_refresh_token
+import ekspor
+import idempotency
+import revokasi
+import outbox
+import ratelimit
+import velocity
+from respons import ORJSONResponse, model_response
+from schema import user,UserLogin,RefreshRequest,Tabung,Tarik,Transfer,Batch
+from schema import DaftarResponse, TokenResponse, SaldoResponse, TransferResponse, HalamanMutasi, RingkasanResponse
+from auth.auth_bearer import JWTBearer, BackOfficeKey
+from auth.auth_handler import sign_jwt, get_password_hash, verify_password, create_access_token,decode_refresh_token, PasswordPoolBusy
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    # Session untuk endpoint baca saja; diarahkan ke replica jika READ_REPLICA_URL diisi
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-@router.post("/daftar")
-async def daftar(data: user, db: Session = Depends(get_db)):
+@router.post("/daftar", response_model=DaftarResponse)
+async def daftar(data: user, db: AsyncSession = Depends(get_db)):
     """Endpoint untuk mendaftar nasabah baru."""
     try:
-        nasabah, error = crud.signup(data, db)
+        nasabah, error = await crud.signup(data, db)
 
         if error:
             raise HTTPException(status_code=400, detail=error)
         
-        return JSONResponse(content={"no_rekening": nasabah.no_rekening}, status_code=200)
+        return model_response(DaftarResponse, {"no_rekening": nasabah.no_rekening})
 
     except HTTPException as http_exc:
-        return JSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+
+    except PasswordPoolBusy as busy:
+        return ORJSONResponse(content={"remark": str(busy)}, status_code=429, headers={"Retry-After": "1"})
 
     except Exception as e:
-        return JSONResponse(content={"remark": str(e)}, status_code=400)
+        return ORJSONResponse(content={"remark": str(e)}, status_code=400)
     
-@router.post("/login")
-async def login(data:UserLogin, db: Session = Depends(get_db)):
+@router.post("/login", response_model=TokenResponse)
+async def login(data:UserLogin, db: AsyncSession = Depends(get_db)):
     """Endpoint untuk login nasabah dan mendapatkan token JWT."""
     try:
         # Menggunakan fungsi login dari crud.py
-        user, error = crud.login(data, db)
+        user, error = await crud.login(data, db)
         
         if error:
             raise HTTPException(status_code=400, detail=error)
         
         # Jika login berhasil, kembalikan token
-        return JSONResponse(content=user, status_code=200)
+        return model_response(TokenResponse, user)
     
     except HTTPException as http_exc:
-        return JSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+
+    except PasswordPoolBusy as busy:
+        return ORJSONResponse(content={"remark": str(busy)}, status_code=429, headers={"Retry-After": "1"})
 
     except Exception as e:
-        return JSONResponse(content={"remark": str(e)}, status_code=400)
+        return ORJSONResponse(content={"remark": str(e)}, status_code=400)
     
 
-@router.post("/tabung", dependencies=[Depends(JWTBearer())])
-async def tabung(data: Tabung, db: Session = Depends(get_db)):
+@router.post("/refresh", response_model=TokenResponse)
+async def refresh(data: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """Endpoint untuk menukar refresh token dengan pasangan token baru (rotasi)."""
+    try:
+        tokens, error = await crud.refresh(data, db)
+
+        if error:
+            # 401 agar klien tahu harus login ulang
+            raise HTTPException(status_code=401, detail=error)
+
+        return model_response(TokenResponse, tokens)
+
+    except HTTPException as http_exc:
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+
+    except Exception as e:
+        return ORJSONResponse(content={"remark": str(e)}, status_code=400)
+
+
+def _respons_saldo(saldo):
+    return model_response(SaldoResponse, {"saldo": saldo})
+
+def _respons_transfer(saldo):
+    return model_response(TransferResponse, {"saldo": saldo})
+
+
+@router.post("/tabung", response_model=SaldoResponse)
+async def tabung(
+    data: Tabung,
+    db: AsyncSession = Depends(get_db),
+    claims: dict = Depends(JWTBearer()),
+    idempotency_key: Optional[str] = Header(None, max_length=200)
+):
     """Endpoint untuk menabung ke rekening nasabah."""
+    return await idempotency.jalankan(
+        idempotency_key, claims, "/tabung", data, lambda: _tabung(data, db), session=db, respons=_respons_saldo
+    )
+
+async def _tabung(data: Tabung, db: AsyncSession):
+    """Menjalankan crud.tabung dan menyusun responsnya."""
     try:
-        saldo, error = crud.tabung(data, db)  # Pastikan memanggil fungsi crud.tabung()
+        saldo, error = await crud.tabung(data, db)  # Pastikan memanggil fungsi crud.tabung()
+
+        if error == crud.KESALAHAN_DATABASE:
+            raise HTTPException(status_code=503, detail=error)
 
         if error:
             raise HTTPException(status_code=400, detail=error)
         
-        return JSONResponse(content={"saldo": saldo}, status_code=200)
+        return _respons_saldo(saldo)
 
     except HTTPException as http_exc:
-        return JSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
 
     except Exception as e:
-        return JSONResponse(content={"remark": str(e)}, status_code=400)
+        return ORJSONResponse(content={"remark": str(e)}, status_code=500)
 
 
-@router.post("/tarik", dependencies=[Depends(JWTBearer())])
-async def tarik(data: Tarik, db: Session = Depends(get_db)):
-    """Endpoint untuk menabung ke rekening nasabah."""
+@router.post("/tarik", response_model=SaldoResponse)
+async def tarik(
+    data: Tarik,
+    db: AsyncSession = Depends(get_db),
+    claims: dict = Depends(JWTBearer()),
+    idempotency_key: Optional[str] = Header(None, max_length=200)
+):
+    """Endpoint untuk menarik dana dari rekening nasabah."""
+    return await idempotency.jalankan(
+        idempotency_key, claims, "/tarik", data, lambda: _tarik(data, db), session=db, respons=_respons_saldo
+    )
+
+async def _tarik(data: Tarik, db: AsyncSession):
+    """Menjalankan crud.tarik dan menyusun responsnya."""
     try:
-        saldo, error = crud.tarik(data, db)  # Pastikan memanggil fungsi crud.tabung()
+        saldo, error = await crud.tarik(data, db)  # Pastikan memanggil fungsi crud.tabung()
+
+        if error == crud.KESALAHAN_DATABASE:
+            raise HTTPException(status_code=503, detail=error)
 
         if error:
             raise HTTPException(status_code=400, detail=error)
         
-        return JSONResponse(content={"saldo": saldo}, status_code=200)
+        return _respons_saldo(saldo)
 
     except HTTPException as http_exc:
-        return JSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
 
     except Exception as e:
-        return JSONResponse(content={"remark": str(e)}, status_code=400)
+        return ORJSONResponse(content={"remark": str(e)}, status_code=500)
 
-@router.post("/transfer", dependencies=[Depends(JWTBearer())])
-async def transfer(data: Transfer, db: Session = Depends(get_db)):
-    """Endpoint untuk menabung ke rekening nasabah."""
+@router.post("/transfer", response_model=TransferResponse)
+async def transfer(
+    data: Transfer,
+    db: AsyncSession = Depends(get_db),
+    claims: dict = Depends(JWTBearer()),
+    idempotency_key: Optional[str] = Header(None, max_length=200)
+):
+    """Endpoint untuk mentransfer dana antar rekening."""
+    return await idempotency.jalankan(
+        idempotency_key, claims, "/transfer", data, lambda: _transfer(data, db), session=db, respons=_respons_transfer
+    )
+
+async def _transfer(data: Transfer, db: AsyncSession):
+    """Menjalankan crud.transfer dan menyusun responsnya."""
     try:
-        saldo, error = crud.transfer(data, db)  # Pastikan memanggil fungsi crud.tabung()
+        saldo, error = await crud.transfer(data, db)  # Pastikan memanggil fungsi crud.tabung()
+
+        if error == crud.KESALAHAN_DATABASE:
+            raise HTTPException(status_code=503, detail=error)
 
         if error:
             raise HTTPException(status_code=400, detail=error)
         
-        return JSONResponse(content={"saldo": saldo}, status_code=200)
+        return _respons_transfer(saldo)
 
     except HTTPException as http_exc:
-        return JSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
 
     except Exception as e:
-        return JSONResponse(content={"remark": str(e)}, status_code=400)
+        return ORJSONResponse(content={"remark": str(e)}, status_code=500)
 
-@router.get("/ceksaldo", dependencies=[Depends(JWTBearer())])
-async def ceksaldo(no_rekening: str, db: Session = Depends(get_db)):
+@router.post("/batch", dependencies=[Depends(JWTBearer())])
+async def batch(data: Batch, db: AsyncSession = Depends(get_db)):
+    """Endpoint untuk menjalankan banyak tabung/tarik/transfer dalam satu transaksi."""
+    try:
+        hasil, error = await crud.batch(data, db)
+
+        if error == crud.KESALAHAN_DATABASE:
+            return ORJSONResponse(content={"remark": error}, status_code=503)
+
+        if error:
+            # Hasil per operasi tetap dikembalikan agar klien tahu operasi mana yang gagal
+            return ORJSONResponse(content={"remark": error, "hasil": hasil}, status_code=400)
+
+        return ORJSONResponse(content={"hasil": hasil}, status_code=200)
+
+    except Exception as e:
+        return ORJSONResponse(content={"remark": str(e)}, status_code=500)
+
+@router.get("/ceksaldo", response_model=SaldoResponse, dependencies=[Depends(JWTBearer())])
+async def ceksaldo(no_rekening: str, db: AsyncSession = Depends(get_read_db)):
     """Endpoint untuk mengecek saldo rekening nasabah."""
     try:
-        # Query nasabah based on no_rekening
-        nasabah = db.query(Nasabah).filter(Nasabah.no_rekening == no_rekening).first()
+        # Saldo dibaca dari cache bila ada, selain itu dari database
+        saldo, error = await crud.ceksaldo(no_rekening, db)
 
-        if not nasabah:
+        if error == crud.REKENING_TIDAK_DIKENALI:
             # Account not found
-            raise HTTPException(status_code=404, detail="No Rekening tidak dikenali")
+            raise HTTPException(status_code=404, detail=error)
+
+        if error:
+            raise HTTPException(status_code=500, detail=error)
 
         # Return the balance
-        return JSONResponse(content={"saldo": nasabah.saldo}, status_code=200)
+        return model_response(SaldoResponse, {"saldo": saldo})
 
     except HTTPException as http_exc:
-        return JSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
 
     except Exception as e:
         # Handle unexpected errors
-        return JSONResponse(content={"remark": str(e)}, status_code=500)
+        return ORJSONResponse(content={"remark": str(e)}, status_code=500)
 
-@router.get("/cekmutasi", dependencies=[Depends(JWTBearer())])
-async def mutasi(no_rekening: str, db: Session = Depends(get_db)):
+@router.get("/cekmutasi", response_model=HalamanMutasi, dependencies=[Depends(JWTBearer())])
+async def mutasi(
+    no_rekening: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    dari: Optional[datetime] = None,
+    sampai: Optional[datetime] = None,
+    jenis_transaksi: Optional[Literal["kredit", "debit"]] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
     """Endpoint untuk mengecek mutasi berdasarkan nomor rekening."""
     try:
-        mutasi_list, error = crud.cek_mutasi(no_rekening, db)
+        if stream:
+            # Seluruh riwayat dialirkan sebagai NDJSON tanpa dimuat ke memori sekaligus
+            return StreamingResponse(
+                _stream_mutasi(no_rekening, dari, sampai, jenis_transaksi),
+                media_type="application/x-ndjson"
+            )
+
+        halaman, error = await crud.cek_mutasi(no_rekening, db, limit, cursor, dari, sampai, jenis_transaksi)
+
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+
+        return model_response(HalamanMutasi, halaman)
+
+    except HTTPException as http_exc:
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+
+    except Exception as e:
+        return ORJSONResponse(content={"remark": str(e)}, status_code=400)
+
+@router.get("/ringkasan", response_model=RingkasanResponse, dependencies=[Depends(JWTBearer())])
+async def ringkasan(no_rekening: str, dari: date, sampai: date, db: AsyncSession = Depends(get_read_db)):
+    """Endpoint untuk ringkasan kredit/debit harian dalam rentang tanggal."""
+    try:
+        if dari > sampai:
+            raise HTTPException(status_code=400, detail="Tanggal dari tidak boleh setelah tanggal sampai")
+
+        hasil, error = await crud.ringkasan(no_rekening, dari, sampai, db)
 
         if error:
             raise HTTPException(status_code=400, detail=error)
 
-        return JSONResponse(content={"mutasi": mutasi_list}, status_code=200)
+        return model_response(RingkasanResponse, hasil)
 
     except HTTPException as http_exc:
-        return JSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
+        return ORJSONResponse(content={"remark": http_exc.detail}, status_code=http_exc.status_code)
 
     except Exception as e:
-        return JSONResponse(content={"remark": str(e)}, status_code=400)
+        return ORJSONResponse(content={"remark": str(e)}, status_code=400)
+
+async def _stream_mutasi(no_rekening: str, dari: Optional[datetime], sampai: Optional[datetime], jenis_transaksi: Optional[str]):
+    # Session dibuka di dalam generator karena dependency get_db sudah ditutup
+    # sebelum body StreamingResponse selesai dikirim
+    async with ReadSessionLocal() as db:
+        async for line in crud.stream_mutasi(no_rekening, db, dari, sampai, jenis_transaksi):
+            yield line
+
+@router.get("/export/mutasi", dependencies=[Depends(BackOfficeKey())])
+async def export_mutasi(
+    no_rekening: List[str] = Query(..., min_length=1, max_length=1000),
+    dari: Optional[datetime] = None,
+    sampai: Optional[datetime] = None,
+    format: Literal["csv", "parquet"] = "csv"
+):
+    """Endpoint back-office untuk mengunduh seluruh mutasi beberapa rekening sebagai CSV atau Parquet."""
+    return StreamingResponse(
+        _stream_ekspor(format, no_rekening, dari, sampai),
+        media_type=ekspor.MEDIA_TYPE[format],
+        headers={"Content-Disposition": f'attachment; filename="mutasi.{format}"'}
+    )
+
+async def _stream_ekspor(format: str, no_rekening: List[str], dari: Optional[datetime], sampai: Optional[datetime]):
+    # Sama seperti _stream_mutasi: session dibuka di dalam generator
+    async with ReadSessionLocal() as db:
+        async for chunk in ekspor.EKSPORTIR[format](db, no_rekening, dari, sampai):
+            yield chunk
+
+@router.get("/metrics")
+async def metrics():
+    """Endpoint metrik dalam format teks Prometheus."""
+    engines = {"primary": async_engine}
+    if read_async_engine is not async_engine:
+        engines["replica"] = read_async_engine
+    pools = {name: pool_stats(engine) for name, engine in engines.items()}
+    cache_stats = balance_cache.stats()
+    token_stats = revokasi.stats()
+    outbox_stats = outbox.stats()
+    velocity_stats = velocity.stats()
+
+    gauges = {
+        "db_pool_checked_out": ("gauge", "Koneksi yang sedang dipakai.", [({"pool": name}, stats.get("checked_out", 0)) for name, stats in pools.items()]),
+        "db_pool_overflow": ("gauge", "Koneksi overflow di atas pool_size.", [({"pool": name}, stats.get("overflow", 0)) for name, stats in pools.items()]),
+        "db_pool_checkout_wait_seconds_total": ("counter", "Total waktu menunggu koneksi.", [({"pool": name}, stats.get("checkout_wait_seconds_total", 0)) for name, stats in pools.items()]),
+        "db_pool_timeouts_total": ("counter", "Jumlah timeout menunggu koneksi.", [({"pool": name}, stats.get("timeout_count", 0)) for name, stats in pools.items()]),
+        "balance_cache_hits_total": ("counter", "Cache hit saldo.", [({}, cache_stats["hits"])]),
+        "balance_cache_misses_total": ("counter", "Cache miss saldo.", [({}, cache_stats["misses"])]),
+        # rate(auth_tokens_issued_total{via="refresh"}[1h]) * 3600 = verifikasi bcrypt yang dihemat per jam
+        "auth_tokens_issued_total": ("counter", "Pasangan token yang diterbitkan, per jalur.", [({"via": via}, token_stats[via]) for via in ("login", "refresh")]),
+        "auth_refresh_reuse_total": ("counter", "Refresh token yang ditolak karena dipakai ulang.", [({}, token_stats["reuse"])]),
+        "outbox_events_published_total": ("counter", "Event outbox yang sudah dikirim ke sink.", [({}, outbox_stats["terkirim"])]),
+        "outbox_publish_errors_total": ("counter", "Batch outbox yang gagal dikirim.", [({}, outbox_stats["gagal"])]),
+        # Rata-rata lag = rate(outbox_lag_seconds_total) / rate(outbox_events_published_total)
+        "outbox_lag_seconds_total": ("counter", "Jumlah lag (commit sampai terkirim) semua event.", [({}, outbox_stats["lag_total"])]),
+        "outbox_last_lag_seconds": ("gauge", "Lag event tertua pada batch terakhir.", [({}, outbox_stats["lag_terakhir"])]),
+        "outbox_last_publish_timestamp_seconds": ("gauge", "Waktu batch terakhir terkirim.", [({}, outbox_stats["terkirim_at"])]),
+        "rate_limit_rejected_total": ("counter", "Request yang ditolak rate limiter.", [({"route": route, "alasan": alasan}, jumlah) for (route, alasan), jumlah in ratelimit.stats().items()]),
+        "velocity_rejected_total": ("counter", "Debit yang ditolak limit velocity, per jendela.", [({"jendela": jendela}, jumlah) for jendela, jumlah in velocity_stats["ditolak"].items()]),
+        "velocity_loads_total": ("counter", "Penghitung velocity yang dibaca dari database.", [({}, velocity_stats["dimuat"])]),
+        "velocity_accounts": ("gauge", "Rekening dengan penghitung velocity di memori worker ini.", [({}, velocity_stats["rekening"])])
+    }
+    return PlainTextResponse(content=render_prometheus(gauges), media_type="text/plain; version=0.0.4")
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Annotated, List, Literal, Optional, Union
+from pydantic import BaseModel, Field, PlainSerializer
 
 class user(BaseModel):
     nik: str = "1234567890"
@@ -8,22 +11,90 @@ class user(BaseModel):
     password: str = "apis123"
 
 class UserLogin(BaseModel):
-    username: str
+    username: str  # Email, No HP, atau No Rekening
     password: str
     
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class UserInDB(BaseModel):
     username: str
     hashed_password: str
 
 class Tabung(BaseModel):
     no_rekening: str
-    nominal: float
+    nominal: Decimal = Field(decimal_places=2)  # Rupiah, maksimal 2 angka di belakang koma
 
 class Tarik(BaseModel):
     no_rekening: str
-    nominal: float
+    nominal: Decimal = Field(decimal_places=2)  # Rupiah, maksimal 2 angka di belakang koma
 
 class Transfer(BaseModel):
     no_rekening_pengirim: str
     no_rekening_penerima: str
-    nominal: float
+    nominal: Decimal = Field(decimal_places=2)  # Rupiah, maksimal 2 angka di belakang koma
+
+class OperasiTabung(Tabung):
+    jenis: Literal["tabung"]
+
+class OperasiTarik(Tarik):
+    jenis: Literal["tarik"]
+
+class OperasiTransfer(Transfer):
+    jenis: Literal["transfer"]
+
+class Batch(BaseModel):
+    operasi: List[Annotated[Union[OperasiTabung, OperasiTarik, OperasiTransfer], Field(discriminator="jenis")]] = Field(min_length=1, max_length=10000)
+    # True: semua operasi dibatalkan jika ada yang gagal; False: operasi yang valid tetap diterapkan
+    atomik: bool = True
+
+
+# Nominal rupiah di respons tetap dikirim sebagai angka JSON seperti sebelumnya
+Rupiah = Annotated[Decimal, PlainSerializer(float, return_type=float, when_used="json")]
+
+class DaftarResponse(BaseModel):
+    no_rekening: str
+
+class TokenResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+
+class SaldoResponse(BaseModel):
+    saldo: Rupiah
+
+class SaldoTransfer(BaseModel):
+    saldo_pengirim: Rupiah
+    saldo_penerima: Rupiah
+
+class TransferResponse(BaseModel):
+    saldo: SaldoTransfer
+
+class MutasiResponse(BaseModel):
+    id: int
+    no_rekening: str
+    jenis_transaksi: str
+    tanggal_transaksi: Optional[datetime]
+    nominal: Rupiah
+    saldo: Rupiah
+    keterangan: Optional[str]
+
+class HalamanMutasi(BaseModel):
+    mutasi: List[MutasiResponse]
+    next_cursor: Optional[str]
+
+class RingkasanHarian(BaseModel):
+    tanggal: date
+    total_kredit: Rupiah
+    total_debit: Rupiah
+    jumlah_transaksi: int
+    saldo_penutupan: Rupiah
+
+class RingkasanResponse(BaseModel):
+    no_rekening: str
+    saldo_awal: Rupiah
+    saldo_akhir: Rupiah
+    total_kredit: Rupiah
+    total_debit: Rupiah
+    jumlah_transaksi: int
+    harian: List[RingkasanHarian]
@@ -0,0 +1,68 @@
+import argparse
+import logging
+import os
+from decouple import config
+
+SERVER_HOST = config("HOST", default="0.0.0.0")
+SERVER_PORT = config("PORT", default=8000, cast=int)
+# Jumlah proses worker; default satu per core
+WEB_CONCURRENCY = config("WEB_CONCURRENCY", default=os.cpu_count() or 1, cast=int)
+GUNICORN_WORKER_CLASS = config("GUNICORN_WORKER_CLASS", default="uvicorn.workers.UvicornWorker")
+GUNICORN_TIMEOUT = config("GUNICORN_TIMEOUT", default=60, cast=int)  # detik
+GUNICORN_GRACEFUL_TIMEOUT = config("GUNICORN_GRACEFUL_TIMEOUT", default=30, cast=int)  # detik
+
+
+def setelah_fork(server=None, worker=None) -> None:
+    """Hook post_fork gunicorn: koneksi pool yang terbuka di master (jika ada) dilepas tanpa
+    ditutup, agar socket yang sama tidak dipakai bersama oleh beberapa worker."""
+    from config import engine, async_engine, read_async_engine
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    if read_async_engine is not async_engine:
+        read_async_engine.sync_engine.dispose(close=False)
+
+
+def jalankan(workers: int = WEB_CONCURRENCY, host: str = SERVER_HOST, port: int = SERVER_PORT) -> None:
+    """Menjalankan aplikasi dengan gunicorn: aplikasi di-import sekali oleh master (preload)
+    lalu di-fork ke setiap worker. Tanpa gunicorn, dipakai uvicorn multi-worker biasa."""
+    if workers > 1 and config("BALANCE_CACHE_BACKEND", default="memory") == "memory":
+        # Cache di memori tiap worker akan menyajikan saldo basi setelah worker lain menulis;
+        # dengan beberapa worker hanya backend bersama (redis) yang aman
+        logging.warning("BALANCE_CACHE_BACKEND=memory tidak koheren untuk %s worker; cache saldo dimatikan", workers)
+        os.environ["BALANCE_CACHE_BACKEND"] = "none"
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        import uvicorn
+        logging.warning("gunicorn tidak terpasang; memakai uvicorn tanpa preload")
+        uvicorn.run("main:app", host=host, port=port, workers=workers)
+        return
+
+    class Aplikasi(BaseApplication):
+        def load_config(self):
+            pengaturan = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": GUNICORN_WORKER_CLASS,
+                "preload_app": True,
+                "post_fork": setelah_fork,
+                "timeout": GUNICORN_TIMEOUT,
+                "graceful_timeout": GUNICORN_GRACEFUL_TIMEOUT
+            }
+            for nama, nilai in pengaturan.items():
+                self.cfg.set(nama, nilai)
+
+        def load(self):
+            from main import app
+            return app
+
+    Aplikasi().run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server aplikasi bank")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    args = parser.parse_args()
+    jalankan(args.workers, args.host, args.port)
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Modul aplikasi membaca konfigurasi saat di-import, jadi environment diisi sebelum test
+# di-collect. Test menghapus dan membuat ulang tabel: pakai TEST_DATABASE_URL (database
+# sekali pakai), bukan DATABASE_URL aplikasi. Default-nya file SQLite sementara.
+_url = os.environ.get("TEST_DATABASE_URL")
+if not _url:
+    _url = f"sqlite:///{Path(tempfile.mkdtemp(prefix='test-bank-')) / 'test.db'}"
+os.environ["DATABASE_URL"] = _url
+if _url.startswith("sqlite://"):
+    os.environ["ASYNC_DATABASE_URL"] = _url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+else:
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+@pytest.fixture
+def db():
+    """Skema kosong untuk satu test."""
+    from config import engine, async_engine
+    import model
+    model.Base.metadata.drop_all(bind=engine)
+    model.Base.metadata.create_all(bind=engine)
+    yield engine
+    # Koneksi async dibuat di event loop milik test; ditutup agar tidak tertinggal antar test
+    asyncio.run(async_engine.dispose())
@@ -0,0 +1,30 @@
+"""Pipeline log audit: record terakhir tetap ditulis walau tidak ada record baru sesudahnya."""
+import logging
+import queue
+import time
+import audit
+
+
+class _Tampung(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_flush_berkala_saat_antrean_sepi():
+    target = _Tampung()
+    handler = audit.BatchingHandler(100, 0.05, target)
+    log_queue = queue.SimpleQueue()
+    listener = audit.BatchingQueueListener(log_queue, handler, flush_interval=0.05)
+    listener.start()
+    try:
+        log_queue.put(logging.makeLogRecord({"msg": "tabung", "levelno": logging.INFO}))
+        batas = time.monotonic() + 2
+        while not target.records and time.monotonic() < batas:
+            time.sleep(0.01)
+        assert [r.msg for r in target.records] == ["tabung"]
+    finally:
+        listener.stop()
@@ -0,0 +1,41 @@
+"""Cache saldo: abstraksi backend, backend tanpa cache, dan bacaan replica yang tidak di-cache."""
+import asyncio
+import pytest
+import cache
+import crud
+from config import AsyncSessionLocal
+from model import Nasabah
+
+
+def test_backend_wajib_lengkap():
+    with pytest.raises(TypeError):
+        cache.BalanceCache()
+
+
+def test_backend_none(monkeypatch):
+    monkeypatch.setattr(cache, "BALANCE_CACHE_BACKEND", "none")
+    backend = cache.create_balance_cache()
+    assert isinstance(backend, cache.NullBalanceCache)
+
+    async def skenario():
+        await backend.set("1", 100)
+        return await backend.get("1")
+    assert asyncio.run(skenario()) is None
+    assert backend.stats()["misses"] == 1
+
+
+def test_bacaan_replica_tidak_mengisi_cache(db, monkeypatch):
+    backend = cache.LRUBalanceCache()
+    monkeypatch.setattr(crud, "balance_cache", backend)
+
+    async def skenario():
+        async with AsyncSessionLocal() as session:
+            session.add(Nasabah(nama="apis", nik="1", email="a@mail.com", no_hp="08", password="x", no_rekening="1130000001", saldo=500))
+            await session.commit()
+        async with AsyncSessionLocal(info={"replica": True}) as session:
+            assert await crud.ceksaldo("1130000001", session) == (5, None)
+        assert await backend.get("1130000001") is None
+        async with AsyncSessionLocal() as session:
+            await crud.ceksaldo("1130000001", session)
+        assert await backend.get("1130000001") == 500
+    asyncio.run(skenario())
@@ -0,0 +1,36 @@
+"""Ekspor massal mutasi hanya untuk back-office, bukan untuk token nasabah."""
+import asyncio
+import httpx
+import main
+from auth import auth_bearer
+
+
+async def _ekspor(*daftar_headers: dict) -> list:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        no_rekening = (await client.post("/daftar", json={})).json()["no_rekening"]
+        token = (await client.post("/login", json={"username": "apis@mail.com", "password": "apis123"})).json()["access_token"]
+        await client.post("/tabung", json={"no_rekening": no_rekening, "nominal": "1000"}, headers={"Authorization": f"Bearer {token}"})
+        return [
+            await client.get("/export/mutasi", params={"no_rekening": no_rekening}, headers={k: v.format(token=token) for k, v in headers.items()})
+            for headers in daftar_headers
+        ]
+
+
+def test_token_nasabah_ditolak(db, monkeypatch):
+    monkeypatch.setattr(auth_bearer, "BACKOFFICE_API_KEY", "rahasia-backoffice")
+    [r] = asyncio.run(_ekspor({"Authorization": "Bearer {token}"}))
+    assert r.status_code == 403
+
+
+def test_nonaktif_tanpa_kunci(db, monkeypatch):
+    monkeypatch.setattr(auth_bearer, "BACKOFFICE_API_KEY", "")
+    [r] = asyncio.run(_ekspor({"X-Backoffice-Key": ""}))
+    assert r.status_code == 403
+
+
+def test_kunci_backoffice(db, monkeypatch):
+    monkeypatch.setattr(auth_bearer, "BACKOFFICE_API_KEY", "rahasia-backoffice")
+    salah, benar = asyncio.run(_ekspor({"X-Backoffice-Key": "salah"}, {"X-Backoffice-Key": "rahasia-backoffice"}))
+    assert salah.status_code == 403
+    assert benar.status_code == 200
+    assert benar.text.count("\n") == 2  # header CSV dan satu mutasi
@@ -0,0 +1,82 @@
+"""Idempotency-Key: error database boleh diulang, transaksi yang sudah di-commit tidak pernah diulang."""
+import asyncio
+import httpx
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+import crud
+import main
+from model import Mutasi, Nasabah
+
+
+async def _siapkan(client: httpx.AsyncClient):
+    no_rekening = (await client.post("/daftar", json={})).json()["no_rekening"]
+    token = (await client.post("/login", json={"username": "apis@mail.com", "password": "apis123"})).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    await client.post("/tabung", json={"no_rekening": no_rekening, "nominal": "1000"}, headers=headers)
+    return no_rekening, headers
+
+
+def test_error_database_tidak_disimpan(db, monkeypatch):
+    async def skenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            no_rekening, headers = await _siapkan(client)
+            headers = {**headers, "Idempotency-Key": "tarik-1"}
+            catat_mutasi = crud._catat_mutasi
+
+            async def gagal(session, rows):
+                raise OperationalError("INSERT INTO mutasi", None, Exception("disk I/O error"))
+
+            monkeypatch.setattr(crud, "_catat_mutasi", gagal)
+            r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "100"}, headers=headers)
+            assert r.status_code == 503
+            # Detail error database hanya di log, bukan di respons
+            assert "disk I/O" not in r.text
+
+            # Key dilepas, jadi request ulang dengan key yang sama benar-benar dijalankan
+            monkeypatch.setattr(crud, "_catat_mutasi", catat_mutasi)
+            r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "100"}, headers=headers)
+            assert r.status_code == 200, r.text
+            assert "Idempotent-Replayed" not in r.headers
+            assert r.json()["saldo"] == 900
+    asyncio.run(skenario())
+
+
+def test_respons_tersimpan_bersama_transaksi(db, monkeypatch):
+    async def skenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            no_rekening, headers = await _siapkan(client)
+            idem = {**headers, "Idempotency-Key": "tarik-2"}
+
+            # Request gagal setelah transaksi di-commit (mis. worker berhenti sebelum membalas)
+            async def gagal(no, saldo):
+                raise RuntimeError("worker berhenti")
+
+            monkeypatch.setattr(crud.balance_cache, "set", gagal)
+            r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "100"}, headers=idem)
+            assert r.status_code == 500
+            monkeypatch.undo()
+
+            # Request ulang mendapat respons transaksi pertama, saldo hanya terpotong sekali
+            r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "100"}, headers=idem)
+            assert r.status_code == 200, r.text
+            assert r.headers["Idempotent-Replayed"] == "true"
+            assert r.json()["saldo"] == 900
+            return no_rekening
+    no_rekening = asyncio.run(skenario())
+    with db.connect() as conn:
+        saldo = conn.execute(select(Nasabah.saldo).where(Nasabah.no_rekening == no_rekening)).scalar_one()
+        jumlah_tarik = conn.execute(select(func.count()).select_from(Mutasi).where(Mutasi.keterangan == "Tarik")).scalar_one()
+    assert (saldo, jumlah_tarik) == (90000, 1)
+
+
+def test_penolakan_tetap_direplay(db):
+    async def skenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            no_rekening, headers = await _siapkan(client)
+            idem = {**headers, "Idempotency-Key": "tarik-3"}
+            r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "5000"}, headers=idem)
+            assert r.status_code == 400
+            r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "5000"}, headers=idem)
+            assert r.status_code == 400
+            assert r.headers["Idempotent-Replayed"] == "true"
+    asyncio.run(skenario())
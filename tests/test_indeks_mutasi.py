@@ -0,0 +1,59 @@
+"""Index keyset mutasi pada tabel lama yang dibuat sebelum index ada di model. Hanya untuk Postgres."""
+import pytest
+from sqlalchemy import text
+from config import engine
+import manage
+import partisi
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != "postgresql", reason="CREATE INDEX CONCURRENTLY khusus Postgres")
+
+
+def _indeks(conn):
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = 'ix_mutasi_no_rekening_tanggal_id'"
+    )).scalar_one_or_none()
+
+
+def _tabel_lama(db):
+    with db.begin() as conn:
+        conn.execute(text("DROP INDEX ix_mutasi_no_rekening_tanggal_id"))
+
+
+def test_indeks_mutasi_pada_tabel_lama(db):
+    _tabel_lama(db)
+    manage.indeks_mutasi()
+    with db.connect() as conn:
+        assert _indeks(conn) is True
+    # Dijalankan ulang tidak mengubah apa pun
+    manage.indeks_mutasi()
+
+
+def test_indeks_tidak_valid_dibuat_ulang(db):
+    with db.begin() as conn:
+        conn.execute(text(
+            "UPDATE pg_index SET indisvalid = false WHERE indexrelid = 'ix_mutasi_no_rekening_tanggal_id'::regclass"
+        ))
+        assert _indeks(conn) is False
+    manage.indeks_mutasi()
+    with db.connect() as conn:
+        assert _indeks(conn) is True
+
+
+def test_partisi_tabel_lama_tanpa_indeks(db):
+    _tabel_lama(db)
+    partisi.migrasi_partisi(engine, bulan_ke_depan=1)
+    with db.connect() as conn:
+        assert partisi.is_partitioned(conn)
+        assert _indeks(conn) is not None
+    # Mutasi baru masuk ke partisi bulan berjalan
+    with db.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO nasabah (nama, nik, email, no_hp, password, no_rekening, saldo) "
+            "VALUES ('apis', '1', 'a@mail.com', '08', 'x', '1130000001', 100)"
+        ))
+        conn.execute(text(
+            "INSERT INTO mutasi (no_rekening, jenis_transaksi, tanggal_transaksi, nominal, saldo) "
+            "VALUES ('1130000001', 'kredit', now(), 100, 100)"
+        ))
+        assert conn.execute(text("SELECT count(*) FROM mutasi")).scalar_one() == 1
@@ -0,0 +1,25 @@
+"""Login dengan email, no_hp, atau no_rekening (format baru 16 digit maupun format lama 11 digit)."""
+import asyncio
+import httpx
+import main
+from auth.auth_handler import get_password_hash
+from config import AsyncSessionLocal
+from model import Nasabah
+
+
+def test_login_no_rekening_lama(db):
+    async def skenario():
+        async with AsyncSessionLocal() as session:
+            session.add(Nasabah(
+                nama="lama", nik="9", email="lama@mail.com", no_hp="08129", no_rekening="11312345678",
+                password=get_password_hash("rahasia"), saldo=0
+            ))
+            await session.commit()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            no_rekening = (await client.post("/daftar", json={})).json()["no_rekening"]
+            for username, password in (
+                ("11312345678", "rahasia"), ("08129", "rahasia"), ("LAMA@mail.com", "rahasia"), (no_rekening, "apis123")
+            ):
+                r = await client.post("/login", json={"username": username, "password": password})
+                assert r.status_code == 200, (username, r.text)
+    asyncio.run(skenario())
@@ -0,0 +1,72 @@
+"""Migrasi saldo Float ke sen (manage.py migrasi-saldo) tidak boleh kehilangan perubahan saldo
+yang ditulis aplikasi lama selama backfill berjalan. Hanya untuk Postgres."""
+import pytest
+from sqlalchemy import text
+from config import engine
+import manage
+import model
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != "postgresql", reason="migrasi-saldo khusus Postgres")
+
+
+def _skema_lama(conn) -> None:
+    model.Base.metadata.drop_all(bind=conn)
+    conn.execute(text("DROP TABLE IF EXISTS mutasi, nasabah CASCADE"))
+    conn.execute(text("""
+        CREATE TABLE nasabah (
+            id SERIAL PRIMARY KEY, no_rekening VARCHAR(16) UNIQUE NOT NULL,
+            saldo DOUBLE PRECISION NOT NULL DEFAULT 0
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE mutasi (
+            id SERIAL PRIMARY KEY, no_rekening VARCHAR(16) NOT NULL REFERENCES nasabah (no_rekening),
+            jenis_transaksi VARCHAR(50) NOT NULL, tanggal_transaksi TIMESTAMP NOT NULL,
+            saldo DOUBLE PRECISION NOT NULL
+        )
+    """))
+
+
+def test_perubahan_saldo_selama_backfill_ikut_termigrasi(monkeypatch):
+    with engine.begin() as conn:
+        _skema_lama(conn)
+        for i in range(1, 51):
+            conn.execute(text("INSERT INTO nasabah (no_rekening, saldo) VALUES (:no, :saldo)"), {"no": f"R{i}", "saldo": i * 1000.10})
+            conn.execute(
+                text("INSERT INTO mutasi (no_rekening, jenis_transaksi, tanggal_transaksi, saldo) VALUES (:no, 'kredit', now(), :saldo)"),
+                {"no": f"R{i}", "saldo": i * 1000.10}
+            )
+
+    backfill_asli = manage._backfill
+
+    def backfill_lalu_aplikasi_lama_menulis(sql, table, batch_size):
+        backfill_asli(sql, table, batch_size)
+        if table == "nasabah":
+            # Aplikasi lama mengubah saldo rekening yang sudah tersalin dan menulis mutasi baru
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE nasabah SET saldo = saldo - 500.05 WHERE no_rekening IN ('R1', 'R20')"))
+                conn.execute(text("""
+                    INSERT INTO mutasi (no_rekening, jenis_transaksi, tanggal_transaksi, saldo)
+                    SELECT no_rekening, 'debit', now(), saldo FROM nasabah WHERE no_rekening IN ('R1', 'R20')
+                """))
+
+    monkeypatch.setattr(manage, "_backfill", backfill_lalu_aplikasi_lama_menulis)
+    manage.migrasi_saldo(batch_size=7)
+
+    with engine.connect() as conn:
+        selisih = conn.execute(text(
+            "SELECT no_rekening FROM nasabah WHERE saldo <> ROUND(saldo_float_lama::numeric * 100)"
+        )).scalars().all()
+        assert selisih == []
+        assert conn.execute(text("SELECT saldo FROM nasabah WHERE no_rekening = 'R1'")).scalar_one() == 50005
+        total_lama, total_baru = conn.execute(text(
+            "SELECT SUM(ROUND(saldo_float_lama::numeric * 100)), SUM(saldo) FROM nasabah"
+        )).one()
+        assert total_lama == total_baru
+        # Nominal mutasi susulan dihitung dari selisih dengan mutasi sebelumnya
+        assert conn.execute(text(
+            "SELECT nominal FROM mutasi WHERE no_rekening = 'R1' AND jenis_transaksi = 'debit'"
+        )).scalar_one() == 50005
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE mutasi, nasabah CASCADE"))
@@ -0,0 +1,29 @@
+"""Pool hashing password per proses: worker hasil fork (gunicorn preload) tidak memakai
+ProcessPoolExecutor milik master."""
+import asyncio
+import os
+import pytest
+from auth import auth_handler
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="membutuhkan os.fork")
+
+
+def test_pool_proses_dibuat_ulang_setelah_fork(monkeypatch):
+    monkeypatch.setattr(auth_handler, "PASSWORD_POOL_KIND", "process")
+    monkeypatch.setattr(auth_handler, "_password_pid", None)
+    hash_master = asyncio.run(auth_handler.get_password_hash_async("rahasia"))
+    executor_master = auth_handler._password_executor
+
+    pid = os.fork()
+    if pid == 0:
+        kode = 1
+        try:
+            hasil = asyncio.run(asyncio.wait_for(auth_handler.verify_and_update_password_async("rahasia", hash_master), 20))
+            if hasil[0] and auth_handler._password_executor is not executor_master:
+                kode = 0
+        finally:
+            os._exit(kode)
+    _, status = os.waitpid(pid, 0)
+    executor_master.shutdown()
+    monkeypatch.setattr(auth_handler, "_password_pid", None)
+    assert os.waitstatus_to_exitcode(status) == 0
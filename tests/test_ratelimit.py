@@ -0,0 +1,45 @@
+"""Batas per pengguna di RateLimitMiddleware hanya dibebankan pada access token yang valid."""
+import asyncio
+import httpx
+import main
+from ratelimit import MemoryStore, RateLimitMiddleware
+
+
+async def _daftar_dan_login(client, nomor: int) -> tuple:
+    data = {"nik": f"32{nomor:014d}", "nama": f"nasabah{nomor}", "email": f"n{nomor}@mail.com", "no_hp": f"0812{nomor:08d}", "password": "rahasia"}
+    no_rekening = (await client.post("/daftar", json=data)).json()["no_rekening"]
+    token = (await client.post("/login", json={"username": data["email"], "password": "rahasia"})).json()["access_token"]
+    await client.post("/tabung", json={"no_rekening": no_rekening, "nominal": "1000"}, headers={"Authorization": f"Bearer {token}"})
+    return no_rekening, {"Authorization": f"Bearer {token}"}
+
+
+def test_request_tanpa_token_tidak_menghabiskan_kuota_korban(db):
+    async def skenario():
+        app = RateLimitMiddleware(main.app, MemoryStore())
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            no_rekening, headers = await _daftar_dan_login(client, 1)
+            # Penyerang tanpa token memakai no_rekening korban melebihi burst per pengguna
+            for _ in range(15):
+                r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "1"})
+                assert r.status_code == 403
+            r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "1"}, headers=headers)
+            assert r.status_code == 200, r.text
+
+            # Kuota pengguna sendiri tetap dibatasi
+            status = [(await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "1"}, headers=headers)).status_code for _ in range(15)]
+            assert 429 in status
+    asyncio.run(skenario())
+
+
+def test_kuota_terpisah_per_pengguna(db):
+    async def skenario():
+        app = RateLimitMiddleware(main.app, MemoryStore())
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            rek_a, headers_a = await _daftar_dan_login(client, 1)
+            rek_b, headers_b = await _daftar_dan_login(client, 2)
+            # Pengguna A menghabiskan kuotanya pada rekening B; B tetap bisa bertransaksi
+            for _ in range(25):
+                await client.get("/ceksaldo", params={"no_rekening": rek_b}, headers=headers_a)
+            assert (await client.get("/ceksaldo", params={"no_rekening": rek_a}, headers=headers_a)).status_code == 429
+            assert (await client.get("/ceksaldo", params={"no_rekening": rek_b}, headers=headers_b)).status_code == 200
+    asyncio.run(skenario())
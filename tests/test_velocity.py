@@ -0,0 +1,73 @@
+"""Limit velocity tetap tepat saat debit tersebar di beberapa worker (penghitung per proses)."""
+import asyncio
+from collections import OrderedDict
+import httpx
+import main
+import velocity
+from config import AsyncSessionLocal
+from model import LimitRekening
+
+
+def test_limit_berlaku_lintas_worker(db, monkeypatch):
+    worker_a, worker_b = OrderedDict(), OrderedDict()
+
+    async def skenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            no_rekening = (await client.post("/daftar", json={})).json()["no_rekening"]
+            token = (await client.post("/login", json={"username": "apis@mail.com", "password": "apis123"})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            await client.post("/tabung", json={"no_rekening": no_rekening, "nominal": "1000"}, headers=headers)
+            async with AsyncSessionLocal() as session:
+                session.add(LimitRekening(no_rekening=no_rekening, jendela="jam", maks_jumlah=3))
+                await session.commit()
+
+            async def tarik(worker: OrderedDict) -> int:
+                # Setiap worker hanya punya penghitung di memorinya sendiri
+                monkeypatch.setattr(velocity, "_penghitung", worker)
+                r = await client.post("/tarik", json={"no_rekening": no_rekening, "nominal": "1"}, headers=headers)
+                return r.status_code
+
+            assert await tarik(worker_a) == 200
+            assert await tarik(worker_a) == 200
+            assert await tarik(worker_b) == 200
+            dimuat = velocity.stats()["dimuat"]
+            # Worker A belum melihat debit dari worker B: versinya beda sehingga dimuat ulang
+            assert await tarik(worker_a) == 400
+            assert await tarik(worker_b) == 400
+            assert velocity.stats()["dimuat"] == dimuat + 1
+    asyncio.run(skenario())
+
+
+def test_batch_dan_transfer_terhitung_di_worker_lain(db, monkeypatch):
+    worker_a, worker_b = OrderedDict(), OrderedDict()
+
+    async def skenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            rek_a = (await client.post("/daftar", json={})).json()["no_rekening"]
+            rek_b = (await client.post("/daftar", json={"nik": "2", "nama": "budi", "email": "b@mail.com", "no_hp": "0812", "password": "pw"})).json()["no_rekening"]
+            token = (await client.post("/login", json={"username": "apis@mail.com", "password": "apis123"})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            await client.post("/tabung", json={"no_rekening": rek_a, "nominal": "1000"}, headers=headers)
+            async with AsyncSessionLocal() as session:
+                session.add(LimitRekening(no_rekening=rek_a, jendela="harian", maks_nominal=10_000))  # Rp 100
+                await session.commit()
+
+            monkeypatch.setattr(velocity, "_penghitung", worker_a)
+            r = await client.post("/transfer", json={"no_rekening_pengirim": rek_a, "no_rekening_penerima": rek_b, "nominal": "40"}, headers=headers)
+            assert r.status_code == 200, r.text
+
+            monkeypatch.setattr(velocity, "_penghitung", worker_b)
+            r = await client.post("/batch", json={"operasi": [
+                {"jenis": "tarik", "no_rekening": rek_a, "nominal": "30"},
+                {"jenis": "transfer", "no_rekening_pengirim": rek_a, "no_rekening_penerima": rek_b, "nominal": "20"}
+            ]}, headers=headers)
+            assert r.status_code == 200, r.text
+
+            # Worker A sudah punya penghitung (Rp 40) tetapi harus melihat Rp 50 dari batch di worker B
+            monkeypatch.setattr(velocity, "_penghitung", worker_a)
+            r = await client.post("/tarik", json={"no_rekening": rek_a, "nominal": "20"}, headers=headers)
+            assert r.status_code == 400
+            assert r.json()["remark"] == "Melebihi limit transaksi harian"
+            r = await client.post("/tarik", json={"no_rekening": rek_a, "nominal": "10"}, headers=headers)
+            assert r.status_code == 200, r.text
+    asyncio.run(skenario())
@@ -0,0 +1,232 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple, Optional
+from decouple import config
+from sqlalchemy import select
+from model import Mutasi, LimitRekening
+from money import ke_sen
+
+# Limit velocity (jumlah nominal dan transaksi debit per jendela geser) untuk tarik dan transfer
+VELOCITY_LIMIT = config("VELOCITY_LIMIT", default=True, cast=bool)
+# Lebar slot penghitung; jendela bisa mencakup hingga satu slot lebih lama (lebih ketat, tidak lebih longgar)
+VELOCITY_RESOLUSI = config("VELOCITY_RESOLUSI", default=60, cast=int)  # detik
+# Penghitung di memori tiap worker diberi versi nasabah.jumlah_debit. Baris rekening sudah
+# terkunci saat limit diperiksa, jadi jika versinya berbeda (worker lain sempat mendebit)
+# penghitung dibangun ulang dari mutasi dan hasilnya tetap tepat berapa pun jumlah worker.
+# Umur ini hanya agar perubahan limit_rekening ikut terbaca
+VELOCITY_MUAT_ULANG = config("VELOCITY_MUAT_ULANG", default=300, cast=int)  # detik
+VELOCITY_MAX_REKENING = config("VELOCITY_MAX_REKENING", default=200_000, cast=int)
+# Limit default dalam rupiah; 0 berarti tanpa limit. Limit per rekening disimpan di tabel limit_rekening
+VELOCITY_JAM_NOMINAL = config("VELOCITY_JAM_NOMINAL", default="25000000", cast=Decimal)
+VELOCITY_JAM_JUMLAH = config("VELOCITY_JAM_JUMLAH", default=30, cast=int)
+VELOCITY_HARIAN_NOMINAL = config("VELOCITY_HARIAN_NOMINAL", default="100000000", cast=Decimal)
+VELOCITY_HARIAN_JUMLAH = config("VELOCITY_HARIAN_JUMLAH", default=100, cast=int)
+
+# Jumlah maksimum no_rekening per query saat memuat penghitung
+VELOCITY_MUAT_CHUNK = 5000
+
+
+class Jendela(NamedTuple):
+    nama: str
+    detik: int
+    maks_nominal: Optional[int]  # Dalam sen; None berarti tanpa limit
+    maks_jumlah: Optional[int]
+
+
+JENDELA = (
+    Jendela("jam", 3600, ke_sen(VELOCITY_JAM_NOMINAL) or None, VELOCITY_JAM_JUMLAH or None),
+    Jendela("harian", 86400, ke_sen(VELOCITY_HARIAN_NOMINAL) or None, VELOCITY_HARIAN_JUMLAH or None),
+)
+
+# Penolakan per jendela dan jumlah pemuatan dari database, untuk /metrics
+_stats = {"ditolak": dict.fromkeys((j.nama for j in JENDELA), 0), "dimuat": 0}
+
+# Penghitung per no_rekening, LRU dengan batas VELOCITY_MAX_REKENING
+_penghitung = OrderedDict()
+
+
+def stats() -> dict:
+    return {"ditolak": dict(_stats["ditolak"]), "dimuat": _stats["dimuat"], "rekening": len(_penghitung)}
+
+
+class Penghitung:
+    """Total nominal dan jumlah debit satu rekening per jendela geser.
+
+    Slot ``VELOCITY_RESOLUSI`` detik disimpan sekali untuk semua jendela dalam tiga
+    array (slot, nominal, jumlah); tiap jendela hanya mencatat indeks slot tertua
+    yang masih masuk beserta totalnya. Slot yang keluar jendela dikurangkan dari
+    total saat diakses, sehingga pemeriksaan limit O(1) (diamortisasi) berapa pun
+    jumlah transaksinya, dengan memori kecil per rekening.
+    """
+
+    __slots__ = ("jendela", "slot", "slot_nominal", "slot_jumlah", "awal", "nominal", "jumlah", "dimuat_at", "versi")
+
+    def __init__(self, jendela: tuple, versi: int = 0):
+        self.jendela = jendela
+        self.versi = versi  # nasabah.jumlah_debit yang sudah tercakup, termasuk reservasi
+        self.slot = array("q")
+        self.slot_nominal = array("q")
+        self.slot_jumlah = array("q")
+        self.awal = [0] * len(jendela)
+        self.nominal = [0] * len(jendela)
+        self.jumlah = [0] * len(jendela)
+        self.dimuat_at = time.monotonic()
+
+    def _geser(self, slot: int) -> None:
+        n = len(self.slot)
+        for i, jendela in enumerate(self.jendela):
+            batas = slot - jendela.detik // VELOCITY_RESOLUSI
+            a = self.awal[i]
+            while a < n and self.slot[a] <= batas:
+                self.nominal[i] -= self.slot_nominal[a]
+                self.jumlah[i] -= self.slot_jumlah[a]
+                a += 1
+            self.awal[i] = a
+        # Slot yang sudah keluar dari semua jendela dibuang begitu mencapai separuh array
+        m = min(self.awal)
+        if m and m * 2 >= n:
+            del self.slot[:m], self.slot_nominal[:m], self.slot_jumlah[:m]
+            self.awal = [a - m for a in self.awal]
+
+    def tambah(self, slot: int, nominal: int) -> None:
+        """Mencatat satu debit; slot harus tidak lebih lama dari slot terakhir yang dicatat."""
+        if self.slot and self.slot[-1] == slot:
+            self.slot_nominal[-1] += nominal
+            self.slot_jumlah[-1] += 1
+        else:
+            self.slot.append(slot)
+            self.slot_nominal.append(nominal)
+            self.slot_jumlah.append(1)
+        for i in range(len(self.jendela)):
+            self.nominal[i] += nominal
+            self.jumlah[i] += 1
+
+    def kurangi(self, slot: int, nominal: int) -> None:
+        # Slot reservasi hampir selalu yang terakhir; yang sudah dibuang diabaikan
+        for j in range(len(self.slot) - 1, -1, -1):
+            if self.slot[j] == slot:
+                self.slot_nominal[j] -= nominal
+                self.slot_jumlah[j] -= 1
+                for i, a in enumerate(self.awal):
+                    if a <= j:
+                        self.nominal[i] -= nominal
+                        self.jumlah[i] -= 1
+                return
+            if self.slot[j] < slot:
+                return
+
+    def periksa(self, nominal: int, slot: int) -> Optional[Jendela]:
+        """Jendela pertama yang terlampaui jika debit ini ditambahkan, atau None."""
+        self._geser(slot)
+        for i, jendela in enumerate(self.jendela):
+            if jendela.maks_nominal is not None and self.nominal[i] + nominal > jendela.maks_nominal:
+                return jendela
+            if jendela.maks_jumlah is not None and self.jumlah[i] + 1 > jendela.maks_jumlah:
+                return jendela
+        return None
+
+
+def _jendela_rekening(limit: dict) -> tuple:
+    """Jendela default dengan limit per rekening (nilai NULL memakai default) diterapkan."""
+    if not limit:
+        return JENDELA
+    return tuple(
+        j._replace(
+            maks_nominal=limit[j.nama].maks_nominal if limit[j.nama].maks_nominal is not None else j.maks_nominal,
+            maks_jumlah=limit[j.nama].maks_jumlah if limit[j.nama].maks_jumlah is not None else j.maks_jumlah
+        ) if j.nama in limit else j
+        for j in JENDELA
+    )
+
+
+def _pasang(no_rekening: str, penghitung: Penghitung) -> None:
+    _penghitung[no_rekening] = penghitung
+    _penghitung.move_to_end(no_rekening)
+    if len(_penghitung) > VELOCITY_MAX_REKENING:
+        _penghitung.popitem(last=False)
+
+
+async def _muat_dari_db(session, versi: dict) -> dict:
+    """Membangun penghitung dari debit di jendela terpanjang (index no_rekening, tanggal_transaksi)."""
+    nomor_rekening = list(versi)
+    jendela_terpanjang = max(j.detik for j in JENDELA)
+    sejak = datetime.fromtimestamp((time.time() // VELOCITY_RESOLUSI * VELOCITY_RESOLUSI) - jendela_terpanjang)
+
+    limit = {}
+    result = await session.execute(select(LimitRekening).where(LimitRekening.no_rekening.in_(nomor_rekening)))
+    for baris in result.scalars():
+        limit.setdefault(baris.no_rekening, {})[baris.jendela] = baris
+
+    hasil = {no: Penghitung(_jendela_rekening(limit.get(no)), versi[no]) for no in nomor_rekening}
+    result = await session.execute(
+        select(Mutasi.no_rekening, Mutasi.tanggal_transaksi, Mutasi.nominal)
+        .where(
+            Mutasi.no_rekening.in_(nomor_rekening),
+            Mutasi.jenis_transaksi == "debit",
+            Mutasi.tanggal_transaksi >= sejak
+        )
+        .order_by(Mutasi.no_rekening, Mutasi.tanggal_transaksi)
+    )
+    for no_rekening, tanggal_transaksi, nominal in result:
+        hasil[no_rekening].tambah(int(tanggal_transaksi.timestamp() // VELOCITY_RESOLUSI), nominal)
+    _stats["dimuat"] += len(nomor_rekening)
+    return hasil
+
+
+async def muat(session, versi: dict) -> dict:
+    """Penghitung untuk rekening yang didebit, dari ``{no_rekening: jumlah_debit}`` yang dibaca
+    dari baris nasabah yang sudah terkunci di transaksi ini (sebelum diubah).
+
+    Penghitung di memori dipakai langsung jika versinya sama; jika belum ada, versinya beda,
+    atau sudah lebih lama dari VELOCITY_MUAT_ULANG, penghitung dibangun ulang dari database.
+    """
+    if not VELOCITY_LIMIT:
+        return {}
+    sekarang = time.monotonic()
+    hasil, kurang = {}, {}
+    for no, jumlah_debit in versi.items():
+        penghitung = _penghitung.get(no)
+        if penghitung is None or penghitung.versi != jumlah_debit or sekarang - penghitung.dimuat_at > VELOCITY_MUAT_ULANG:
+            kurang[no] = jumlah_debit
+        else:
+            _penghitung.move_to_end(no)
+            hasil[no] = penghitung
+
+    nomor = list(kurang)
+    for start in range(0, len(nomor), VELOCITY_MUAT_CHUNK):
+        dimuat = await _muat_dari_db(session, {no: kurang[no] for no in nomor[start:start + VELOCITY_MUAT_CHUNK]})
+        for no, penghitung in dimuat.items():
+            _pasang(no, penghitung)
+            hasil[no] = penghitung
+    return hasil
+
+
+def cadangkan(penghitung: dict, no_rekening: str, nominal: int, reservasi: list) -> Optional[str]:
+    """Memeriksa limit lalu langsung mencatat debit (tanpa await di antaranya, jadi atomik
+    per worker). Mengembalikan pesan error, atau None dan menambah ``reservasi``."""
+    entri = penghitung.get(no_rekening)
+    if entri is None:
+        return None
+    slot = int(time.time() // VELOCITY_RESOLUSI)
+    jendela = entri.periksa(nominal, slot)
+    if jendela is not None:
+        _stats["ditolak"][jendela.nama] = _stats["ditolak"].get(jendela.nama, 0) + 1
+        logging.warning("Limit transaksi %s terlampaui: No Rekening=%s, Nominal (sen)=%s", jendela.nama, no_rekening, nominal)
+        return f"Melebihi limit transaksi {jendela.nama}"
+    entri.tambah(slot, nominal)
+    # Setiap debit menaikkan nasabah.jumlah_debit satu kali di transaksi yang sama
+    entri.versi += 1
+    reservasi.append((entri, slot, nominal))
+    return None
+
+
+def batalkan(reservasi: list) -> None:
+    """Melepas reservasi transaksi yang tidak jadi di-commit."""
+    for entri, slot, nominal in reservasi:
+        entri.kurangi(slot, nominal)
+        entri.versi -= 1
+    reservasi.clear()